@@ -1,31 +1,79 @@
 import os
-import shutil
+import json
+import queue
+import threading
+import time
+import uuid
 from datetime import timedelta
-import linkrot
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, session, send_from_directory, after_this_request
-from linkrot.downloader import sanitize_url, get_status_code
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flask import Flask, render_template, request, session, send_from_directory, after_this_request, url_for, abort
+from linkrot.downloader import sanitize_url
+from linkcheck import get_status_code, check_urls
+from statuscache import cache_stats
 from celery_init import celery_init_app
-from tasks import pdfdata_task
+from tasks import pdfdata_task, build_download_archive, analyse_pdf
+from tasks import RESULT_TYPE, RESULT_URL, reference_outline
 from celery.result import AsyncResult
-from flask import Response, request
+from celery import states
+from flask import Response, request, g
 from datetime import datetime
 from urllib.parse import urljoin
 import utilites
-import requests
+import progress
+import refindex
+import localjobs
+import workspace
+import httpclient
+import resultcodec
+import redisreport
+import metrics
+import queues
+import events
+import pagecache
+import redis
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = utilites.get_tmp_folder()  # '/tmp/'
 app.secret_key = os.environ.get('APP_SECRET_KEY')
+# Reverse proxies in front of the app, each adding one X-Forwarded-For hop;
+# the client address is the hop added by the outermost of them
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 broker = os.environ['REDIS_URL']  # "redis://localhost"
 backend = os.environ['REDIS_URL']
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=60)
+# Requests past the upload limit plus room for the form fields are cut off
+# by Werkzeug before the multipart body is buffered
+app.config['MAX_CONTENT_LENGTH'] = utilites.MAX_UPLOAD_SIZE + 64 * 1024
+# Seconds before the task of a worker that died is handed to another one,
+# longer than any task runs so running tasks are not handed out twice
+TASK_VISIBILITY_TIMEOUT = int(os.environ.get('TASK_VISIBILITY_TIMEOUT', 1800))
 app.config['CELERY'] = dict(
     broker_url=broker,
     result_backend=backend,
     task_ignore_result=False,
+    result_serializer=resultcodec.RESULT_SERIALIZER,
+    result_accept_content=['json', resultcodec.SERIALIZER],
+    result_expires=utilites.RESULT_EXPIRES,
+    task_queues=queues.task_queues(),
+    task_default_queue=queues.DEFAULT_QUEUE,
+    task_routes=queues.TASK_ROUTES,
+    # a worker holds only the task it runs, the rest stay queued in order
+    worker_prefetch_multiplier=1,
+    # tasks are acknowledged once they finished, so the task of a worker
+    # killed or recycled midway is run again; they are idempotent, see
+    # progress for the checkpoints of the link checks
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    broker_transport_options={'visibility_timeout': TASK_VISIBILITY_TIMEOUT},
+    beat_schedule={
+        'redis-report': {'task': 'tasks.report_redis_memory',
+                         'schedule': redisreport.REDIS_REPORT_INTERVAL},
+    },
 )
 app.config['CAPTCHA_KEY_ID'] = os.environ.get('CAPTCHA_KEY_ID')
 app.config['CAPTCHA_SECRET_KEY'] = os.environ.get('CAPTCHA_SECRET_KEY')
@@ -37,6 +85,48 @@ app.config['CAPTCHA_DISPLAY'] = "block" if app.config['ENV'] == "PROD" else "non
 
 ALLOWED_EXTENSIONS = set(['pdf'])
 MAX_THREADS_DEFAULT = 30
+# Seconds an analysis can be reused for an identical upload, kept below the
+# Celery result expiry so a reused id never points at a purged result
+ANALYSIS_REUSE_TTL = int(os.environ.get('ANALYSIS_REUSE_TTL',
+                                        utilites.RESULT_EXPIRES * 23 // 24))
+# Site the sitemap lists when requested under a host not trusted
+SITE_URL = os.environ.get('SITE_URL', 'https://rottingresearch.org')
+# Most urls one /check/batch request may ask for
+CHECK_BATCH_MAX = int(os.environ.get('CHECK_BATCH_MAX', 500))
+
+REQUEST_SECONDS = metrics.Histogram(
+    'rr_request_seconds', 'Seconds to answer requests, by endpoint')
+REQUESTS = metrics.Counter(
+    'rr_requests_total', 'Requests answered, by endpoint and status code')
+UPLOAD_BYTES = metrics.Histogram(
+    'rr_upload_bytes', 'Size of accepted PDF uploads', metrics.SIZE_BUCKETS)
+UPLOADS = metrics.Counter(
+    'rr_uploads_total', 'PDF uploads, by outcome')
+# Endpoints left out of the request metrics
+UNTIMED_ENDPOINTS = ('static', 'metrics_endpoint')
+STARTED_AT = datetime.now()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    """
+    Time and count the request. Streamed responses are timed up to the
+    start of the body.
+    """
+    endpoint = request.endpoint or 'unknown'
+    if endpoint not in UNTIMED_ENDPOINTS and 'request_started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started,
+                                endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+app.after_request(pagecache.compress)
 
 
 def allowed_file(filename):
@@ -44,21 +134,29 @@ def allowed_file(filename):
 
 
 @app.route('/', methods=['GET'])
+@pagecache.cached(vary=lambda: (app.config['CAPTCHA_KEY_ID'],
+                                app.config['CAPTCHA_DISPLAY']))
 def upload_form():
     captcha_key = app.config['CAPTCHA_KEY_ID']
     captcha_display = app.config['CAPTCHA_DISPLAY']
     return render_template('upload.html', captcha=captcha_key, captcha_display=captcha_display, flash='')
 
 @app.route('/sitemap.xml', methods=['GET'])
+@pagecache.cached(vary=pagecache.trusted_host)
 def sitemap_xml():
     #app.logger.debug("↳ sitemap_xml() fired")    # Debug log
     """
     Generates an XML sitemap dynamically based on all accessible GET routes.
-    Only includes routes that do not require parameters.
+    Only includes routes that do not require parameters. The pages change
+    with a deploy, so lastmod is the start of this process. The urls are
+    on the requested host only when it is trusted, on SITE_URL otherwise.
     """
     pages = []
-    lastmod = datetime.now().date().isoformat()
-    base_url = request.host_url.rstrip('/')
+    lastmod = STARTED_AT.date().isoformat()
+    if pagecache.trusted_host():
+        base_url = request.host_url.rstrip('/')
+    else:
+        base_url = SITE_URL
     # Loop through all routes in the app
     for rule in app.url_map.iter_rules():
         # Include only GET routes without arguments (i.e., static routes)
@@ -87,6 +185,7 @@ def security_txt():
     )
 
 @app.route("/robots.txt")
+@pagecache.cached()
 def robots_txt():
     robots_path = os.path.join(BASE_DIR, "static", "robots.txt")
     with open(robots_path, "r", encoding="utf-8") as f:
@@ -127,42 +226,57 @@ def not_found(e):
 # defining function 
     return render_template("404.html"),404 
 
+@app.errorhandler(413)
+def upload_too_large(e):
+    UPLOADS.inc(outcome='size')
+    return render_template('upload.html', captcha=app.config['CAPTCHA_KEY_ID'],
+                           captcha_display=app.config['CAPTCHA_DISPLAY'],
+                           flash='size'), 413
+
 @app.route('/about', methods=['GET'])
+@pagecache.cached()
 def about():
     return render_template('about.html')
 
 
 @app.route('/projects')
+@pagecache.cached()
 def projects():
     return render_template('projects.html')
 
 
 @app.route('/best-practices')
+@pagecache.cached()
 def practices():
     return render_template('practices.html')
 
 
 @app.route('/research')
+@pagecache.cached()
 def research():
     return render_template('research.html')
 
 
 @app.route('/story')
+@pagecache.cached()
 def story():
     return render_template('story.html')
 
 
 @app.route('/policies')
+@pagecache.cached()
 def policies():
     return render_template('policies.html')
 
 
 @app.route('/contact')
+@pagecache.cached()
 def contact():
     return render_template('contact.html')
 
 
 @app.route('/contribute')
+@pagecache.cached()
 def contribute():
     return render_template('contribute.html')
 
@@ -183,11 +297,24 @@ def upload_pdf():
         isCaptchaValid = validateCaptcha(request.form['g-recaptcha-response'])
         if isCaptchaValid:
             filename = secure_filename(file.filename)
-            path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            try:
+                job_dir = workspace.create(app.config['UPLOAD_FOLDER'])
+            except workspace.QuotaExceeded:
+                UPLOADS.inc(outcome='busy')
+                return render_template('upload.html', captcha=captcha_key, captcha_display=captcha_display, flash='busy'), 503
+            path = os.path.join(job_dir, filename)
             session['file'] = filename.split('.')[0]
             session['type'] = 'file'
-            file.save(path)
-            metadata, pdfs, urls, arxiv, doi, task_id = pdfdata(path)
+            try:
+                digest = utilites.save_upload(file, path)
+            except utilites.UploadRejected as e:
+                workspace.remove(job_dir)
+                UPLOADS.inc(outcome=e.reason)
+                return render_template('upload.html', captcha=captcha_key, captcha_display=captcha_display, flash=e.reason), 400
+            UPLOADS.inc(outcome='accepted')
+            UPLOAD_BYTES.observe(os.path.getsize(path))
+            workspace.add_bytes(job_dir, os.path.getsize(path))
+            metadata, pdfs, urls, arxiv, doi, task_id = pdfdata(path, digest)
             return render_template('analysis.html',
                                    meta_titles=list(metadata.keys()),
                                    meta_values=list(metadata.values()),
@@ -203,57 +330,263 @@ def upload_pdf():
         return render_template('upload.html', captcha=captcha_key, captcha_display=captcha_display, flash='pdf')
 
 
-def pdfdata(path):
+def pdfdata(path, digest=None):
     metadata = dict()
     pdfs, urls, arxiv, doi = (list(), list(), list(), list())
     session['path'] = path
-    task_id = pdfdata_task.delay(path)
+    task_id = start_analysis(path, digest, submitter())
+    session['task_id'] = str(task_id)
     return metadata, pdfs, urls, arxiv, doi, task_id
 
 
+def job_result(id):
+    """ Result of a Celery job, or of an in-process job in that mode """
+    if localjobs.enabled():
+        return localjobs.LocalResult(id)
+    return AsyncResult(id)
+
+
+def submitter():
+    """
+    Fair share identity of the client: its address as seen by the
+    trusted proxies, never a hop the client could have written itself
+    """
+    address = request.remote_addr
+    return queues.submitter_id(address) if address else None
+
+
+def start_analysis(path, digest=None, submitter=None):
+    """
+    Start pdfdata_task for the upload, or reuse the analysis of an
+    identical upload (same content digest) that finished or is still
+    running. The digest is claimed with SET NX so concurrent uploads of
+    the same file attach to a single task. In the in-process mode the
+    analysis runs on the local job pool instead. submitter gets a fair
+    share of the link check workers, see queues.
+    """
+    task_id = str(uuid.uuid4())
+    if digest:
+        key = 'analysis:pdf:' + digest
+        try:
+            r = utilites.get_redis()
+            for _ in range(2):
+                if r.set(key, task_id, nx=True, ex=ANALYSIS_REUSE_TTL):
+                    break
+                existing = r.get(key)
+                if existing is None:
+                    continue
+                result = job_result(existing.decode())
+                if result.state not in (states.FAILURE, states.REVOKED):
+                    return result
+                r.delete(key)
+        except redis.RedisError:
+            pass
+    if localjobs.enabled():
+        return localjobs.apply_async(analyse_pdf, (path, task_id), task_id)
+    return pdfdata_task.apply_async((path,), dict(submitter=submitter),
+                                    task_id=task_id)
+
+
 @app.route('/downloadpdf', methods=['GET', 'POST'])
 def downloadpdf():
-    @ after_this_request
+    """
+    Start building the reference PDF archive in a Celery job. The client
+    polls /downloadpdf/<id> and fetches the zip once it is ready.
+    """
+    analysis = job_result(session['task_id']) if 'task_id' in session else None
+    if analysis is None or not analysis.successful():
+        return {"ready": False, "error": "analysis not finished"}, 409
+
+    index = refindex.load(session['task_id'])
+    if index is None:
+        # index expired or Redis was unavailable, fall back to the result
+        result = analysis.result
+        index = {'metadata': result['metadata'],
+                 'references': [['pdf', row[RESULT_URL], row[RESULT_URL], 0]
+                                for row in result['result_data']
+                                if row[RESULT_TYPE] == 'pdf']}
+
+    download_id = str(uuid.uuid4())
+    # the archive lives in the workspace of the upload and expires with it
+    archive_path = os.path.join(os.path.dirname(session['path']),
+                                download_id + '.zip')
+    args = (session['path'], refindex.pdf_urls(index), archive_path, index)
+    if localjobs.enabled():
+        localjobs.apply_async(build_download_archive, args, download_id)
+    else:
+        build_download_archive.apply_async(args, task_id=download_id)
+    session['download_id'] = download_id
+    return {"task_id": download_id,
+            "status": url_for('download_status', id=download_id)}, 202
+
+
+@app.route('/downloadpdf/<id>')
+def download_status(id: str) -> dict[str, object]:
+    if session.get('download_id') != id:
+        abort(404)
+    result = job_result(id)
+    response = {
+        "ready": result.ready(),
+        "successful": result.successful(),
+    }
+    if result.successful():
+        response["value"] = result.result
+        response["archive"] = url_for('download_archive', id=id)
+    return response
+
+
+@app.route('/downloadpdf/<id>/archive')
+def download_archive(id: str):
+    if session.get('download_id') != id or not job_result(id).successful():
+        abort(404)
+
+    job_dir = os.path.dirname(session['path'])
+
+    @after_this_request
     def remove_file(response):
-        os.remove(os.path.join(
-            app.config['UPLOAD_FOLDER'], session['file']+'.zip'))
+        # the archive is already open for sending
+        workspace.remove(job_dir)
         return response
-        
-    download_folder_path = os.path.join(
-        app.config['UPLOAD_FOLDER'], session['file'])
-    os.mkdir(download_folder_path)
-    linkrot.linkrot(session['path']).download_pdfs(download_folder_path)
-    shutil.make_archive(
-        os.path.join(app.config['UPLOAD_FOLDER'], session['file']), 'zip', download_folder_path)
-    if session['type'] == 'file':
-        os.remove(session['path'])
-    shutil.rmtree(download_folder_path)
-    return send_from_directory(app.config['UPLOAD_FOLDER'], session['file']+'.zip', as_attachment=True)
+
+    return send_from_directory(job_dir, id + '.zip',
+                               as_attachment=True,
+                               download_name=session['file'] + '.zip')
 
 
 @app.route('/check')
 def check():
     args = request.args
     url = sanitize_url(args['url'])
-    status = get_status_code(url)
+    if args.get('recheck'):
+        status = get_status_code(url, recheck=True)
+    else:
+        status = get_status_code(url)
     return str(status)
 
 
+@app.route('/check/batch', methods=['POST'])
+def check_batch():
+    """
+    Check a JSON body {"urls": [...], "recheck": false} concurrently through
+    the status cache, with the global and per-host limits of check_urls.
+    One JSON line {"index", "url", "status"} is streamed per url as soon as
+    its check finishes.
+    """
+    payload = request.get_json(silent=True)
+    urls = payload.get('urls') if isinstance(payload, dict) else None
+    if (not isinstance(urls, list) or
+            not all(isinstance(url, str) and url for url in urls)):
+        return {"error": "expected a JSON list of urls"}, 400
+    if len(urls) > CHECK_BATCH_MAX:
+        return {"error": "at most %d urls per batch" % CHECK_BATCH_MAX}, 413
+
+    urls = [sanitize_url(url) for url in urls]
+    recheck = bool(payload.get('recheck'))
+    results = queue.Queue()
+
+    def check(url):
+        return get_status_code(url, recheck=True) if recheck else get_status_code(url)
+
+    def run():
+        try:
+            check_urls(urls, check,
+                       on_result=lambda index, status: results.put((index, status)))
+        finally:
+            results.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def generate():
+        for index, status in iter(results.get, None):
+            yield json.dumps({"index": index, "url": urls[index],
+                              "status": str(status)}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/check/stats')
+def check_stats():
+    return cache_stats()
+
+
+@app.route('/jobs/stats')
+def jobs_stats():
+    return localjobs.stats()
+
+
+@app.route('/workspace/stats')
+def workspace_stats():
+    return workspace.stats(app.config['UPLOAD_FOLDER'])
+
+
+@app.route('/redis/stats')
+def redis_stats():
+    """ The Redis report of the last beat run, never a scan per request """
+    return redisreport.latest()
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+def result_response(id, since=None, outline=False):
+    """
+    State of job id read once from the backend, plus the references
+    checked after the first since ones when since is given. They are read
+    after the state so a ready result never misses its last items. With
+    outline, an unfinished job also returns its extracted metadata and
+    references (see reference_outline), None while they are extracted.
+    """
+    result = job_result(id)
+    state = result.state
+    response = {
+        "ready": state in states.READY_STATES,
+        "successful": state == states.SUCCESS,
+        "value": result.result if state == states.SUCCESS else None,
+    }
+    if outline and not response["ready"]:
+        response["outline"] = reference_outline(id)
+    if since is not None:
+        items = progress.read(id, max(since, 0))
+        response["items"] = items
+        response["next"] = max(since, 0) + len(items)
+    return response
+
+
 @app.route("/result/<id>")
 def task_result(id: str) -> dict[str, object]:
-    result = AsyncResult(id)
-    return {
-        "ready": result.ready(),
-        "successful": result.successful(),
-        "value": result.result if (result.ready() and result.result) else None,
-    }
+    return result_response(id, request.args.get('since', type=int),
+                           request.args.get('outline', type=int) == 1)
+
+
+@app.route("/result/<id>/events")
+def task_events(id: str):
+    """
+    Server-sent events of the analysis, see events.stream. 204 tells the
+    browser to stop reconnecting and poll /result instead.
+    """
+    if not events.RESULT_EVENTS:
+        return '', 204
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+    return Response(events.stream(id, max(since, 0),
+                                  lambda cursor: result_response(id, cursor),
+                                  lambda: reference_outline(id)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
 
 def validateCaptcha(response: str):
     if app.config['ENV'] == "DEV":
         return True
     
-    res = requests.post(
-        'https://www.google.com/recaptcha/api/siteverify?secret='+app.config['CAPTCHA_SECRET_KEY']+'&response='+response).json()
+    res = httpclient.get_session().post(
+        'https://www.google.com/recaptcha/api/siteverify',
+        data={'secret': app.config['CAPTCHA_SECRET_KEY'], 'response': response},
+        timeout=httpclient.TIMEOUT).json()
     
     return res['success']
 
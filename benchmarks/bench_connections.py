@@ -0,0 +1,75 @@
+'''
+file: benchmarks/bench_connections.py
+description: Connections opened per analysed paper with and without pooling
+
+Checks the references of one synthetic paper against the local stub
+server, once with a fresh urllib connection per request as the checker
+used to do and once over the pooled keep-alive client, and reports how
+many TCP connections the stub accepted for each.
+
+    python benchmarks/bench_connections.py --refs 300 --hosts 5 --delay 0.01
+'''
+
+import argparse
+import os
+import sys
+import time
+from urllib.request import Request, urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpclient  # noqa: E402
+from linkcheck import check_urls  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+
+def unpooled_status(url):
+    ''' The checker before pooling: one connection per HEAD request '''
+    request = Request(url, method='HEAD')
+    with urlopen(request, timeout=httpclient.HTTP_READ_TIMEOUT) as response:
+        return response.getcode()
+
+
+def pooled_status(url):
+    return httpclient.head_or_get(url).status_code
+
+
+def paper_urls(base_url, refs, hosts):
+    port = base_url.rsplit(':', 1)[1]
+    # every 127.x.y.z address reaches the stub on loopback
+    return ['http://127.0.0.%d:%s/ref/%d' % (i % hosts + 1, port, i)
+            for i in range(refs)]
+
+
+def run(server, urls, check):
+    httpclient._session = None
+    server.connections = server.requests = 0
+    start = time.perf_counter()
+    statuses = check_urls(urls, check)
+    elapsed = time.perf_counter() - start
+    assert statuses == ['200'] * len(urls), set(statuses)
+    return server.connections, server.requests, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--refs', type=int, default=300)
+    parser.add_argument('--hosts', type=int, default=5)
+    parser.add_argument('--delay', type=float, default=0.01,
+                        help='stub latency per request in seconds')
+    args = parser.parse_args()
+
+    with StubServer(delay=args.delay) as server:
+        urls = paper_urls(server.base_url, args.refs, args.hosts)
+        print('%d refs over %d hosts, %.3fs latency'
+              % (args.refs, args.hosts, args.delay))
+        for name, check in (('urllib', unpooled_status),
+                            ('pooled', pooled_status)):
+            connections, requests, elapsed = run(server, urls, check)
+            print('%-6s %5d connections  %5d requests  %.2f conn/ref  %.2fs'
+                  % (name, connections, requests, connections / len(urls),
+                     elapsed))
+
+
+if __name__ == '__main__':
+    main()
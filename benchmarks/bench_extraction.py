@@ -0,0 +1,99 @@
+'''
+file: benchmarks/bench_extraction.py
+description: Reference extraction seconds by page count, whole document versus page ranges
+
+Writes synthetic papers (see synthetic.py) of each page count, with
+--refs-per-page references per page and a --links share of them also
+linked, then extracts their references three ways: linkrot on the whole
+document as documents up to EXTRACT_SPLIT_PAGES pages are read, the page
+ranges of extraction.py read one after the other and merged, and the
+same ranges on a pool of --processes processes as the in-process mode
+reads larger documents. The extract_pages Celery tasks parallelise like
+the pool, over the worker slots instead of processes. Every way must find
+the references linkrot finds, else the benchmark exits with status 1.
+
+The speedup of the serial ranges comes from the merge, which checks each
+text url against the links before it in one pass where linkrot compares
+it with each of them. The pool adds a speedup up to the number of cores,
+once the pages outweigh starting the processes.
+
+    python benchmarks/bench_extraction.py --pages 50,200,600 --processes 4
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import linkrot  # noqa: E402
+import extraction  # noqa: E402
+import synthetic  # noqa: E402
+
+BASE_URL = 'http://127.0.0.1:8000'
+
+
+def found(metadata, refs):
+    return metadata, sorted((ref.reftype, ref.ref, ref.page) for ref in refs)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    return time.perf_counter() - start, value
+
+
+def whole_document(path):
+    pdf = linkrot.linkrot(path)
+    return pdf.get_metadata(), pdf.get_references()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--pages', default='50,200,600',
+                        help='comma separated page counts')
+    parser.add_argument('--refs-per-page', type=int, default=8)
+    parser.add_argument('--links', type=float, default=0.5,
+                        help='share of references that are also links')
+    parser.add_argument('--range-pages', type=int,
+                        default=extraction.EXTRACT_RANGE_PAGES)
+    parser.add_argument('--processes', type=int,
+                        default=extraction.EXTRACT_PROCESSES)
+    args = parser.parse_args()
+    extraction.EXTRACT_RANGE_PAGES = args.range_pages
+
+    print('%d references per page, %d%% linked, %d pages per range, '
+          '%d processes on %d cores'
+          % (args.refs_per_page, args.links * 100, args.range_pages,
+             args.processes, os.cpu_count() or 1))
+    print('%8s %8s %10s %10s %10s %9s %9s' % (
+        'pages', 'refs', 'linkrot s', 'ranges s', 'pool s', 'ranges x',
+        'pool x'))
+    mismatches = []
+    with tempfile.TemporaryDirectory() as folder:
+        for pages in [int(count) for count in args.pages.split(',')]:
+            path = os.path.join(folder, '%d.pdf' % pages)
+            with open(path, 'wb') as f:
+                f.write(synthetic.make_pdf(
+                    BASE_URL, pages * args.refs_per_page, paper=pages,
+                    lines_per_page=args.refs_per_page, links=args.links))
+            whole, expected = timed(whole_document, path)
+            serial, ranges = timed(extraction.extract, path, processes=1)
+            pooled, pool = timed(extraction.extract, path,
+                                 processes=args.processes)
+            for name, value in (('ranges', ranges), ('pool', pool)):
+                if found(*value) != found(*expected):
+                    mismatches.append('%d pages: %s' % (pages, name))
+            print('%8d %8d %10.2f %10.2f %10.2f %9.1f %9.1f'
+                  % (pages, len(expected[1]), whole, serial, pooled,
+                     whole / serial, whole / pooled))
+    for line in mismatches:
+        print('different references: ' + line)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+file: benchmarks/bench_linkcheck.py
+description: References per second for the per-reference and batch engines
+
+Both engines run the full pdfdata_task chord on an in-process Celery
+worker with an in-memory broker, checking references served by the local
+stub server.
+
+    python benchmarks/bench_linkcheck.py --refs 300 --hosts 5 --delay 0.05
+'''
+
+import argparse
+import os
+import sys
+import time
+from unittest.mock import Mock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from celery import Celery  # noqa: E402
+from celery.contrib.testing.worker import start_worker  # noqa: E402
+import queues  # noqa: E402
+import tasks  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+
+def fake_pdf(base_url, refs, hosts):
+    ''' linkrot stand-in returning refs spread over several host names '''
+    pdf = Mock()
+    pdf.get_metadata.return_value = {'Title': 'Benchmark'}
+    port = base_url.rsplit(':', 1)[1]
+    rows = []
+    for i in range(refs):
+        row = Mock()
+        row.reftype = 'url'
+        # every 127.x.y.z address reaches the stub on loopback
+        row.ref = 'http://127.0.0.%d:%s/ref/%d' % (i % hosts + 1, port, i)
+        row.page = 1
+        rows.append(row)
+    pdf.get_references.return_value = rows
+    return pdf
+
+
+def run_engine(app, engine, pdf):
+    with patch('tasks.linkrot.linkrot', return_value=pdf), \
+            patch('tasks.CHECK_ENGINE', engine):
+        pdfdata_task = app.tasks[tasks.pdfdata_task.name]
+        start = time.perf_counter()
+        result = pdfdata_task.delay('/benchmark.pdf').get(timeout=3600,
+                                                            interval=0.05)
+        elapsed = time.perf_counter() - start
+    return len(result['result_data']), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--refs', type=int, default=300)
+    parser.add_argument('--hosts', type=int, default=5)
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help='stub latency per request in seconds')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Celery worker slots')
+    args = parser.parse_args()
+
+    app = Celery('bench', broker='memory://', backend='cache+memory://',
+                 set_as_current=True)
+    app.conf.broker_transport_options = {'polling_interval': 0.01}
+    # the tasks are sent to the queues of queues.py, which the worker must
+    # consume like a deployed one
+    app.conf.task_queues = queues.task_queues()
+    app.conf.task_routes = queues.TASK_ROUTES
+    app.set_default()
+    app.finalize()
+
+    with StubServer(delay=args.delay) as server, \
+            start_worker(app, pool='threads', concurrency=args.concurrency,
+                         perform_ping_check=False, shutdown_timeout=30):
+        pdf = fake_pdf(server.base_url, args.refs, args.hosts)
+        print('%d refs over %d hosts, %.3fs latency, %d worker slots'
+              % (args.refs, args.hosts, args.delay, args.concurrency))
+        for engine in ('task', 'batch'):
+            count, elapsed = run_engine(app, engine, pdf)
+            print('%-6s %6.1f refs/s  (%d refs in %.2fs)'
+                  % (engine, count / elapsed, count, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+'''
+file: benchmarks/bench_pipeline.py
+description: End-to-end papers per minute, references per second, RSS and Redis bytes
+
+Uploads synthetic papers (see synthetic.py) through the Flask app, waits
+for their analysis, then builds and fetches their download archive, all
+against the local stub server. Celery runs on an in-process worker with
+an in-memory broker, or --inprocess uses the ANALYSIS_MODE=inprocess job
+pool instead of Celery. Redis is the one at REDIS_URL, or an in-memory
+fake with --fake-redis; the fake answers each command about ten times
+slower, so throughput figures of the two do not compare. The per-host
+rate limit is raised to --host-rate so the pipeline rather than the
+politeness limits is measured.
+
+For every paper size it reports papers per minute over the whole
+upload-to-archive flow, the seconds until the page can list the
+extracted references, references checked per second during the
+analysis, peak RSS of the process and the Redis bytes one paper leaves
+behind (application keys plus the results the Celery backend would keep
+in Redis). --save-baseline stores the figures in baselines.json, --check
+compares the run with them and exits with status 1 on a regression
+larger than --tolerance.
+
+    python benchmarks/bench_pipeline.py --sizes 10,100,1000 --papers 3
+    python benchmarks/bench_pipeline.py --fake-redis --check
+'''
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from io import BytesIO
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+from celery import Celery  # noqa: E402
+from celery.contrib.testing.worker import start_worker  # noqa: E402
+import httpclient  # noqa: E402
+import redisreport  # noqa: E402
+import synthetic  # noqa: E402
+from stub_server import StubServer, route_to_stub  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'baselines.json')
+POLL_INTERVAL = 0.05
+# Figures where more is better; for the others less is better
+HIGHER_IS_BETTER = ('papers_per_min', 'refs_per_s')
+COMPARED = HIGHER_IS_BETTER + ('outline_s', 'peak_rss_mb', 'redis_bytes')
+# Differences below these are polling noise whatever the tolerance
+SLACK = {'outline_s': 0.25}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def stored_bytes(backend):
+    ''' Bytes in Redis plus the results held by the in-memory backend '''
+    cache = getattr(backend.client, 'cache', {})
+    results = sum(len(key) + len(value) for key, value in cache.items())
+    return redisreport.report().get('bytes', 0) + results
+
+
+def wait_for(client, url, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        state = client.get(url).get_json()
+        if state['ready']:
+            return state
+        if time.monotonic() > deadline:
+            raise RuntimeError('timed out waiting for %s' % url)
+        time.sleep(POLL_INTERVAL)
+
+
+def wait_for_outline(client, task_id, timeout):
+    ''' Poll like the page until the extracted references are listed '''
+    deadline = time.monotonic() + timeout
+    while True:
+        state = client.get('/result/%s?outline=1' % task_id).get_json()
+        if state['ready'] or state.get('outline'):
+            return
+        if time.monotonic() > deadline:
+            raise RuntimeError('timed out waiting for the outline')
+        time.sleep(POLL_INTERVAL)
+
+
+def run_paper(client, pdf, name, timeout):
+    '''
+    Upload, analyse and download one paper. Returns the references
+    checked and the seconds until the outline, the analysis and the
+    download took.
+    '''
+    start = time.perf_counter()
+    with patch('app.validateCaptcha', return_value=True):
+        response = client.post('/', data={
+            'file': (BytesIO(pdf), name + '.pdf'),
+            'g-recaptcha-response': 'benchmark'})
+    assert response.status_code == 200, response.status_code
+    with client.session_transaction() as session:
+        task_id = session['task_id']
+    wait_for_outline(client, task_id, timeout)
+    outlined = time.perf_counter()
+    result = wait_for(client, '/result/' + task_id, timeout)
+    assert result['successful'], result
+    analysed = time.perf_counter()
+
+    started = client.post('/downloadpdf').get_json()
+    download = wait_for(client, started['status'], timeout)
+    assert download['successful'], download
+    archive = client.get(download['archive'])
+    assert archive.status_code == 200, archive.status_code
+    archive.close()
+    return (len(result['value']['result_data']), outlined - start,
+            analysed - start, time.perf_counter() - analysed)
+
+
+def run_size(client, backend, server, size, args):
+    refs = analysis = outline = 0.0
+    footprint = []
+    start = time.perf_counter()
+    for paper in range(args.papers):
+        pdf = synthetic.make_pdf(server.base_url, size,
+                                 paper=size * 100 + paper,
+                                 hosts=args.hosts, broken=args.broken,
+                                 redirects=args.redirects)
+        before = stored_bytes(backend)
+        checked, outlined, analysed, _ = run_paper(
+            client, pdf, 'paper-%d' % paper, args.timeout)
+        footprint.append(stored_bytes(backend) - before)
+        refs += checked
+        outline += outlined
+        analysis += analysed
+    elapsed = time.perf_counter() - start
+    return dict(papers_per_min=round(args.papers * 60 / elapsed, 2),
+                outline_s=round(outline / args.papers, 2),
+                refs_per_s=round(refs / analysis, 1),
+                peak_rss_mb=round(peak_rss_mb(), 1),
+                redis_bytes=int(sum(footprint) / len(footprint)))
+
+
+def regressions(figures, baseline, tolerance):
+    ''' Figures worse than the baseline by more than tolerance '''
+    found = []
+    for size, current in figures.items():
+        previous = baseline.get('sizes', {}).get(size)
+        if not previous:
+            continue
+        for name in COMPARED:
+            old, new = previous.get(name), current[name]
+            if not old:
+                continue
+            worse = (new < old * (1 - tolerance) if name in HIGHER_IS_BETTER
+                     else new > old * (1 + tolerance))
+            if worse and abs(new - old) > SLACK.get(name, 0):
+                found.append('%s refs: %s %s -> %s' % (size, name, old, new))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='comma separated references per paper')
+    parser.add_argument('--papers', type=int, default=3,
+                        help='papers per size')
+    parser.add_argument('--hosts', type=int, default=5)
+    parser.add_argument('--delay', type=float, default=0.01,
+                        help='stub latency per request in seconds')
+    parser.add_argument('--broken', type=float, default=0.05,
+                        help='share of references answering 404')
+    parser.add_argument('--redirects', type=float, default=0.05,
+                        help='share of references redirecting once')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Celery worker slots')
+    parser.add_argument('--inprocess', action='store_true',
+                        help='run jobs on the in-process pool, without Celery')
+    parser.add_argument('--host-rate', type=int, default=1000,
+                        help='checks per second allowed against one host')
+    parser.add_argument('--fake-redis', action='store_true',
+                        help='use an in-memory fake instead of REDIS_URL')
+    parser.add_argument('--timeout', type=float, default=1800,
+                        help='seconds to wait for one analysis or download')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    # read when the app modules are imported below
+    os.environ['HOST_MAX_RATE'] = str(args.host_rate)
+    with contextlib.ExitStack() as stack:
+        if args.fake_redis:
+            import fakeredis
+            stack.enter_context(patch('utilites.get_redis',
+                                      return_value=fakeredis.FakeRedis()))
+        import app as web
+
+        flask_app = web.app
+        flask_app.config.update(TESTING=True, SECRET_KEY='benchmark',
+                                UPLOAD_FOLDER=stack.enter_context(
+                                    tempfile.TemporaryDirectory()))
+        celery = Celery('bench', set_as_current=True)
+        celery.config_from_object(dict(
+            flask_app.config['CELERY'],
+            broker_url='memory://', result_backend='cache+memory://',
+            broker_transport_options={'polling_interval': 0.01},
+            # the in-memory backend polls for finished chords
+            result_chord_retry_interval=0.05))
+        celery.set_default()
+        celery.finalize()
+
+        server = stack.enter_context(StubServer(delay=args.delay))
+        route_to_stub(httpclient.get_session(), server.base_url)
+        if args.inprocess:
+            stack.enter_context(patch('localjobs.ANALYSIS_MODE', 'inprocess'))
+        else:
+            stack.enter_context(start_worker(
+                celery, pool='threads', concurrency=args.concurrency,
+                perform_ping_check=False, shutdown_timeout=30))
+        client = stack.enter_context(flask_app.test_client())
+
+        print('%s, %d papers per size, %.3fs latency, %d hosts, %s'
+              % (args.sizes, args.papers, args.delay, args.hosts,
+                 'in-process jobs' if args.inprocess else
+                 '%d worker slots' % args.concurrency))
+        print('%8s %12s %10s %10s %12s %12s' % (
+            'refs', 'papers/min', 'outline s', 'refs/s', 'peak RSS MB',
+            'Redis bytes'))
+        figures = dict()
+        for size in sizes:
+            figures[str(size)] = run_size(client, celery.backend, server,
+                                          size, args)
+            row = figures[str(size)]
+            print('%8d %12.2f %10.2f %10.1f %12.1f %12d'
+                  % (size, row['papers_per_min'], row['outline_s'],
+                     row['refs_per_s'], row['peak_rss_mb'],
+                     row['redis_bytes']))
+
+    settings = dict(papers=args.papers, hosts=args.hosts, delay=args.delay,
+                    broken=args.broken, redirects=args.redirects,
+                    concurrency=args.concurrency, inprocess=args.inprocess,
+                    host_rate=args.host_rate, fake_redis=args.fake_redis)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(settings=settings, sizes=figures), f, indent=2)
+            f.write('\n')
+        print('baseline saved to %s' % args.baseline)
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings:
+            print('warning: baseline was recorded with %s'
+                  % baseline.get('settings'))
+        found = regressions(figures, baseline, args.tolerance)
+        for line in found:
+            print('regression: ' + line)
+        if found:
+            sys.exit(1)
+        print('no regression beyond %d%%' % (args.tolerance * 100))
+
+
+if __name__ == '__main__':
+    main()
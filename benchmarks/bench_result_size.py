@@ -0,0 +1,107 @@
+'''
+file: benchmarks/bench_result_size.py
+description: Redis bytes stored per analysed paper for each result encoding
+
+Builds the results of one synthetic paper and encodes them the way the
+Celery Redis backend stores them: the aggregated analysis result, the
+results of the check batches the chord collects, and the progress
+stream. Reports the bytes for the former per-reference dicts with plain
+JSON, the compact [type, url, status] records with plain JSON, and the
+compact records with the zlib compressed 'zjson' serializer.
+
+    python benchmarks/bench_result_size.py --refs 300
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+from celery import Celery
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resultcodec  # noqa: E402
+from tasks import build_ref_result, BATCH_SIZE  # noqa: E402
+
+STATUSES = ['200'] * 8 + ['404', '403', 'timed out']
+
+
+def paper_refs(refs, seed=1):
+    ''' Reference dicts with the type mix of a typical paper '''
+    rand = random.Random(seed)
+    ref_dicts = []
+    for i in range(refs):
+        kind = rand.choice(['url', 'url', 'url', 'doi', 'arxiv', 'pdf'])
+        if kind == 'doi':
+            ref = '10.%d/j.jcp.%d.%d' % (1000 + i, 2000 + i % 25, 10000 + i)
+        elif kind == 'arxiv':
+            ref = '%d.%05d' % (1500 + i % 900, i)
+        elif kind == 'pdf':
+            ref = 'https://www.example%d.org/papers/%d/preprint.pdf' % (i % 7, i)
+        else:
+            ref = 'https://github.com/example%d/project-%d/blob/main/README.md' % (
+                i % 11, i)
+        ref_dicts.append(dict(reftype=kind, ref=ref))
+    return ref_dicts, [rand.choice(STATUSES) for _ in ref_dicts]
+
+
+def dict_result(ref_dict, stat):
+    ''' The per-reference result before the compact records '''
+    record = build_ref_result(ref_dict, stat)
+    result = dict(pdfs=[], urls=[], arxiv=[], doi=[], check=[stat])
+    key = {'pdf': 'pdfs', 'url': 'urls'}.get(record[0], record[0])
+    result[key].append(record[1])
+    return result
+
+
+def stored_bytes(backend, records, metadata, progress_dumps):
+    ''' Bytes of the chord batch results, aggregate result and progress '''
+    def meta(result):
+        return dict(status='SUCCESS', result=result, traceback=None,
+                    children=[], date_done='2026-10-18T12:00:00.000000',
+                    task_id='6f1c2a8e-3b1d-4f5e-9a7c-2d4b8e6f0a1c')
+
+    batches = [records[i:i + BATCH_SIZE]
+               for i in range(0, len(records), BATCH_SIZE)]
+    children = sum(len(backend.encode(meta(batch))) for batch in batches)
+    aggregate = len(backend.encode(meta({'metadata': metadata,
+                                         'result_data': records})))
+    stream = sum(len(progress_dumps(record)) for record in records)
+    return children, aggregate, stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--refs', type=int, default=300)
+    args = parser.parse_args()
+
+    ref_dicts, statuses = paper_refs(args.refs)
+    metadata = {'Title': 'A synthetic paper', 'Author': 'Bench Mark',
+                'CreationDate': '2026-10-18 12:00 UTC+00:00'}
+    old = [dict_result(r, s) for r, s in zip(ref_dicts, statuses)]
+    new = [build_ref_result(r, s) for r, s in zip(ref_dicts, statuses)]
+
+    variants = [('dict records, json', 'json', old, json.dumps),
+                ('compact records, json', 'json', new,
+                 lambda r: json.dumps(r, separators=(',', ':'))),
+                ('compact records, zjson', resultcodec.SERIALIZER, new,
+                 lambda r: json.dumps(r, separators=(',', ':')))]
+
+    print('%d references per paper\n' % args.refs)
+    print('%-24s %10s %10s %10s %10s' % ('encoding', 'batches', 'aggregate',
+                                         'progress', 'total'))
+    baseline = None
+    for name, serializer, records, progress_dumps in variants:
+        app = Celery('bench', backend='cache+memory://', set_as_current=False)
+        app.conf.result_serializer = serializer
+        app.conf.result_accept_content = ['json', resultcodec.SERIALIZER]
+        sizes = stored_bytes(app.backend, records, metadata, progress_dumps)
+        total = sum(sizes)
+        baseline = baseline or total
+        print('%-24s %10d %10d %10d %10d  (%.0f%%)' % (
+            (name,) + sizes + (total, 100.0 * total / baseline)))
+
+
+if __name__ == '__main__':
+    main()
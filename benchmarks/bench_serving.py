@@ -0,0 +1,118 @@
+'''
+file: benchmarks/bench_serving.py
+description: /check requests per second and latency per gunicorn worker model
+
+Starts gunicorn with gunicorn_config.py once per worker class and drives
+/check?recheck=1 with many concurrent clients for a fixed time. Every
+check goes out to the local stub server, which answers after --delay
+seconds, so the results show how many slow outbound requests each
+worker model can wait on at once.
+
+    python benchmarks/bench_serving.py --workers 2 --clients 100 --delay 0.2
+'''
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_server import StubServer  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(worker_class, workers, port):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_WORKERS=str(workers))
+    env.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+    env.setdefault('APP_SECRET_KEY', 'benchmark')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn_config.py',
+         '--bind', '127.0.0.1:%d' % port, '--log-level', 'warning', 'app:app'],
+        cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get('http://127.0.0.1:%d/robots.txt' % port, timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def drive(url, clients, duration):
+    ''' Latencies of every request answered within duration seconds '''
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    end = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < end:
+            start = time.perf_counter()
+            try:
+                ok = session.get(url, timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--workers', type=int, default=2,
+                        help='gunicorn worker processes')
+    parser.add_argument('--clients', type=int, default=100,
+                        help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to drive each worker model')
+    parser.add_argument('--delay', type=float, default=0.2,
+                        help='stub latency per outbound check in seconds')
+    parser.add_argument('--models', default='gthread,gevent')
+    args = parser.parse_args()
+
+    with StubServer(delay=args.delay) as stub:
+        print('%d clients, %d workers, %.3fs outbound latency, %.0fs each'
+              % (args.clients, args.workers, args.delay, args.duration))
+        for model in args.models.split(','):
+            port = free_port()
+            process = start_gunicorn(model, args.workers, port)
+            try:
+                url = ('http://127.0.0.1:%d/check?recheck=1&url=%s/ref'
+                       % (port, stub.base_url))
+                latencies, errors = drive(url, args.clients, args.duration)
+            finally:
+                process.terminate()
+                process.wait()
+            count = len(latencies)
+            p50 = latencies[count // 2] if count else 0
+            p99 = latencies[min(count - 1, int(count * 0.99))] if count else 0
+            print('%-8s %7.1f req/s  p50 %6.3fs  p99 %6.3fs  %d errors'
+                  % (model, count / args.duration, p50, p99, errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+'''
+file: benchmarks/stub_server.py
+description: Local HTTP stub standing in for the hosts cited by a paper
+'''
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlsplit
+from requests.adapters import HTTPAdapter
+
+# Hosts of typed references that route_to_stub answers from the stub
+STUB_ROUTED_HOSTS = ('dx.doi.org', 'arxiv.org')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Answers every path after an optional delay. Behaviour can be set per
+    request through the query string, for example
+    /paper?status=404&delay=0.2 or /moved?redirect=2
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, send_body):
+        query = parse_qs(urlparse(self.path).query)
+        delay = float(query.get('delay', [self.server.delay])[0])
+        status = int(query.get('status', [self.server.status])[0])
+        redirect = int(query.get('redirect', [0])[0])
+        time.sleep(delay)
+
+        with self.server.lock:
+            self.server.requests += 1
+
+        if redirect > 0:
+            target = urlparse(self.path)._replace(
+                query='redirect=%d' % (redirect - 1)).geturl()
+            self.send_response(302)
+            self.send_header('Location', target)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = b'x' * self.server.body_size
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+
+class StubServer(ThreadingHTTPServer):
+    ''' Threaded stub server with default latency and status '''
+
+    daemon_threads = True
+    # bursts of fresh connections must not overflow the listen backlog
+    request_queue_size = 128
+
+    def __init__(self, delay=0.05, status=200, body_size=2048, port=0):
+        # bound to all addresses so every 127.x.y.z host name reaches it
+        super().__init__(('', port), StubHandler)
+        self.delay = delay
+        self.status = status
+        self.body_size = body_size
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def handle_error(self, request, client_address):
+        # clients closing a connection early are expected, like the GET
+        # fallback of a link check that never reads the body
+        pass
+
+    def get_request(self):
+        request = super().get_request()
+        with self.lock:
+            self.connections += 1
+        return request
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class StubAdapter(HTTPAdapter):
+    ''' Sends every request to the stub, keeping its path and query '''
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = self.base_url + parts.path + (
+            '?' + parts.query if parts.query else '')
+        return super().send(request, **kwargs)
+
+
+def route_to_stub(session, base_url, hosts=STUB_ROUTED_HOSTS):
+    ''' Answer requests of session for hosts from the stub at base_url '''
+    adapter = StubAdapter(base_url, pool_maxsize=20)
+    for host in hosts:
+        for scheme in ('http://', 'https://'):
+            session.mount(scheme + host + '/', adapter)
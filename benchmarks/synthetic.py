@@ -0,0 +1,74 @@
+'''
+file: benchmarks/synthetic.py
+description: Synthetic papers citing references served by the local stub
+
+make_pdf writes a PDF whose text cites refs references of mixed types,
+which linkrot extracts like those of a real paper: urls and PDF links on
+the stub's 127.0.0.x host names, plus dx.doi.org and arxiv.org links
+that stub_server.route_to_stub sends to the stub. A share of the
+references answers with an error status or redirects first. With links
+a share of the references is also a link annotation, as in papers with
+hyperlinked references.
+'''
+
+import random
+import fitz
+
+# Share of each reference type in a paper
+REFERENCE_MIX = (('url', 0.5), ('pdf', 0.15), ('doi', 0.2), ('arxiv', 0.15))
+LINES_PER_PAGE = 60
+
+
+def reference_lines(base_url, refs, paper=0, hosts=5, broken=0.05,
+                    redirects=0.05, seed=1):
+    ''' Text line citing each reference, unique to paper '''
+    rand = random.Random('%s-%s' % (seed, paper))
+    port = base_url.rsplit(':', 1)[1]
+    types = [kind for kind, _ in REFERENCE_MIX]
+    weights = [share for _, share in REFERENCE_MIX]
+    lines = []
+    for i in range(refs):
+        kind = rand.choices(types, weights)[0]
+        roll = rand.random()
+        query = ('?status=404' if roll < broken else
+                 '?redirect=1' if roll < broken + redirects else '')
+        host = '127.0.0.%d:%s' % (i % hosts + 1, port)
+        if kind == 'url':
+            line = 'http://%s/p%d/ref/%d%s' % (host, paper, i, query)
+        elif kind == 'pdf':
+            line = 'http://%s/p%d/papers/%d.pdf%s' % (host, paper, i, query)
+        elif kind == 'doi':
+            line = 'https://dx.doi.org/10.5555/bench.%d.%d%s' % (paper, i,
+                                                                 query)
+        else:
+            line = 'https://arxiv.org/abs/%d.%05d%s' % (2100 + paper, i,
+                                                         query)
+        lines.append('[%d] %s' % (i + 1, line))
+    return lines
+
+
+def make_pdf(base_url, refs, paper=0, lines_per_page=LINES_PER_PAGE,
+             links=0.0, **options):
+    '''
+    Bytes of a PDF citing refs references on pages of lines_per_page
+    lines, a links share of them also linked, see reference_lines
+    '''
+    lines = reference_lines(base_url, refs, paper, **options)
+    rand = random.Random('links-%s' % paper)
+    doc = fitz.open()
+    doc.set_metadata({'title': 'Synthetic paper %d' % paper,
+                      'author': 'Benchmark'})
+    for start in range(0, max(len(lines), 1), lines_per_page):
+        page = doc.new_page()
+        chunk = lines[start:start + lines_per_page]
+        page.insert_text((36, 40), '\n'.join(chunk) or 'No references',
+                         fontsize=7)
+        for row, line in enumerate(chunk):
+            if rand.random() < links:
+                top = 33 + row * 8.75
+                page.insert_link({'kind': fitz.LINK_URI,
+                                  'uri': line.split(' ', 1)[1],
+                                  'from': fitz.Rect(36, top, 300, top + 8)})
+    data = doc.tobytes()
+    doc.close()
+    return data
@@ -0,0 +1,91 @@
+'''
+file: download.py
+description: Zip archive of an analysed PDF and the PDFs it references
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import as_completed
+from linkrot.downloader import sanitize_url
+from httpclient import get_session, HTTP_CONNECT_TIMEOUT
+from threadpool import ThreadPool
+
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 8))
+DOWNLOAD_TIMEOUT = float(os.environ.get('DOWNLOAD_TIMEOUT', 60))
+# Seconds one referenced PDF may take in total before it counts as failed
+DOWNLOAD_DEADLINE = float(os.environ.get('DOWNLOAD_DEADLINE', 300))
+# Downloads larger than this are spooled to disk instead of memory
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def fetch_pdf(url):
+    '''
+    Download url over the pooled client into a spooled temporary file,
+    rewound for reading
+    '''
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        with get_session().get(sanitize_url(url), stream=True, verify=False,
+                               timeout=(HTTP_CONNECT_TIMEOUT,
+                                        DOWNLOAD_TIMEOUT)) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(COPY_CHUNK_SIZE):
+                spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def archive_name(url, taken):
+    ''' File name for url inside the archive, unique among taken '''
+    name = url.split('/')[-1].split('?')[0] or 'document.pdf'
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in taken:
+        candidate = '%s-%d%s' % (stem, n, ext)
+        n += 1
+    taken.add(candidate)
+    return candidate
+
+
+def write_archive(archive_path, source_path, urls, infos,
+                  max_workers=DOWNLOAD_WORKERS):
+    '''
+    Write the source PDF, its infos and every referenced PDF in urls
+    straight into a zip at archive_path. Referenced PDFs are fetched in
+    parallel on a bounded pool and each one is written into the archive as
+    soon as it arrives; one that takes longer than DOWNLOAD_DEADLINE is
+    given up. Returns the number of PDFs downloaded and failed.
+    '''
+    source_name = os.path.basename(source_path)
+    folder = '%s-referenced-pdfs' % source_name
+    downloaded, failed = 0, 0
+
+    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        if os.path.isfile(source_path):
+            archive.write(source_path, source_name)
+        archive.writestr('%s.infos.json' % source_name,
+                         json.dumps(infos, indent=2))
+
+        taken = set()
+        with ThreadPool(max_workers, timeout=DOWNLOAD_DEADLINE,
+                        name='download') as pool:
+            futures = {pool.submit(fetch_pdf, url): url for url in urls}
+            for future in as_completed(futures):
+                try:
+                    spool = future.result()
+                except Exception:
+                    failed += 1
+                    continue
+                name = archive_name(futures[future], taken)
+                with spool, archive.open('%s/%s' % (folder, name), 'w') as dst:
+                    shutil.copyfileobj(spool, dst, COPY_CHUNK_SIZE)
+                downloaded += 1
+
+    return downloaded, failed
@@ -0,0 +1,191 @@
+'''
+file: events.py
+description: Server-sent events of analysis progress over Redis pub/sub
+
+Workers announce extracted references, checked references and stored
+results on the pub/sub channel of the job (see progress). Each web
+process holds one pub/sub connection, subscribed to the jobs with an
+open event stream in that process, and wakes those streams up. A
+stream then reads what changed with the calls a poll of /result makes,
+but only when something did.
+'''
+
+import json
+import os
+import queue
+import threading
+import time
+import redis
+import progress
+import utilites
+
+# A stream holds a thread under threaded workers, so streams are only
+# served by default when gunicorn runs gevent workers
+RESULT_EVENTS = os.environ.get(
+    'RESULT_EVENTS',
+    'on' if os.environ.get('GUNICORN_WORKER_CLASS') == 'gevent' else 'off'
+) == 'on'
+# Seconds between keepalive comments, each also rereads the job state
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+# Seconds before a stream is closed; the browser reconnects and resumes
+# from the Last-Event-ID it was sent
+EVENTS_MAX_SECONDS = float(os.environ.get('EVENTS_MAX_SECONDS', 300))
+# Seconds a woken stream waits, so a burst of checks goes out as one event
+EVENTS_COALESCE = 0.25
+LISTEN_TIMEOUT = 1.0
+
+
+class Listener:
+    '''
+    One pub/sub connection per process. Streams register a queue per
+    job with watch(); the listener thread keeps the subscriptions in line
+    with the watched jobs and puts every announcement of a job ('outline',
+    'progress' or 'done') on its queues. The thread ends once nothing is
+    watched.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = dict()
+        self.thread = None
+
+    def watch(self, job_id):
+        waiter = queue.Queue()
+        with self.lock:
+            self.waiters.setdefault(progress.events_channel(job_id),
+                                    set()).add(waiter)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True,
+                                               name='events')
+                self.thread.start()
+        return waiter
+
+    def unwatch(self, job_id, waiter):
+        channel = progress.events_channel(job_id)
+        with self.lock:
+            waiters = self.waiters.get(channel, set())
+            waiters.discard(waiter)
+            if not waiters:
+                self.waiters.pop(channel, None)
+
+    def run(self):
+        pubsub = None
+        subscribed = set()
+        while True:
+            with self.lock:
+                channels = set(self.waiters)
+                if not channels:
+                    self.thread = None
+                    break
+            try:
+                if pubsub is None:
+                    pubsub = utilites.get_redis().pubsub(
+                        ignore_subscribe_messages=True)
+                    subscribed = set()
+                if channels - subscribed:
+                    pubsub.subscribe(*(channels - subscribed))
+                if subscribed - channels:
+                    pubsub.unsubscribe(*(subscribed - channels))
+                subscribed = channels
+                message = pubsub.get_message(timeout=LISTEN_TIMEOUT)
+            except redis.RedisError:
+                # streams fall back on their heartbeat until Redis is back
+                pubsub = None
+                time.sleep(LISTEN_TIMEOUT)
+                continue
+            if message and message['type'] == 'message':
+                self.deliver(message['channel'], message['data'])
+        if pubsub is not None:
+            try:
+                pubsub.close()
+            except redis.RedisError:
+                pass
+
+    def deliver(self, channel, data):
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        if isinstance(data, bytes):
+            data = data.decode()
+        with self.lock:
+            waiters = list(self.waiters.get(channel, ()))
+        for waiter in waiters:
+            waiter.put(data)
+
+
+listener = Listener()
+
+
+def event(name, data):
+    ''' One server-sent event, its id is the reference cursor '''
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (
+        data['next'], name, json.dumps(data, separators=(',', ':')))
+
+
+def drain(waiter):
+    messages = []
+    while True:
+        try:
+            messages.append(waiter.get_nowait())
+        except queue.Empty:
+            return messages
+
+
+def stream(job_id, since, read_result, read_outline=None):
+    '''
+    Events of job_id from reference since on: 'outline' with the extracted
+    metadata and references, 'progress' with the newly checked references,
+    then 'result' with the /result response once the job is finished.
+    read_result(cursor) returns that response; it is called at the start,
+    when the job announces its result and on heartbeats, while progress
+    announcements only read new references. read_outline() returns the
+    outline or None before extraction; a stream resuming after checked
+    references skips it, as the browser already has it.
+    '''
+    waiter = listener.watch(job_id)
+    try:
+        deadline = time.monotonic() + EVENTS_MAX_SECONDS
+        cursor = since
+        response = read_result(cursor)
+        outline = read_outline if since == 0 else None
+        # a result stored before the subscription is caught by the first,
+        # short heartbeat
+        timeout = LISTEN_TIMEOUT * 2
+        # announcements that woke the stream, none at the start and on
+        # heartbeats, when everything is read
+        messages = []
+        while True:
+            if response['ready']:
+                yield event('result', response)
+                return
+            if outline and (not messages or 'outline' in messages or
+                            response['items']):
+                found = outline()
+                if found is not None:
+                    yield event('outline', dict(found, next=cursor))
+                    outline = None
+            if response['items']:
+                yield event('progress', dict(items=response['items'],
+                                             next=response['next']))
+            cursor = response['next']
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                messages = [waiter.get(timeout=min(timeout, remaining))]
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                response = read_result(cursor)
+                timeout = EVENTS_HEARTBEAT
+                messages = []
+                continue
+            time.sleep(EVENTS_COALESCE)
+            messages += drain(waiter)
+            timeout = EVENTS_HEARTBEAT
+            if 'done' in messages:
+                response = read_result(cursor)
+            else:
+                items = progress.read(job_id, cursor)
+                response = dict(ready=False, items=items,
+                                next=cursor + len(items))
+    finally:
+        listener.unwatch(job_id, waiter)
@@ -0,0 +1,140 @@
+'''
+file: extraction.py
+description: Reference extraction split into page ranges for very large PDFs
+
+linkrot reads a whole document on one core and compares every url found
+in the text with every link found before it. Above EXTRACT_SPLIT_PAGES
+pages the document is instead read in ranges of EXTRACT_RANGE_PAGES
+pages, in parallel Celery tasks or a process pool, and merge() combines
+the ranges with the rules of linkrot: link annotations first, then the
+urls, arXiv ids and DOIs of the text page by page, a text url being
+dropped when it is part of a link or url found before it, and the first
+reference kept for every ref. The result is the references linkrot
+finds for the whole document.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import fitz
+from linkrot import extractor
+from linkrot.backends import Reference, ReaderBackend, make_compat_str
+
+EXTRACT_SPLIT_PAGES = int(os.environ.get('EXTRACT_SPLIT_PAGES', 150))
+EXTRACT_RANGE_PAGES = int(os.environ.get('EXTRACT_RANGE_PAGES', 50))
+EXTRACT_PROCESSES = int(os.environ.get('EXTRACT_PROCESSES',
+                                       os.cpu_count() or 1))
+
+
+def page_count(path):
+    '''
+    Pages of the PDF at path, 0 when it cannot be opened: linkrot then
+    reports the error as for any small document
+    '''
+    try:
+        with fitz.open(path) as doc:
+            return doc.page_count
+    except (RuntimeError, OSError, ValueError):
+        return 0
+
+
+def page_ranges(pages, size=None):
+    ''' [start, stop) page ranges covering pages, size pages each '''
+    size = size or EXTRACT_RANGE_PAGES
+    return [(start, min(start + size, pages))
+            for start in range(0, pages, size)]
+
+
+def should_split(path):
+    return page_count(path) > EXTRACT_SPLIT_PAGES
+
+
+def read_metadata(path):
+    ''' Document metadata as linkrot reports it, without reading pages '''
+    reader = ReaderBackend()
+    with fitz.open(path) as doc:
+        for key, value in (doc.metadata or {}).items():
+            if isinstance(value, (bytes, str)):
+                reader.metadata[key] = make_compat_str(value)
+        reader.metadata['Pages'] = doc.page_count
+    reader.metadata_cleanup()
+    return reader.metadata
+
+
+def extract_range(path, start, stop):
+    '''
+    Raw findings of pages [start, stop): the external links as [uri,
+    page] and per page [page, urls, arxiv ids, dois] of its text. Pages
+    are numbered from 1 like linkrot does.
+    '''
+    links, pages = [], []
+    with fitz.open(path) as doc:
+        for number in range(start, stop):
+            page = doc[number]
+            link = page.first_link
+            while link:
+                if link.is_external:
+                    links.append([link.uri, number + 1])
+                link = link.next
+            text = page.get_text()
+            pages.append([number + 1, list(extractor.extract_urls(text)),
+                          list(extractor.extract_arxiv(text)),
+                          list(extractor.extract_doi(text))])
+    return {'links': links, 'pages': pages}
+
+
+def merge(parts):
+    '''
+    linkrot References of the extract_range parts of a document, given
+    in page order
+    '''
+    references = dict()
+    # every link and kept url so far, newline separated: a url is part of
+    # one of them exactly when it is part of this buffer, urls have no
+    # whitespace
+    found = bytearray()
+
+    def add(reference):
+        references.setdefault(reference.ref, reference)
+
+    for part in parts:
+        for uri, page in part['links']:
+            found += uri.encode() + b'\n'
+            if not uri.startswith('mailto:'):
+                add(Reference(uri, page))
+    for part in parts:
+        for page, urls, arxiv, dois in part['pages']:
+            for url in urls:
+                if url.encode() in found:
+                    continue
+                add(Reference(url, page))
+                found += url.encode() + b'\n'
+            for ref in arxiv:
+                add(Reference(ref, page))
+            for ref in dois:
+                add(Reference(ref, page))
+    return list(references.values())
+
+
+def _extract_range(args):
+    return extract_range(*args)
+
+
+def extract(path, processes=None):
+    '''
+    Metadata and references of the PDF at path, read in page ranges on a
+    pool of that many processes, EXTRACT_PROCESSES by default
+    '''
+    ranges = [(path, start, stop)
+              for start, stop in page_ranges(page_count(path))]
+    processes = min(processes or EXTRACT_PROCESSES, len(ranges))
+    # daemonic processes, such as prefork pool children, cannot have any
+    if processes > 1 and not multiprocessing.current_process().daemon:
+        # spawned, since forking a threaded web or worker process is unsafe
+        with ProcessPoolExecutor(
+                processes,
+                mp_context=multiprocessing.get_context('spawn')) as pool:
+            parts = list(pool.map(_extract_range, ranges))
+    else:
+        parts = [extract_range(*args) for args in ranges]
+    return read_metadata(path), merge(parts)
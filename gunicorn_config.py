@@ -1,8 +1,18 @@
 # gunicorn_config.py
 import multiprocessing
+import os
 
 bind = "0.0.0.0:8000"   # bind the server to localhost at port 8000
-workers = multiprocessing.cpu_count() * 2 + 1  # number of worker processes
-# workers = 1  # number of worker processes
-threads = 2  # number of threads per worker
+# 'gthread' runs each request on an OS thread. 'gevent' runs it on a
+# greenlet, so routes waiting on outbound HTTP (/check, the captcha check)
+# or on Redis only hold a cheap greenlet while they wait
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    workers = int(os.environ.get('GUNICORN_WORKERS',
+                                 multiprocessing.cpu_count() + 1))
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+else:
+    workers = int(os.environ.get('GUNICORN_WORKERS',
+                                 multiprocessing.cpu_count() * 2 + 1))
+    threads = int(os.environ.get('GUNICORN_THREADS', 2))  # threads per worker
 timeout = 120  # timeout in seconds
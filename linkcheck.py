@@ -0,0 +1,209 @@
+'''
+file: linkcheck.py
+description: Concurrent link checking with global and per-host limits
+
+A link checked successfully before is revalidated: the check sends the
+ETag and Last-Modified it answered with as If-None-Match and
+If-Modified-Since, and a 304 answer stands for the status it had then.
+'''
+
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+import requests
+from linkrot.downloader import sanitize_url
+from httpclient import head_or_get
+from statuscache import (cached_status, lookup_validators, store_validators,
+                         THROTTLED_STATUSES)
+from threadpool import ThreadPool
+import metrics
+
+MAX_WORKERS = int(os.environ.get('LINKCHECK_MAX_WORKERS', 20))
+PER_HOST_LIMIT = int(os.environ.get('LINKCHECK_PER_HOST', 4))
+# Seconds before hosts refused by a limiter are tried again
+RETRY_INTERVAL = 0.05
+
+REVALIDATIONS = metrics.Counter(
+    'rr_revalidations_total', 'Conditional link checks, by outcome')
+REVALIDATION_SAVED_BYTES = metrics.Counter(
+    'rr_revalidation_saved_bytes_total',
+    'Body bytes of GET checks the host did not send by answering 304')
+REVALIDATION_SAVED_SECONDS = metrics.Counter(
+    'rr_revalidation_saved_seconds_total',
+    'Seconds 304 answers took less than the full checks they replaced')
+
+
+def conditional_headers(validators):
+    headers = dict()
+    if validators and validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators and validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def response_validators(response, seconds):
+    ''' Validators of a successful check, None when the host sent none '''
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if not (etag or last_modified):
+        return None
+    try:
+        length = int(response.headers.get('Content-Length') or 0)
+    except ValueError:
+        length = 0
+    return dict(status=response.status_code, url=response.url, etag=etag,
+                last_modified=last_modified, length=length,
+                seconds=round(seconds, 4))
+
+
+def record_not_modified(response, validators, seconds):
+    ''' Count what a 304 saved against the full check it replaced '''
+    REVALIDATIONS.inc(outcome='not_modified')
+    # a HEAD answer has no body either way
+    if getattr(response.request, 'method', None) == 'GET':
+        REVALIDATION_SAVED_BYTES.inc(validators.get('length', 0))
+    REVALIDATION_SAVED_SECONDS.inc(
+        max(0.0, validators.get('seconds', 0) - seconds))
+
+
+def fetch_status(url):
+    '''
+    Uncached check over the pooled client returning (status, final url
+    after redirects). Connection failures are reported by their reason
+    the way linkrot's get_status_code reports them. A link with stored
+    validators is asked conditionally, and a 304 answer returns the
+    status and final url of the check the validators came from and
+    keeps the validators for another VALIDATOR_TTL.
+    '''
+    validators = lookup_validators(url)
+    start = time.perf_counter()
+    try:
+        response = head_or_get(sanitize_url(url),
+                               headers=conditional_headers(validators))
+    except requests.Timeout:
+        return 'timed out', url
+    except requests.ConnectionError as e:
+        reason = getattr(e.args[0], 'reason', None) if e.args else None
+        return str(reason or e), url
+    except Exception:
+        return None, url
+    seconds = time.perf_counter() - start
+    if validators:
+        if response.status_code == 304:
+            record_not_modified(response, validators, seconds)
+            store_validators(url, validators)
+            return validators['status'], validators['url']
+        REVALIDATIONS.inc(outcome='modified')
+    if 200 <= response.status_code < 300:
+        found = response_validators(response, seconds)
+        if found:
+            store_validators(url, found)
+    return response.status_code, response.url
+
+
+def get_status_code(url, recheck=False):
+    ''' Status of url, served from the shared status cache when fresh '''
+    return cached_status(url, fetch_status, recheck)
+
+
+def url_host(url):
+    ''' Hostname used to group urls for the per-host limit '''
+    return (urlparse(sanitize_url(url)).hostname or '').lower()
+
+
+def safe_status(url, check=get_status_code):
+    ''' Status code of url as a string, or 0 when the check fails '''
+    try:
+        return str(check(url))
+    except Exception:
+        return 0
+
+
+def timed_status(url, check=get_status_code):
+    ''' safe_status of url and the seconds the check took '''
+    start = time.perf_counter()
+    status = safe_status(url, check)
+    return status, time.perf_counter() - start
+
+
+def check_urls(urls, check=get_status_code, max_workers=MAX_WORKERS,
+               per_host=PER_HOST_LIMIT, on_result=None, limiter=None,
+               lookup=None):
+    '''
+    Check all urls concurrently and return their statuses in input order.
+    on_result(index, status) is called as each check finishes.
+
+    At most max_workers checks run at once and at most per_host of them
+    against the same host. Hosts are served round-robin, so a long run of
+    urls on one slow host does not hold back the others.
+
+    A limiter (see politeness.HostLimiter) additionally has to admit each
+    check; refused hosts are retried after RETRY_INTERVAL while the other
+    hosts carry on. A url answered with 429 or 503 is retried once.
+
+    lookup(url) returns a known status of url, such as a cached one, or
+    None. The urls it answers are reported straight away and are never
+    checked, so they neither wait for the limiter nor count against it.
+    '''
+    statuses = [None] * len(urls)
+    queues = OrderedDict()
+    for index, url in enumerate(urls):
+        known = lookup(url) if lookup is not None else None
+        if known is not None:
+            statuses[index] = str(known)
+            if on_result is not None:
+                on_result(index, statuses[index])
+            continue
+        queues.setdefault(url_host(url), deque()).append(index)
+
+    active = dict.fromkeys(queues, 0)
+    in_flight = {}
+    retried = set()
+
+    with ThreadPool(max_workers, name='linkcheck') as pool:
+        while queues or in_flight:
+            scheduled = True
+            while scheduled and len(in_flight) < max_workers:
+                scheduled = False
+                for host in list(queues):
+                    if len(in_flight) >= max_workers:
+                        break
+                    if active[host] >= per_host:
+                        continue
+                    if limiter is not None and not limiter.try_acquire(host):
+                        continue
+                    index = queues[host].popleft()
+                    if queues[host]:
+                        queues.move_to_end(host)
+                    else:
+                        del queues[host]
+                    active[host] += 1
+                    future = pool.submit(timed_status, urls[index], check)
+                    in_flight[future] = (index, host)
+                    scheduled = True
+
+            if not in_flight:
+                # every remaining host is refused by the limiter for now
+                time.sleep(RETRY_INTERVAL)
+                continue
+            timeout = RETRY_INTERVAL if limiter is not None and queues else None
+            done, _ = wait(in_flight, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                index, host = in_flight.pop(future)
+                active[host] -= 1
+                status, elapsed = future.result()
+                if limiter is not None:
+                    limiter.release(host, status, elapsed)
+                    if str(status) in THROTTLED_STATUSES and index not in retried:
+                        retried.add(index)
+                        queues.setdefault(host, deque()).append(index)
+                        continue
+                statuses[index] = status
+                if on_result is not None:
+                    on_result(index, statuses[index])
+
+    return statuses
@@ -0,0 +1,109 @@
+'''
+file: localjobs.py
+description: In-process jobs for deployments that cannot run Celery
+
+With ANALYSIS_MODE=inprocess the web process runs analyses and archive
+builds on its own thread pool instead of sending them to a Celery
+worker. Job states are kept in Redis so every web worker can answer the
+polling of any job, and LocalResult reads them with the AsyncResult
+interface the routes already use.
+'''
+
+import os
+import threading
+import redis
+from celery import states
+from threadpool import ThreadPool
+import progress
+import resultcodec
+import utilites
+
+# 'celery' sends jobs to the workers, 'inprocess' runs them in the web process
+ANALYSIS_MODE = os.environ.get('ANALYSIS_MODE', 'celery')
+LOCAL_WORKERS = int(os.environ.get('LOCAL_WORKERS', 4))
+# Seconds an in-process job may run before it is reported as failed
+LOCAL_JOB_TIMEOUT = float(os.environ.get('LOCAL_JOB_TIMEOUT', 900))
+LOCAL_RESULT_TTL = int(os.environ.get('LOCAL_RESULT_TTL',
+                                      utilites.RESULT_EXPIRES))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def enabled():
+    return ANALYSIS_MODE == 'inprocess'
+
+
+def get_pool():
+    ''' Process-wide job pool, created on first use '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(LOCAL_WORKERS, timeout=LOCAL_JOB_TIMEOUT,
+                               name='jobs')
+        return _pool
+
+
+def job_key(job_id):
+    return 'job:local:' + job_id
+
+
+def save_state(job_id, state, result=None):
+    try:
+        utilites.get_redis().set(job_key(job_id),
+                                 resultcodec.dumps({'state': state,
+                                                    'result': result}),
+                                 ex=LOCAL_RESULT_TTL)
+    except redis.RedisError:
+        pass
+
+
+def record_outcome(job_id, future):
+    if future.cancelled():
+        save_state(job_id, states.REVOKED)
+    elif future.exception() is not None:
+        save_state(job_id, states.FAILURE, repr(future.exception()))
+    else:
+        save_state(job_id, states.SUCCESS, future.result())
+    progress.notify_done(job_id)
+
+
+def apply_async(func, args, task_id):
+    ''' Run func(*args) on the job pool under task_id '''
+    save_state(task_id, states.PENDING)
+
+    def run():
+        save_state(task_id, states.STARTED)
+        return func(*args)
+
+    future = get_pool().submit(run)
+    future.add_done_callback(lambda f: record_outcome(task_id, f))
+    return LocalResult(task_id)
+
+
+def stats():
+    ''' Job pool metrics, empty until the first job was submitted '''
+    return _pool.stats() if _pool is not None else dict()
+
+
+class LocalResult:
+    ''' AsyncResult-like view of an in-process job, read once from Redis '''
+
+    def __init__(self, id):
+        self.id = id
+        try:
+            entry = utilites.get_redis().get(job_key(id))
+        except redis.RedisError:
+            entry = None
+        entry = resultcodec.loads(entry) if entry else {}
+        self.state = entry.get('state', states.PENDING)
+        self.result = entry.get('result')
+
+    def __str__(self):
+        return self.id
+
+    def ready(self):
+        return self.state in states.READY_STATES
+
+    def successful(self):
+        return self.state == states.SUCCESS
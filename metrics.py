@@ -0,0 +1,175 @@
+'''
+file: metrics.py
+description: Counters and histograms shared by all processes, in Prometheus format
+
+Web and Celery worker processes record into Redis hashes, one per
+metric, so /metrics reports the totals of every gunicorn and Celery
+worker whichever process answers the scrape. Recording never raises: a
+sample lost while Redis is down is better than a failed request.
+'''
+
+import functools
+import math
+import time
+from contextlib import contextmanager
+import redis
+import utilites
+
+KEY_PREFIX = 'metrics:'
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                30, 60, 120, 300)
+SIZE_BUCKETS = tuple(2 ** power * 1024 for power in range(4, 17, 2))
+COUNT_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_registry = dict()
+_collectors = []
+
+
+def label_text(labels):
+    ''' Prometheus label set of a dict, '' without labels '''
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        pairs.append('%s="%s"' % (name, value.replace('\n', '\\n')))
+    return '{%s}' % ','.join(pairs)
+
+
+def number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Counter:
+    ''' Monotonic total, one series per label set '''
+
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.key = KEY_PREFIX + name
+        _registry[name] = self
+
+    def inc(self, amount=1, **labels):
+        try:
+            utilites.get_redis().hincrbyfloat(self.key, label_text(labels),
+                                              amount)
+        except redis.RedisError:
+            pass
+
+    def samples(self, fields):
+        return [(self.name + labels, float(value))
+                for labels, value in sorted(fields.items())]
+
+
+class Histogram:
+    '''
+    Distribution of observed values over fixed buckets. Each observation
+    increments only the bucket it falls in; the cumulative Prometheus
+    buckets are summed up when rendering.
+    '''
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.key = KEY_PREFIX + name
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        _registry[name] = self
+
+    def observe(self, value, **labels):
+        le = next(bound for bound in self.buckets if value <= bound)
+        series = label_text(labels)
+        try:
+            pipe = utilites.get_redis().pipeline(transaction=False)
+            pipe.hincrby(self.key, 'bucket|%s|%s' % (series, number(le)), 1)
+            pipe.hincrbyfloat(self.key, 'sum|' + series, value)
+            pipe.hincrby(self.key, 'count|' + series, 1)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    @contextmanager
+    def time(self, **labels):
+        ''' Observe the seconds the with block takes '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def wrap(self, func, **labels):
+        ''' func timed on every call '''
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with self.time(**labels):
+                return func(*args, **kwargs)
+        return timed
+
+    def samples(self, fields):
+        per_series = dict()
+        for field, value in fields.items():
+            kind, _, rest = field.partition('|')
+            series, _, le = rest.rpartition('|') if kind == 'bucket' else (
+                rest, '', '')
+            entry = per_series.setdefault(series, dict(buckets=dict()))
+            if kind == 'bucket':
+                entry['buckets'][float(le)] = int(value)
+            else:
+                entry[kind] = float(value)
+
+        samples = []
+        for series, entry in sorted(per_series.items()):
+            inner = series[1:-1]
+            total = 0
+            for bound in self.buckets:
+                total += entry['buckets'].get(bound, 0)
+                le = 'le="%s"' % number(bound)
+                samples.append(('%s_bucket{%s}' % (
+                    self.name, ','.join(filter(None, (inner, le)))), total))
+            samples.append((self.name + '_sum' + series, entry.get('sum', 0)))
+            samples.append((self.name + '_count' + series,
+                            entry.get('count', 0)))
+        return samples
+
+
+def collector(func):
+    '''
+    Register func as a source of values kept elsewhere. It returns
+    (name, kind, help, [(labels dict, value), ...]) tuples.
+    '''
+    _collectors.append(func)
+    return func
+
+
+def render():
+    ''' All metrics in the Prometheus text exposition format '''
+    lines = []
+    try:
+        pipe = utilites.get_redis().pipeline(transaction=False)
+        for metric in _registry.values():
+            pipe.hgetall(metric.key)
+        stored = pipe.execute()
+    except redis.RedisError:
+        stored = [dict()] * len(_registry)
+
+    for metric, fields in zip(_registry.values(), stored):
+        fields = {key.decode(): value.decode()
+                  for key, value in fields.items()}
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        lines.extend('%s %s' % (series, number(value))
+                     for series, value in metric.samples(fields))
+
+    for func in _collectors:
+        for name, kind, help, values in func():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend('%s%s %s' % (name, label_text(labels), number(value))
+                         for labels, value in values)
+    return '\n'.join(lines) + '\n'
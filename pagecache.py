@@ -0,0 +1,160 @@
+'''
+file: pagecache.py
+description: Pages rendered once per process, served with strong ETags and compressed
+
+The informational pages, robots.txt and the sitemap only change with a
+deploy. cached() renders such a view once and keeps the body
+in every encoding next to a strong ETag per encoding. Requests get 304
+for a matching If-None-Match and the stored encoding they accept
+otherwise. A deploy starts new processes that render the pages again,
+and a changed body gets a new ETag, so browsers and proxies pick it up
+on their next revalidation. With debug or TEMPLATES_AUTO_RELOAD on the
+views render on every request; clear() drops the cached pages.
+
+Pages are keyed by endpoint and vary(), never by the Host header the
+client sends; a view depending on the host, like the sitemap, varies by
+trusted_host(), which only returns SERVER_NAME and PAGE_HOSTS. The
+least recently served page makes room once MAX_PAGES are kept.
+
+compress() gzips the other HTML, XML, JSON and text responses.
+'''
+
+import functools
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from flask import Response, current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+PAGE_CACHE_MAX_AGE = int(os.environ.get('PAGE_CACHE_MAX_AGE', 300))
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_TYPES = ('text/html', 'text/plain', 'text/xml',
+                      'application/xml', 'application/json')
+# Host names the pages may be rendered for besides SERVER_NAME
+PAGE_HOSTS = [host.strip().lower()
+              for host in os.environ.get('PAGE_HOSTS', '').split(',')
+              if host.strip()]
+MAX_PAGES = 256
+
+_pages = OrderedDict()
+_lock = threading.Lock()
+
+
+def compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def accepted_encoding(available):
+    ''' Best of the available encodings the client accepts '''
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings[encoding] > 0:
+            return encoding
+    return 'identity'
+
+
+class Page:
+    ''' Rendered body of a view in every encoding, with their ETags '''
+
+    def __init__(self, body, content_type, mimetype):
+        self.content_type = content_type
+        self.bodies = {'identity': body}
+        if compressible(mimetype) and len(body) >= COMPRESS_MIN_SIZE:
+            self.bodies['gzip'] = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # a strong ETag names the bytes sent, so each encoding has its own
+        self.etags = {encoding: digest if encoding == 'identity' else
+                      '%s-%s' % (digest, encoding) for encoding in self.bodies}
+
+    def response(self):
+        encoding = accepted_encoding(self.bodies)
+        response = Response(self.bodies[encoding],
+                            content_type=self.content_type)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(self.etags[encoding])
+        response.cache_control.public = True
+        response.cache_control.max_age = PAGE_CACHE_MAX_AGE
+        return response.make_conditional(request)
+
+
+def trusted_host():
+    ''' Host of the request when it is SERVER_NAME or in PAGE_HOSTS '''
+    host = request.host.lower()
+    server_name = current_app.config.get('SERVER_NAME')
+    if host in PAGE_HOSTS or (server_name and host == server_name.lower()):
+        return host
+    return None
+
+
+def enabled():
+    return not (current_app.debug or
+                current_app.config.get('TEMPLATES_AUTO_RELOAD'))
+
+
+def cached(vary=None):
+    '''
+    Serve the view from a Page rendered on its first request. vary()
+    returns anything else the output depends on besides the endpoint,
+    such as configuration or trusted_host(). Only 200 responses are kept.
+    '''
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return view(*args, **kwargs)
+            key = (request.endpoint, vary() if vary else None)
+            with _lock:
+                page = _pages.get(key)
+                if page is not None:
+                    _pages.move_to_end(key)
+            if page is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                page = Page(response.get_data(), response.content_type,
+                            response.mimetype)
+                with _lock:
+                    _pages[key] = page
+                    while len(_pages) > MAX_PAGES:
+                        _pages.popitem(last=False)
+            return page.response()
+        return wrapper
+    return decorator
+
+
+def clear():
+    with _lock:
+        _pages.clear()
+
+
+def compress(response):
+    '''
+    gzip a compressible response for a client accepting it, as an
+    after_request hook. Streams, files and responses with an ETag or an
+    encoding already are left alone.
+    '''
+    if (response.status_code != 200 or response.direct_passthrough or
+            response.is_streamed or
+            'Content-Encoding' in response.headers or
+            'ETag' in response.headers or
+            not compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    if request.accept_encodings['gzip'] <= 0:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(body, COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
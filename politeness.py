@@ -0,0 +1,172 @@
+'''
+file: politeness.py
+description: Per-host limits for outbound link checks shared by all workers
+
+HostLimiter keeps per-host concurrency and request rate counters in Redis
+so every worker checking the same host shares one budget, and records
+each host's latency. schedule_batches groups references by host so that
+slow or heavily cited hosts do not hold up everything else.
+'''
+
+import os
+import time
+from collections import OrderedDict
+import redis
+from linkcheck import url_host
+from statuscache import THROTTLED_STATUSES
+from refindex import ref_url
+import metrics
+import utilites
+
+HOST_MAX_CONCURRENCY = int(os.environ.get('HOST_MAX_CONCURRENCY', 8))
+HOST_MAX_RATE = int(os.environ.get('HOST_MAX_RATE', 10))
+# Seconds a host is left alone after answering 429 or 503
+HOST_BACKOFF = int(os.environ.get('HOST_BACKOFF', 10))
+# Seconds the latency of a host is remembered after its last check
+HOST_LATENCY_TTL = int(os.environ.get('HOST_LATENCY_TTL', 7 * 24 * 3600))
+# Weight of the newest sample in the latency moving average
+LATENCY_ALPHA = 0.3
+
+LATENCY_PREFIX = 'linkcheck:host:latency:'
+
+HOST_CHECK_SECONDS = metrics.Histogram(
+    'rr_host_check_latency_seconds',
+    'Seconds per link check that reached the host, over all hosts')
+
+
+def parse_host_limits(value):
+    '''
+    Per-host overrides written as host=concurrency:rate pairs, for
+    example "doi.org=4:5,arxiv.org=2:1"
+    '''
+    limits = dict()
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        host, _, limit = item.partition('=')
+        concurrency, _, rate = limit.partition(':')
+        limits[host.strip().lower()] = (int(concurrency), int(rate))
+    return limits
+
+
+HOST_LIMITS = parse_host_limits(os.environ.get('HOST_LIMITS', ''))
+
+
+class HostLimiter:
+    '''
+    Non-blocking per-host admission shared through Redis. Callers ask
+    try_acquire(host) before a check and call release(host, ...) after
+    it; a refused host is simply retried later. A Redis outage lets every
+    check through.
+    '''
+
+    def __init__(self, concurrency=HOST_MAX_CONCURRENCY, rate=HOST_MAX_RATE,
+                 limits=None, backoff=HOST_BACKOFF):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.limits = HOST_LIMITS if limits is None else limits
+        self.backoff = backoff
+
+    def limits_for(self, host):
+        for name, limit in self.limits.items():
+            if host == name or host.endswith('.' + name):
+                return limit
+        return self.concurrency, self.rate
+
+    def try_acquire(self, host):
+        concurrency, rate = self.limits_for(host)
+        active_key = 'linkcheck:host:active:' + host
+        rate_key = 'linkcheck:host:rate:%s:%d' % (host, int(time.time()))
+        try:
+            r = utilites.get_redis()
+            if r.exists('linkcheck:host:backoff:' + host):
+                return False
+            pipe = r.pipeline()
+            pipe.incr(active_key)
+            # stale counts of crashed workers disappear once a host is idle
+            pipe.expire(active_key, 300)
+            active, _ = pipe.execute()
+            if active > concurrency:
+                r.decr(active_key)
+                return False
+            # only admitted checks count against the rate, a refusal takes
+            # its request back
+            pipe = r.pipeline()
+            pipe.incr(rate_key)
+            pipe.expire(rate_key, 2)
+            requests, _ = pipe.execute()
+            if requests > rate:
+                pipe = r.pipeline()
+                pipe.decr(rate_key)
+                pipe.decr(active_key)
+                pipe.execute()
+                return False
+        except redis.RedisError:
+            pass
+        return True
+
+    def release(self, host, status=None, elapsed=None):
+        try:
+            r = utilites.get_redis()
+            r.decr('linkcheck:host:active:' + host)
+            if str(status) in THROTTLED_STATUSES:
+                r.set('linkcheck:host:backoff:' + host, 1, ex=self.backoff)
+            if elapsed is not None:
+                record_latency(host, elapsed)
+        except redis.RedisError:
+            pass
+
+
+def record_latency(host, elapsed):
+    ''' Fold a check duration in seconds into the host's moving average '''
+    HOST_CHECK_SECONDS.observe(elapsed)
+    r = utilites.get_redis()
+    previous = r.get(LATENCY_PREFIX + host)
+    if previous is not None:
+        elapsed = (LATENCY_ALPHA * elapsed +
+                   (1 - LATENCY_ALPHA) * float(previous))
+    r.set(LATENCY_PREFIX + host, round(elapsed, 4), ex=HOST_LATENCY_TTL)
+
+
+def host_latencies(hosts):
+    ''' Measured average check latency in seconds of those hosts known '''
+    hosts = list(hosts)
+    if not hosts:
+        return dict()
+    try:
+        latencies = utilites.get_redis().mget(
+            [LATENCY_PREFIX + host for host in hosts])
+    except redis.RedisError:
+        return dict()
+    return {host: float(value) for host, value in zip(hosts, latencies)
+            if value is not None}
+
+
+def schedule_batches(ref_dicts, batch_size):
+    '''
+    Split references into check batches grouped by host. A host with a
+    full batch worth of references gets batches of its own, the remaining
+    hosts share batches. Batches of the fastest known hosts come first so
+    their results are not stuck behind slow ones.
+    '''
+    by_host = OrderedDict()
+    for ref_dict in ref_dicts:
+        by_host.setdefault(url_host(ref_url(ref_dict)), []).append(ref_dict)
+
+    latencies = host_latencies(by_host)
+    known = sorted(latencies.values())
+    # hosts never measured are assumed to be of median speed
+    default = known[len(known) // 2] if known else 0.0
+    hosts = sorted(by_host, key=lambda host: latencies.get(host, default))
+
+    batches, shared = [], []
+    for host in hosts:
+        refs = by_host[host]
+        while len(refs) >= batch_size:
+            batches.append(refs[:batch_size])
+            refs = refs[batch_size:]
+        shared.extend(refs)
+        if len(shared) >= batch_size:
+            batches.append(shared[:batch_size])
+            shared = shared[batch_size:]
+    if shared:
+        batches.append(shared)
+    return batches
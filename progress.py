@@ -0,0 +1,79 @@
+'''
+file: progress.py
+description: Per-analysis stream of finished reference results kept in Redis
+
+Every append, the extracted references and every stored job result are
+also announced on the pub/sub channel of the job, which wakes up its open
+event streams (see events).
+
+The stream doubles as the checkpoint of the checks: a check task that
+runs again, after its worker died or the broker redelivered it, takes
+the results already published with checked() and only checks and
+publishes the references without one.
+'''
+
+import json
+import os
+import redis
+import utilites
+
+PROGRESS_TTL = int(os.environ.get('PROGRESS_TTL', utilites.RESULT_EXPIRES))
+
+
+def progress_key(job_id):
+    return 'analysis:progress:' + job_id
+
+
+def events_channel(job_id):
+    return 'analysis:events:' + job_id
+
+
+def publish(job_id, results):
+    ''' Append finished reference results to the stream of job_id '''
+    if not job_id or not results:
+        return
+    key = progress_key(job_id)
+    try:
+        pipe = utilites.get_redis().pipeline()
+        pipe.rpush(key, *[json.dumps(result, separators=(',', ':'))
+                          for result in results])
+        pipe.expire(key, PROGRESS_TTL)
+        pipe.publish(events_channel(job_id), 'progress')
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def notify(job_id, message):
+    if not job_id:
+        return
+    try:
+        utilites.get_redis().publish(events_channel(job_id), message)
+    except redis.RedisError:
+        pass
+
+
+def notify_outline(job_id):
+    ''' Announce that the references of job_id are extracted '''
+    notify(job_id, 'outline')
+
+
+def notify_done(job_id):
+    ''' Announce that the result of job_id is stored '''
+    notify(job_id, 'done')
+
+
+def read(job_id, since=0):
+    ''' Results of job_id published after the first since ones '''
+    try:
+        items = utilites.get_redis().lrange(progress_key(job_id), since, -1)
+    except redis.RedisError:
+        return []
+    return [json.loads(item) for item in items]
+
+
+def checked(job_id, key):
+    ''' Results of job_id published so far, by key(result) '''
+    if not job_id:
+        return {}
+    return {key(result): result for result in read(job_id)}
@@ -0,0 +1,115 @@
+'''
+file: queues.py
+description: Celery queues by job size with a fair share per submitter
+
+PDF extraction and the chord callbacks go to the interactive queue:
+they are short and someone is waiting on each of them. The link checks
+of a paper go to the checks queue, or to the bulk queue when the paper
+has more than LARGE_PAPER_REFS references or its submitter already has
+more than SUBMITTER_FAIR_REFS references being checked. A worker
+consuming several queues takes from each in turn, so one dissertation
+in the bulk queue gets its share of the workers instead of holding up
+every short paper queued behind it.
+'''
+
+import hashlib
+import os
+import redis
+from kombu import Queue
+import utilites
+
+INTERACTIVE_QUEUE = 'interactive'
+CHECKS_QUEUE = 'checks'
+BULK_QUEUE = 'bulk'
+# Archive builds and periodic tasks
+DEFAULT_QUEUE = 'celery'
+ALL_QUEUES = (INTERACTIVE_QUEUE, CHECKS_QUEUE, DEFAULT_QUEUE, BULK_QUEUE)
+
+LARGE_PAPER_REFS = int(os.environ.get('LARGE_PAPER_REFS', 500))
+SUBMITTER_FAIR_REFS = int(os.environ.get('SUBMITTER_FAIR_REFS', 1000))
+# Seconds the in-flight count of a submitter outlives its last paper, so
+# the count of an analysis that never finished does not stay forever
+SUBMITTER_TTL = 3600
+# Deliveries of a task whose worker keeps dying before it is failed
+TASK_MAX_DELIVERIES = int(os.environ.get('TASK_MAX_DELIVERIES', 3))
+# Seconds the redelivery count of a task is kept
+DELIVERIES_TTL = 24 * 3600
+
+TASK_ROUTES = {
+    'tasks.pdfdata_task': {'queue': INTERACTIVE_QUEUE},
+    'tasks.extract_pages': {'queue': INTERACTIVE_QUEUE},
+    'tasks.merge_pages': {'queue': INTERACTIVE_QUEUE},
+    'tasks.aggregate_results': {'queue': INTERACTIVE_QUEUE},
+    'tasks.check_refs_batch': {'queue': CHECKS_QUEUE},
+    'tasks.sort_ref': {'queue': CHECKS_QUEUE},
+}
+
+
+def task_queues():
+    ''' Every queue, consumed by a worker started without -Q '''
+    return [Queue(name, routing_key=name) for name in ALL_QUEUES]
+
+
+def submitter_id(address):
+    ''' Short digest of a client address, the address is not stored '''
+    return hashlib.sha256(address.encode()).hexdigest()[:16]
+
+
+def submitter_key(submitter):
+    return 'queue:submitter:' + submitter
+
+
+def check_queue(refs, submitter=None):
+    '''
+    Queue for the link checks of a paper with refs references. The
+    references are added to the in-flight count of submitter until
+    checks_done; a Redis outage only skips the fair share.
+    '''
+    in_flight = refs
+    if submitter:
+        try:
+            pipe = utilites.get_redis().pipeline()
+            pipe.incrby(submitter_key(submitter), refs)
+            pipe.expire(submitter_key(submitter), SUBMITTER_TTL)
+            in_flight = pipe.execute()[0]
+        except redis.RedisError:
+            pass
+    if refs > LARGE_PAPER_REFS or in_flight > SUBMITTER_FAIR_REFS:
+        return BULK_QUEUE
+    return CHECKS_QUEUE
+
+
+def checks_done(refs, submitter=None, job_id=None):
+    '''
+    Remove refs checked references from the count of submitter, once
+    per job_id when given: a callback delivered again must not remove
+    them twice
+    '''
+    if not submitter:
+        return
+    try:
+        r = utilites.get_redis()
+        if job_id and not r.set('queue:done:' + job_id, 1, nx=True,
+                                ex=SUBMITTER_TTL):
+            return
+        if r.decrby(submitter_key(submitter), refs) <= 0:
+            r.delete(submitter_key(submitter))
+    except redis.RedisError:
+        pass
+
+
+def deliveries_exhausted(name, task_id):
+    '''
+    Count a redelivery of task name with task_id and tell whether it has
+    now been delivered more than TASK_MAX_DELIVERIES times. A Redis
+    outage lets the task run.
+    '''
+    key = 'queue:redelivered:%s:%s' % (name, task_id)
+    try:
+        pipe = utilites.get_redis().pipeline()
+        pipe.incr(key)
+        pipe.expire(key, DELIVERIES_TTL)
+        redeliveries = pipe.execute()[0]
+    except redis.RedisError:
+        return False
+    return redeliveries >= TASK_MAX_DELIVERIES
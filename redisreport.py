@@ -0,0 +1,162 @@
+'''
+file: redisreport.py
+description: Key counts and memory use of the Redis instance by key class
+
+The broker, the result backend and the application caches share one
+small Redis instance. report() scans the keyspace and adds up the keys
+and bytes of every class below, next to the instance memory figures, so
+it shows which class to shorten the retention of before Redis starts
+evicting keys. Scanning loads the instance that also brokers the jobs,
+so only the periodic log_report() does it; it stores the report for
+latest() to serve.
+'''
+
+import json
+import logging
+import os
+import time
+import redis
+import queues
+import utilites
+
+REDIS_REPORT_INTERVAL = int(os.environ.get('REDIS_REPORT_INTERVAL', 3600))
+SCAN_COUNT = 1000
+REPORT_KEY = 'redisreport:latest'
+
+# First matching prefix names the class of a key
+KEY_CLASSES = (
+    ('celery-task-meta-', 'results'),
+    ('celery-taskset-meta-', 'chords'),
+    ('chord-unlock-', 'chords'),
+    ('linkcheck:status:', 'statuses'),
+    ('linkcheck:validators:', 'validators'),
+    ('linkcheck:host:', 'hosts'),
+    ('linkcheck:cache:', 'counters'),
+    ('workspace:', 'counters'),
+    ('queue:', 'counters'),
+    ('redisreport:', 'counters'),
+    ('analysis:refs:', 'refindex'),
+    ('analysis:progress:', 'progress'),
+    ('analysis:pdf:', 'uploads'),
+    ('job:local:', 'local_jobs'),
+    ('metrics:', 'metrics'),
+    ('_kombu', 'broker'),
+    ('unacked', 'broker'),
+)
+# Policies that may evict keys without a TTL, like the broker queues
+UNSAFE_POLICIES = ('allkeys-lru', 'allkeys-lfu', 'allkeys-random')
+
+logger = logging.getLogger(__name__)
+
+
+def key_class(key):
+    if isinstance(key, bytes):
+        key = key.decode(errors='replace')
+    for prefix, name in KEY_CLASSES:
+        if key.startswith(prefix):
+            return name
+    for name in queues.ALL_QUEUES:
+        if key == name or key.startswith(name + '\x06'):
+            return 'broker'
+    return 'other'
+
+
+def key_sizes(client, keys):
+    '''
+    Bytes used by each of keys, from MEMORY USAGE or, where the server
+    lacks it, the length of the serialized value
+    '''
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.memory_usage(key)
+    try:
+        return [size or 0 for size in pipe.execute()]
+    except redis.ResponseError:
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.dump(key)
+        return [len(key) + len(value or b'')
+                for key, value in zip(keys, pipe.execute())]
+
+
+def memory_info(client):
+    try:
+        info = client.info('memory')
+    except redis.ResponseError:
+        return dict()
+    return {key: info.get(key) for key in
+            ('used_memory', 'maxmemory', 'maxmemory_policy')}
+
+
+def report(client=None):
+    '''
+    Keys and bytes per key class plus the memory figures of the server.
+    Returns an empty dict when Redis is unreachable.
+    '''
+    client = client or utilites.get_redis()
+    classes = dict()
+    try:
+        batch = []
+        for key in client.scan_iter(count=SCAN_COUNT):
+            batch.append(key)
+            if len(batch) >= SCAN_COUNT:
+                count_keys(client, batch, classes)
+                batch = []
+        count_keys(client, batch, classes)
+        memory = memory_info(client)
+    except redis.RedisError:
+        return dict()
+    return dict(memory, classes=classes,
+                keys=sum(c['keys'] for c in classes.values()),
+                bytes=sum(c['bytes'] for c in classes.values()))
+
+
+def count_keys(client, keys, classes):
+    if not keys:
+        return
+    for key, size in zip(keys, key_sizes(client, keys)):
+        entry = classes.setdefault(key_class(key), dict(keys=0, bytes=0))
+        entry['keys'] += 1
+        entry['bytes'] += size
+
+
+def store_report(client, stats):
+    ''' Keep stats for latest() until two intervals have passed '''
+    try:
+        client.set(REPORT_KEY, json.dumps(dict(stats, generated=time.time())),
+                   ex=2 * REDIS_REPORT_INTERVAL)
+    except redis.RedisError:
+        pass
+
+
+def latest(client=None):
+    ''' The report last stored by log_report, empty when there is none '''
+    try:
+        stored = (client or utilites.get_redis()).get(REPORT_KEY)
+    except redis.RedisError:
+        return dict()
+    return json.loads(stored) if stored else dict()
+
+
+def log_report(client=None):
+    '''
+    Log report() one line per key class and store it for latest(),
+    returns the report
+    '''
+    client = client or utilites.get_redis()
+    stats = report(client)
+    if not stats:
+        logger.warning('redis report: redis unreachable')
+        return stats
+    store_report(client, stats)
+    logger.info('redis report: %d keys, %d bytes, used_memory=%s '
+                'maxmemory=%s', stats['keys'], stats['bytes'],
+                stats.get('used_memory'), stats.get('maxmemory'))
+    for name, entry in sorted(stats['classes'].items()):
+        logger.info('redis report: %s %d keys %d bytes', name, entry['keys'],
+                    entry['bytes'])
+    if stats.get('maxmemory_policy') in UNSAFE_POLICIES:
+        logger.warning('redis report: maxmemory-policy %s can evict queued '
+                       'jobs, use a volatile-* policy',
+                       stats['maxmemory_policy'])
+    return stats
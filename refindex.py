@@ -0,0 +1,76 @@
+'''
+file: refindex.py
+description: Compact index of the references extracted from an analysed PDF
+
+The index is stored next to the analysis result under its task id so that
+later steps (downloads, reruns) never have to parse the PDF again. Each
+reference is a [reftype, ref, url, page] row.
+'''
+
+import json
+import os
+import zlib
+import redis
+from statuscache import normalize_url
+import utilites
+
+REFINDEX_TTL = int(os.environ.get('REFINDEX_TTL', utilites.RESULT_EXPIRES))
+
+REFTYPE, REF, URL, PAGE = range(4)
+
+
+def index_key(job_id):
+    return 'analysis:refs:' + job_id
+
+
+def ref_url(ref_dict):
+    if ref_dict['reftype'] == 'arxiv':
+        return "https://arxiv.org/abs/"+ref_dict['ref']
+    elif ref_dict['reftype'] == 'doi':
+        return "https://doi.org/"+ref_dict['ref']
+    return ref_dict['ref']
+
+
+def build(metadata, refs):
+    ''' Index document for the metadata and linkrot references of a PDF '''
+    rows = []
+    for ref in refs:
+        url = ref_url(dict(reftype=ref.reftype, ref=ref.ref))
+        rows.append([ref.reftype, ref.ref, normalize_url(url), ref.page])
+    return {'metadata': metadata, 'references': rows}
+
+
+def save(job_id, index):
+    if not job_id:
+        return
+    data = zlib.compress(json.dumps(index, separators=(',', ':')).encode())
+    try:
+        utilites.get_redis().set(index_key(job_id), data, ex=REFINDEX_TTL)
+    except redis.RedisError:
+        pass
+
+
+def load(job_id):
+    ''' Stored index document of job_id, or None '''
+    if not job_id:
+        return None
+    try:
+        data = utilites.get_redis().get(index_key(job_id))
+    except redis.RedisError:
+        return None
+    return json.loads(zlib.decompress(data)) if data else None
+
+
+def ref_dicts(index):
+    ''' sort_ref style dicts for every reference in the index '''
+    return [dict(reftype=row[REFTYPE], ref=row[REF])
+            for row in index['references']]
+
+
+def pdf_urls(index):
+    ''' Referenced PDF urls in the index, without repeats '''
+    urls = []
+    for row in index['references']:
+        if row[REFTYPE] == 'pdf' and row[REF] not in urls:
+            urls.append(row[REF])
+    return urls
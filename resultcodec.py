@@ -0,0 +1,38 @@
+'''
+file: resultcodec.py
+description: zlib compressed JSON encoding of the stored task results
+
+Analysis results sit in the Redis result backend for a day and are read
+on every poll. Registering 'zjson' with kombu lets Celery store them as
+compact JSON compressed with zlib; results written as plain JSON before
+the switch are still read back.
+'''
+
+import os
+import zlib
+from kombu.serialization import register
+from kombu.utils import json
+
+SERIALIZER = 'zjson'
+CONTENT_TYPE = 'application/x-zjson'
+# Serializer of the result backend, 'json' stores results uncompressed
+RESULT_SERIALIZER = os.environ.get('RESULT_SERIALIZER', SERIALIZER)
+
+
+def dumps(obj):
+    return zlib.compress(json.dumps(obj, separators=(',', ':')).encode())
+
+
+def loads(data):
+    if isinstance(data, str):
+        data = data.encode()
+    try:
+        data = zlib.decompress(data)
+    except zlib.error:
+        # stored as plain JSON
+        pass
+    return json.loads(data)
+
+
+register(SERIALIZER, dumps, loads, content_type=CONTENT_TYPE,
+         content_encoding='binary')
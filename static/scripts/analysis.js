@@ -2,71 +2,66 @@ window.addEventListener("load", () => {
   const links = [...document.getElementsByClassName("analysis-ref")];
   let [success, error403, error404, errorOther] = [0, 0, 0, 0];
   let [numberOfLinks, numberChecked] = [links.length, 0];
+  const urls = links.map((row) => row.getElementsByTagName("input")[0].value);
 
-  links.forEach((row) => {
-    const url = row.getElementsByTagName("input")[0].value;
+  const showResult = (row, response) => {
     const icon = row.getElementsByClassName("analysis-icon")[0];
     const message = row.getElementsByClassName("fetch-response")[0];
+    message.innerHTML = `<b>${response}</b>`;
+    if (Number(response) === 200) {
+      icon.innerHTML = '<i class="fa fa-check-circle text-success"></i>';
+      success += 1;
+    } else {
+      icon.innerHTML = '<i class="fa fa-exclamation-circle text-failure"></i>';
+      if (Number(response) == 403) error403 += 1;
+      if (Number(response) == 404) error404 += 1;
+      if (Number(response) !== 403 && Number(response) !== 404) {
+        errorOther += 1;
+        message.innerHTML = `<b>N/A</b>`;
+      }
+    }
+    numberChecked += 1;
+    updateCounts(success, error403, error404, errorOther);
+    if (numberOfLinks === numberChecked) {
+      const summary = document.getElementsByClassName("linkrot-summary")[0];
+      summary.innerHTML = 'Linkrot Summary <i class="fa fa-check"></i>';
+      setTimeout(() => (summary.innerHTML = "Linkrot Summary"), 2000);
+    }
+  };
 
-    const request = "/check?url=" + encodeURIComponent(url);
-    checkHeaders(request)
-      .then(
-        (response) => {
-          message.innerHTML = `<b>${response}</b>`;
-          if (Number(response) === 200) {
-            icon.innerHTML = '<i class="fa fa-check-circle text-success"></i>';
-            success += 1;
-            numberChecked += 1;
-          } else {
-            icon.innerHTML =
-              '<i class="fa fa-exclamation-circle text-failure"></i>';
-            if (Number(response) == 403) error403 += 1;
-            if (Number(response) == 404) error404 += 1;
-            if (Number(response) !== 403 && Number(response) !== 404) {
-              errorOther += 1;
-              message.innerHTML = `<b>N/A</b>`;
-            }
-            numberChecked += 1;
-          }
-        },
-        (err) => {
-          console.error(err);
-          icon.innerHTML =
-            '<i class="fa fa-exclamation-circle text-failure"></i>';
-          message.innerHTML = "N/A";
-          errorOther += 1;
-          numberChecked += 1;
-        }
-      )
-      .finally(() => {
-        updateCounts(success, error403, error404, errorOther);
-        if (numberOfLinks === numberChecked) {
-          const summary = document.getElementsByClassName("linkrot-summary")[0];
-          summary.innerHTML = 'Linkrot Summary <i class="fa fa-check"></i>';
-          setTimeout(() => (summary.innerHTML = "Linkrot Summary"), 2000);
-        }
-      });
+  if (numberOfLinks === 0) return;
+  // one request for every link, results stream back as each check finishes
+  const answered = new Set();
+  checkBatch(urls, (result) => {
+    answered.add(result.index);
+    showResult(links[result.index], result.status);
+  }).catch((err) => {
+    console.error(err);
+    links.forEach((row, index) => {
+      if (!answered.has(index)) showResult(row, "N/A");
+    });
   });
 });
 
-function checkHeaders(url) {
-  return new Promise((resolve, reject) => {
-    const Http = new XMLHttpRequest();
-    Http.timeout = 20000;
-    Http.open("GET", url, true);
-
-    Http.onreadystatechange = () => {
-      if (Http.readyState === 4) {
-        resolve(Http.response);
-      }
-    };
-
-    Http.onerrer = (e) => {
-      reject(e);
-    };
-
-    Http.send();
+async function checkBatch(urls, onResult) {
+  const response = await fetch("/check/batch", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ urls }),
   });
+  if (!response.ok) throw new Error(`batch check failed: ${response.status}`);
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.filter(Boolean).forEach((line) => onResult(JSON.parse(line)));
+  }
 }
 
 function updateCounts(success, error403, error404, errorOther) {
@@ -103,20 +98,20 @@ function updateCounts(success, error403, error404, errorOther) {
 }
 
 
-function get_status(task_id){
+function get_status(task_id, delay){
     var url = "/result/"+ task_id
     $.get( url)
       .done(function( data ) {
         console.log( data );
-        if (data.successful === true){
-            console.log("success");
+        if (data.ready === true){
+            console.log(data.successful ? "success" : "failed");
         } else {
-        console.log(" no success");
-        setTimeout(get_status, 2000, task_id);
+        // back off while the analysis runs, up to 16s between polls
+        setTimeout(get_status, delay, task_id, Math.min(delay * 2, 16000));
         }
       });
 }
 $( document ).ready(function() {
     var task_id = $("#taskid").data( "taskid" );
-    setTimeout(get_status, 2000, task_id);
+    setTimeout(get_status, 1000, task_id, 2000);
 });
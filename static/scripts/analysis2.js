@@ -1,21 +1,30 @@
-function construct_block(url, status) {
-  var res = $("<li>", { class: "analysis-ref" });
-  $("<input>", { type: "hidden", value: url }).appendTo(res);
-  var div1 = $("<div>", { class: "check analysis-icon" }).appendTo(res);
+function set_row_status(row, status) {
+  var icon = row.find(".analysis-icon").empty();
+  var message = row.find(".fetch-response").empty();
 
-  var div2 = $("<div>", { class: "fetch-response" }).appendTo(res);
-
-  if (Number(status) == 200) {
-    $("<i>", { class: "fa fa-check-circle text-success" }).appendTo(div1);
-    $("<b>").text(status).appendTo(div2);
+  if (status === null) {
+    // listed from the outline, not checked yet
+    $("<i>", { class: "fa fa-circle-o-notch fa-spin" }).appendTo(icon);
+    $("<b>").text("pending").appendTo(message);
+  } else if (Number(status) == 200) {
+    $("<i>", { class: "fa fa-check-circle text-success" }).appendTo(icon);
+    $("<b>").text(status).appendTo(message);
   } else {
-    $("<i>", { class: "fa fa-exclamation-circle text-failure" }).appendTo(div1);
+    $("<i>", { class: "fa fa-exclamation-circle text-failure" }).appendTo(icon);
     if (Number(status) !== 403 && Number(status) !== 404) {
-      $("<b>").html("N/A").appendTo(div2);
+      $("<b>").html("N/A").appendTo(message);
     } else {
-      $("<b>").text(status).appendTo(div2);
+      $("<b>").text(status).appendTo(message);
     }
   }
+}
+
+function construct_block(url, status) {
+  var res = $("<li>", { class: "analysis-ref" });
+  $("<input>", { type: "hidden", value: url }).appendTo(res);
+  $("<div>", { class: "check analysis-icon" }).appendTo(res);
+  $("<div>", { class: "fetch-response" }).appendTo(res);
+  set_row_status(res, status);
 
   var div3 = $("<div>", { class: "link-container" }).appendTo(res);
   var link_a = $("<a>", {
@@ -42,49 +51,107 @@ function fill_document_information(data, container) {
   });
 }
 
-function fill_data_gui(data) {
-  let [success, error403, error404, errorOther, doiCount, arxivCount] = [
-    0, 0, 0, 0, 0, 0,
-  ];
-  let [numberOfLinks, numberChecked] = [data.value.result_data.length, 0];
-  fill_document_information(data.value.metadata, $(".meta-grid"));
-
-  $.each(data.value.result_data, function (key, value) {
-    if (value.pdfs.length > 0) {
-      var li = construct_block(value.pdfs[0], value.check[0]);
-      $("#pdfs").append(li);
-    } else if (value.doi.length > 0) {
-      var li = construct_block(value.doi[0], value.check[0]);
-      $("#doi").append(li);
-      doiCount += 1;
-    } else if (value.arxiv.length > 0) {
-      var li = construct_block(value.arxiv[0], value.check[0]);
-      $("#arxiv").append(li);
-      arxivCount += 1;
-    } else if (value.urls.length > 0) {
-      var li = construct_block(value.urls[0], value.check[0]);
-      $("#urls").append(li);
-    }
+var counts = {
+  success: 0,
+  error403: 0,
+  error404: 0,
+  errorOther: 0,
+  doi: 0,
+  arxiv: 0,
+};
+var cursor = 0;
+// /result polling interval in ms, doubled while nothing changes
+var POLL_MIN = 1000;
+var POLL_MAX = 16000;
+var poll_delay = POLL_MIN;
+// rows listed from the outline that wait for their status, by url
+var pending_rows = {};
+var outlined = false;
 
-    if (Number(value.check[0]) === 200) {
-      success += 1;
-      numberChecked += 1;
-    } else {
-      if (Number(value.check[0]) == 403) error403 += 1;
-      if (Number(value.check[0]) == 404) error404 += 1;
-      if (Number(value.check[0]) !== 403 && Number(value.check[0]) !== 404) {
-        errorOther += 1;
-      }
-      numberChecked += 1;
+// result records are [type, url, status]
+var reference_lists = {
+  pdf: "#pdfs",
+  doi: "#doi",
+  arxiv: "#arxiv",
+  url: "#urls",
+};
+
+function list_reference(type, url, status) {
+  if (type in reference_lists) {
+    var li = construct_block(url, status);
+    $(reference_lists[type]).append(li);
+  }
+  if (type === "doi") counts.doi += 1;
+  if (type === "arxiv") counts.arxiv += 1;
+  return li;
+}
+
+function show_outline(outline) {
+  // The extracted references, [type, url] each, before any is checked
+  if (outlined || !outline) return;
+  outlined = true;
+  fill_document_information(outline.metadata, $(".meta-grid"));
+  $.each(outline.references, function (key, value) {
+    var li = list_reference(value[0], value[1], null);
+    if (li) {
+      (pending_rows[value[1]] = pending_rows[value[1]] || []).push(li);
     }
   });
+  update_summary();
+}
 
-  updateCounts(success, error403, error404, errorOther, arxivCount, doiCount);
+function add_reference(value) {
+  var type = value[0],
+    url = value[1],
+    status = value[2];
+  var rows = pending_rows[url];
+  if (rows && rows.length > 0) {
+    set_row_status(rows.shift(), status);
+  } else {
+    list_reference(type, url, status);
+  }
+  count_status(status);
+}
+
+function count_status(status) {
+  if (Number(status) === 200) {
+    counts.success += 1;
+  } else {
+    if (Number(status) == 403) counts.error403 += 1;
+    if (Number(status) == 404) counts.error404 += 1;
+    if (Number(status) !== 403 && Number(status) !== 404) {
+      counts.errorOther += 1;
+    }
+  }
+}
+
+function update_summary() {
+  updateCounts(
+    counts.success,
+    counts.error403,
+    counts.error404,
+    counts.errorOther,
+    counts.arxiv,
+    counts.doi
+  );
+}
+
+function fill_data_gui(data) {
+  // Rows normally arrive one by one while the analysis runs; render the
+  // full result only when nothing was streamed (e.g. a reused analysis)
+  if (cursor === 0) {
+    $.each(data.value.result_data, function (key, value) {
+      add_reference(value);
+    });
+  }
+  if (!outlined) {
+    fill_document_information(data.value.metadata, $(".meta-grid"));
+  }
+
+  update_summary();
   const summary = document.getElementsByClassName("linkrot-summary")[0];
   summary.innerHTML = 'Linkrot Summary <i class="fa fa-check"></i>';
   setTimeout(() => (summary.innerHTML = "Linkrot Summary"), 2000);
-
-  console.log("data");
 }
 function updateCounts(
   success,
@@ -132,20 +199,162 @@ function updateCounts(
   }
 }
 
+function show_progress(data) {
+  $.each(data.items, function (key, value) {
+    add_reference(value);
+  });
+  cursor = data.next;
+  if (data.items.length > 0) {
+    update_summary();
+  }
+}
+
+function show_result(data) {
+  if (data.successful === true) {
+    fill_data_gui(data);
+  } else {
+    console.error("analysis failed");
+  }
+}
+
 function get_status(task_id) {
   var url = "/result/" + task_id;
+  var params = { since: cursor };
+  if (!outlined && cursor === 0) params.outline = 1;
+  $.get(url, params)
+    .done(function (data) {
+      show_outline(data.outline);
+      show_progress(data);
+      if (data.ready === true) {
+        show_result(data);
+        return;
+      }
+      poll_delay =
+        data.items.length > 0 ? POLL_MIN : Math.min(poll_delay * 2, POLL_MAX);
+      setTimeout(get_status, poll_delay, task_id);
+    })
+    .fail(function () {
+      poll_delay = Math.min(poll_delay * 2, POLL_MAX);
+      setTimeout(get_status, poll_delay, task_id);
+    });
+}
+
+function watch_status(task_id) {
+  // Pushed events when the server streams them, polling otherwise
+  if (!window.EventSource) {
+    get_status(task_id);
+    return;
+  }
+  var source = new EventSource(
+    "/result/" + task_id + "/events?since=" + cursor
+  );
+  source.addEventListener("outline", function (e) {
+    show_outline(JSON.parse(e.data));
+  });
+  source.addEventListener("progress", function (e) {
+    show_progress(JSON.parse(e.data));
+  });
+  source.addEventListener("result", function (e) {
+    source.close();
+    var data = JSON.parse(e.data);
+    show_progress(data);
+    show_result(data);
+  });
+  source.onerror = function () {
+    // a dropped stream reconnects by itself, a refused one stays closed
+    if (source.readyState === EventSource.CLOSED) {
+      get_status(task_id);
+    }
+  };
+}
+
+function download_reference_pdfs() {
+  var label = $("#resourceDownload .download-label");
+  label.text("Preparing archive...");
+  $.post("/downloadpdf")
+    .done(function (data) {
+      setTimeout(poll_download, 1000, data.status, label);
+    })
+    .fail(function () {
+      label.text("Available once the analysis finishes");
+    });
+}
+
+function poll_download(url, label) {
   $.get(url).done(function (data) {
-    console.log(data);
     if (data.successful === true) {
-      fill_data_gui(data);
+      label.html("Download Reference&nbsp;PDFs");
+      window.location = data.archive;
+    } else if (data.ready === true) {
+      label.text("Download failed");
     } else {
-      console.log(" no success");
-      setTimeout(get_status, 2000, task_id);
+      setTimeout(poll_download, 1000, url, label);
     }
   });
 }
 
+function read_check_stream(response, on_result) {
+  // /check/batch answers with one JSON line per url as each check finishes
+  if (!response.ok) {
+    throw new Error("batch check failed: " + response.status);
+  }
+  var reader = response.body.getReader();
+  var decoder = new TextDecoder();
+  var buffer = "";
+
+  function pump() {
+    return reader.read().then(function (chunk) {
+      if (chunk.done) {
+        return;
+      }
+      buffer += decoder.decode(chunk.value, { stream: true });
+      var lines = buffer.split("\n");
+      buffer = lines.pop();
+      $.each(lines, function (key, line) {
+        if (line) {
+          on_result(JSON.parse(line));
+        }
+      });
+      return pump();
+    });
+  }
+  return pump();
+}
+
+function recheck_all() {
+  var rows = $(".analysis-ref").toArray();
+  var label = $("#recheckLinks .recheck-label");
+  if (rows.length === 0) {
+    return;
+  }
+  var urls = rows.map(function (row) {
+    return $(row).find("input").val();
+  });
+  counts.success = counts.error403 = counts.error404 = counts.errorOther = 0;
+  label.text("Rechecking...");
+
+  fetch("/check/batch", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ urls: urls, recheck: true }),
+  })
+    .then(function (response) {
+      return read_check_stream(response, function (result) {
+        set_row_status($(rows[result.index]), result.status);
+        count_status(result.status);
+        update_summary();
+      });
+    })
+    .then(function () {
+      label.html("Recheck All&nbsp;Links");
+    })
+    .catch(function (err) {
+      console.error(err);
+      label.text("Recheck failed");
+    });
+}
+
 $(document).ready(function () {
   var task_id = $("#taskid").data("taskid");
-  setTimeout(get_status, 2000, task_id);
+  watch_status(task_id);
 });
@@ -0,0 +1,150 @@
+'''
+file: statuscache.py
+description: Shared Redis cache of link check results keyed on normalized url
+
+Next to the status of a link its ETag and Last-Modified validators are
+kept for VALIDATOR_TTL, longer than any status, so the check after the
+status expired can be a conditional request (see linkcheck.fetch_status).
+'''
+
+import json
+import os
+import time
+from urllib.parse import urlsplit, urlunsplit
+import redis
+from linkrot.downloader import sanitize_url
+import metrics
+import utilites
+
+KEY_PREFIX = 'linkcheck:status:'
+VALIDATORS_PREFIX = 'linkcheck:validators:'
+HITS_KEY = 'linkcheck:cache:hits'
+MISSES_KEY = 'linkcheck:cache:misses'
+
+# Seconds to keep a result, by outcome
+TTL_OK = int(os.environ.get('STATUS_CACHE_TTL_OK', 7 * 24 * 3600))
+TTL_CLIENT_ERROR = int(os.environ.get('STATUS_CACHE_TTL_CLIENT_ERROR', 24 * 3600))
+TTL_ERROR = int(os.environ.get('STATUS_CACHE_TTL_ERROR', 300))
+# Seconds to keep the validators of a link
+VALIDATOR_TTL = int(os.environ.get('VALIDATOR_TTL', 30 * 24 * 3600))
+# Rate limited answers say nothing about the link and are never cached
+THROTTLED_STATUSES = ('429', '503')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    ''' Cache key form of url: scheme and host lower-cased, no fragment '''
+    parts = urlsplit(sanitize_url(url.strip()))
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += ':%d' % parts.port
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def ttl_for(status):
+    ''' Successes are kept long, client errors shorter, the rest briefly '''
+    try:
+        code = int(status)
+    except (TypeError, ValueError):
+        return TTL_ERROR
+    if 200 <= code < 400:
+        return TTL_OK
+    if 400 <= code < 500:
+        return TTL_CLIENT_ERROR
+    return TTL_ERROR
+
+
+def lookup(url):
+    ''' Cached entry for url or None '''
+    try:
+        entry = utilites.get_redis().get(KEY_PREFIX + normalize_url(url))
+    except redis.RedisError:
+        return None
+    return json.loads(entry) if entry else None
+
+
+def store(url, status, final_url=None):
+    entry = dict(status=status, checked=time.time(), url=final_url or url)
+    try:
+        utilites.get_redis().set(KEY_PREFIX + normalize_url(url),
+                                 json.dumps(entry), ex=ttl_for(status))
+    except redis.RedisError:
+        pass
+    return entry
+
+
+def lookup_validators(url):
+    '''
+    Validators of the last successful check of url: a dict of its status,
+    final url, etag, last_modified, body length and seconds, or None
+    '''
+    try:
+        entry = utilites.get_redis().get(VALIDATORS_PREFIX + normalize_url(url))
+    except redis.RedisError:
+        return None
+    return json.loads(entry) if entry else None
+
+
+def store_validators(url, validators):
+    try:
+        utilites.get_redis().set(VALIDATORS_PREFIX + normalize_url(url),
+                                 json.dumps(validators), ex=VALIDATOR_TTL)
+    except redis.RedisError:
+        pass
+
+
+def count(key):
+    try:
+        utilites.get_redis().incr(key)
+    except redis.RedisError:
+        pass
+
+
+def lookup_status(url):
+    ''' Cached status of url, counted as a hit, or None '''
+    entry = lookup(url)
+    if entry is None:
+        return None
+    count(HITS_KEY)
+    return entry['status']
+
+
+def cached_status(url, fetch, recheck=False):
+    '''
+    Status of url from the cache, calling fetch(url) -> (status, final url)
+    on a miss. recheck skips the cached entry and refreshes it.
+    '''
+    if not recheck:
+        status = lookup_status(url)
+        if status is not None:
+            return status
+    count(MISSES_KEY)
+    status, final_url = fetch(url)
+    if str(status) not in THROTTLED_STATUSES:
+        store(url, status, final_url)
+    return status
+
+
+def cache_stats():
+    ''' Hit and miss counters shared by every worker '''
+    try:
+        hits, misses = utilites.get_redis().mget(HITS_KEY, MISSES_KEY)
+    except redis.RedisError:
+        hits, misses = None, None
+    hits, misses = int(hits or 0), int(misses or 0)
+    total = hits + misses
+    return dict(hits=hits, misses=misses,
+                hit_rate=round(hits / total, 4) if total else 0.0)
+
+
+@metrics.collector
+def cache_metrics():
+    stats = cache_stats()
+    return [('rr_status_cache_hits_total', 'counter',
+             'Link checks answered from the status cache',
+             [({}, stats['hits'])]),
+            ('rr_status_cache_misses_total', 'counter',
+             'Link checks that had to contact the host',
+             [({}, stats['misses'])])]
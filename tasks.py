@@ -1,14 +1,91 @@
+import logging
+import os
+import time
 from celery import shared_task
-from celery import group
+from celery import chord, states
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from celery.exceptions import WorkerLostError
 import linkrot
-from linkrot.downloader import get_status_code
 from urllib.parse import urlparse
-from time import sleep
+from linkcheck import check_urls, safe_status, get_status_code
+from statuscache import lookup_status
+from download import write_archive
+from refindex import ref_url
+from politeness import HostLimiter, schedule_batches
+import extraction
+import metrics
+import progress
+import queues
+import refindex
+import redisreport
+import workspace
 
-@shared_task(ignore_result=False)
-def pdfdata_task(path):
-    pdf = linkrot.linkrot(path)
-    metadata = pdf.get_metadata()
+# 'batch' checks BATCH_SIZE references per task, 'task' one per task
+CHECK_ENGINE = os.environ.get('CHECK_ENGINE', 'batch')
+BATCH_SIZE = int(os.environ.get('CHECK_BATCH_SIZE', 50))
+
+# Tasks whose result a browser waits for under the task id
+WATCHED_TASKS = ('tasks.pdfdata_task', 'tasks.merge_pages',
+                 'tasks.aggregate_results', 'tasks.build_download_archive')
+
+# Fields of the per-reference records in result_data
+RESULT_TYPE, RESULT_URL, RESULT_STATUS = range(3)
+
+logger = logging.getLogger(__name__)
+
+PDF_PARSE_SECONDS = metrics.Histogram(
+    'rr_pdf_parse_seconds', 'Seconds spent parsing uploaded PDFs, by step')
+PDF_REFERENCES = metrics.Histogram(
+    'rr_pdf_references', 'References extracted per PDF', metrics.COUNT_BUCKETS)
+CHECK_SECONDS = metrics.Histogram(
+    'rr_link_check_seconds', 'Seconds per reference check, cache hits included')
+TASK_SECONDS = metrics.Histogram(
+    'rr_task_seconds', 'Seconds Celery tasks ran, by task')
+TASK_QUEUE_WAIT = metrics.Histogram(
+    'rr_task_queue_wait_seconds', 'Seconds Celery tasks waited to be started')
+TASKS = metrics.Counter('rr_tasks_total', 'Celery tasks run, by task and state')
+PAPERS_ROUTED = metrics.Counter(
+    'rr_papers_routed_total', 'Papers whose link checks were queued, by queue')
+CHECKS_RESUMED = metrics.Counter(
+    'rr_checks_resumed_total',
+    'References a rerun check task took from the progress stream of its job')
+
+# perf_counter at the start of the tasks running in this process
+_task_started = dict()
+
+
+@before_task_publish.connect
+def stamp_published(headers=None, **kwargs):
+    """ Send the publish time along, for the queue wait of the task """
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    published = getattr(task.request, 'published_at', None)
+    if published:
+        TASK_QUEUE_WAIT.observe(max(0.0, time.time() - published),
+                                task=task.name)
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def stop_task_timer(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_SECONDS.observe(time.perf_counter() - started, task=task.name)
+    TASKS.inc(task=task.name, state=state or 'UNKNOWN')
+
+
+@task_postrun.connect
+def announce_result(task_id=None, task=None, state=None, **kwargs):
+    """ Wake the event streams of a finished job, its result is stored """
+    if task.name in WATCHED_TASKS and state in states.READY_STATES:
+        progress.notify_done(task_id)
+
+
+def format_metadata(metadata):
     for key in metadata:
         if "Date" in key:
             value = metadata[key]
@@ -20,50 +97,317 @@ def pdfdata_task(path):
                                                                        s=value[14:16],
                                                                        th=value[16:19],
                                                                        tm=value[20:22])
-    refs = pdf.get_references()
-    g = group(sort_ref.s(dict(reftype=ref_row.reftype, ref=ref_row.ref)) for ref_row in refs)
-    res = g()
-    while not res.ready():
-        sleep(1)
-    result_data = list()
-    for child in res:
-        result_data.append(child.result)
-    return {'metadata': metadata, 'result_data': result_data}
+    return metadata
 
-@shared_task(ignore_result=False)
-def sort_ref(ref_dict):
-    result = dict(pdfs=[],
-                    urls=[],
-                    arxiv=[],
-                    doi=[],
-                    check = []
-                  )
-    if ref_dict['reftype'] == 'arxiv':
-        url = "https://arxiv.org/abs/"+ref_dict['ref']
-        result['arxiv'].append(url)
-    elif ref_dict['reftype'] == 'doi':
-        url = "https://doi.org/"+ref_dict['ref']
-        result['doi'].append(url)
+
+@shared_task(bind=True, ignore_result=False)
+def pdfdata_task(self, path, submitter=None):
+    """
+    Extract metadata and references from the PDF, then hand the link
+    checks over to a chord instead of waiting on them here.
+
+    The chord replaces this task and inherits its id, so the aggregated
+    result is stored under the id the front end is already polling while
+    this worker slot is released straight away. Each check also publishes
+    its result to the progress stream of that id as soon as it finishes.
+
+    The extracted references are kept in the reference index of the task
+    id, so a rerun of the same task skips parsing the PDF, and announced
+    so the page lists them as pending before any link is checked. The
+    ids of the checks go to the callback, which forgets their results
+    once they are aggregated.
+
+    The checks are queued by the size of the paper and the references
+    submitter already has in flight, see queues.check_queue.
+
+    A PDF of more than extraction.EXTRACT_SPLIT_PAGES pages is read by
+    extract_pages tasks over page ranges in parallel instead, and
+    merge_pages carries on with their merged references.
+    """
+    fail_lost_redeliveries(self)
+    job_id = self.request.id
+    index = refindex.load(job_id)
+    pages = extraction.page_count(path) if index is None else 0
+    if pages > extraction.EXTRACT_SPLIT_PAGES:
+        header = [extract_pages.s(path, start, stop)
+                  for start, stop in extraction.page_ranges(pages)]
+        child_ids = [signature.freeze().id for signature in header]
+        return self.replace(chord(header, merge_pages.s(
+            path, child_ids, submitter)))
+    metadata, ref_dicts = load_references(path, job_id, index)
+    # a stored index means this analysis ran before, checks may be done
+    return check_references(self, metadata, ref_dicts, submitter,
+                            resume=index is not None or redelivered(self))
+
+
+@shared_task(bind=True, ignore_result=False)
+def extract_pages(self, path, start, stop):
+    """ Raw references of pages [start, stop) of the PDF, see extraction """
+    fail_lost_redeliveries(self)
+    with PDF_PARSE_SECONDS.time(step='pages'):
+        return extraction.extract_range(path, start, stop)
+
+
+@shared_task(bind=True, ignore_result=False)
+def merge_pages(self, parts, path, child_ids=(), submitter=None):
+    """
+    Chord callback of the page range extraction of pdfdata_task. It
+    inherits the id of the analysis, merges and stores the references of
+    the ranges, forgets the results of the range tasks (child_ids) and
+    hands the link checks over like pdfdata_task does.
+    """
+    fail_lost_redeliveries(self)
+    job_id = self.request.id
+    forget_results(self.app.backend, child_ids)
+    with PDF_PARSE_SECONDS.time(step='merge'):
+        metadata = format_metadata(extraction.read_metadata(path))
+        refs = extraction.merge(parts)
+    index = index_references(job_id, metadata, refs)
+    return check_references(self, index['metadata'],
+                            refindex.ref_dicts(index), submitter,
+                            resume=redelivered(self))
+
+
+def redelivered(task):
+    """ Whether the broker handed task out before, to a worker since lost """
+    return bool((task.request.delivery_info or {}).get('redelivered'))
+
+
+def fail_lost_redeliveries(task):
+    """
+    Fail the PDF task task once it was redelivered more often than
+    queues.TASK_MAX_DELIVERIES allows, as when the document crashes the
+    worker reading it, instead of handing it to the next worker forever.
+    """
+    if not redelivered(task):
+        return
+    if queues.deliveries_exhausted(task.name, task.request.id):
+        raise WorkerLostError('%s was delivered %d times without finishing'
+                              % (task.name, queues.TASK_MAX_DELIVERIES))
+
+
+def check_references(task, metadata, ref_dicts, submitter=None,
+                     resume=False):
+    """
+    Announce the extracted references of the job of task and replace the
+    task by the chord checking them. resume has the checks skip the
+    references an earlier run of the job already published.
+    """
+    job_id = task.request.id
+    progress.notify_outline(job_id)
+    if not ref_dicts:
+        return {'metadata': metadata, 'result_data': []}
+    if CHECK_ENGINE == 'batch':
+        header = [check_refs_batch.s(batch, job_id, resume)
+                  for batch in schedule_batches(ref_dicts, BATCH_SIZE)]
     else:
-        url = ref_dict['ref']
-    
-    try:
-        stat = str(get_status_code(url))
-    except:
-        stat = 0
-    
-    result["check"].append(stat)
-
-    if ref_dict['reftype'] == 'url':
+        header = [sort_ref.s(ref_dict, job_id, resume)
+                  for ref_dict in ref_dicts]
+    queue = queues.check_queue(len(ref_dicts), submitter)
+    PAPERS_ROUTED.inc(queue=queue)
+    for signature in header:
+        signature.set(queue=queue)
+    child_ids = [signature.freeze().id for signature in header]
+    return task.replace(chord(header, aggregate_results.s(
+        metadata, child_ids, submitter)))
+
+
+def load_references(path, job_id, index=None):
+    """
+    Metadata and reference dicts of the PDF at path, read from index or
+    the reference index of job_id when one was stored, parsed and stored
+    otherwise.
+    """
+    if index is None:
+        index = refindex.load(job_id)
+    if index is None:
+        with PDF_PARSE_SECONDS.time(step='open'):
+            pdf = linkrot.linkrot(path)
+            metadata = format_metadata(pdf.get_metadata())
+        with PDF_PARSE_SECONDS.time(step='references'):
+            refs = pdf.get_references()
+        index = index_references(job_id, metadata, refs)
+    return index['metadata'], refindex.ref_dicts(index)
+
+
+def index_references(job_id, metadata, refs):
+    """ Build and store the reference index of job_id """
+    PDF_REFERENCES.observe(len(refs))
+    index = refindex.build(metadata, refs)
+    refindex.save(job_id, index)
+    return index
+
+
+def analyse_pdf(path, job_id):
+    """
+    The whole analysis of pdfdata_task run in the calling thread, for the
+    in-process mode without Celery. Returns the aggregated payload. A
+    PDF of more than extraction.EXTRACT_SPLIT_PAGES pages is read in page
+    ranges on a process pool.
+    """
+    index = refindex.load(job_id)
+    resume = index is not None
+    if index is None and extraction.should_split(path):
+        with PDF_PARSE_SECONDS.time(step='pages'):
+            metadata, refs = extraction.extract(path)
+        index = index_references(job_id, format_metadata(metadata), refs)
+    metadata, ref_dicts = load_references(path, job_id, index)
+    progress.notify_outline(job_id)
+    return {'metadata': metadata,
+            'result_data': check_refs(ref_dicts, job_id, resume)}
+
+
+@shared_task(bind=True, ignore_result=False)
+def aggregate_results(self, result_data, metadata, child_ids=(),
+                      submitter=None):
+    """
+    Chord callback building the final analysis payload.
+
+    Batch checks return a list of per-reference records, single checks
+    return one record; both are flattened into result_data. The results
+    of the checks (child_ids) are only needed up to here and are removed
+    from the backend instead of waiting for result_expires, and the
+    references leave the in-flight count of submitter, once even when
+    the callback is delivered again.
+    """
+    forget_results(self.app.backend, child_ids)
+    flat = list()
+    for item in result_data:
+        if not item or isinstance(item[0], list):
+            flat.extend(item)
+        else:
+            flat.append(item)
+    queues.checks_done(len(flat), submitter, self.request.id)
+    return {'metadata': metadata, 'result_data': flat}
+
+
+def forget_results(backend, task_ids):
+    """ Remove the stored results of task_ids, ignoring backend errors """
+    for task_id in task_ids:
+        try:
+            backend.forget(task_id)
+        except Exception:
+            logger.warning('could not forget result %s', task_id)
+
+
+@shared_task(ignore_result=True)
+def report_redis_memory():
+    """ Periodic log of Redis keys and memory per key class """
+    redisreport.log_report()
+
+
+def build_ref_result(ref_dict, stat):
+    """
+    Compact [type, url, status] record of a checked reference, indexed by
+    RESULT_TYPE, RESULT_URL and RESULT_STATUS. Plain urls on doi.org or
+    arxiv.org hosts are typed as doi or arxiv references.
+    """
+    reftype = ref_dict['reftype']
+    url = ref_url(ref_dict)
+    if reftype == 'url':
         host = urlparse(url).hostname
         if host and host.endswith(".doi.org"):
-            result['doi'].append(url)
+            reftype = 'doi'
         elif host and host.endswith(".arxiv.org"):
-            result['arxiv'].append(url)
-        else:
-            if not urlparse(url).scheme:
-                url = 'https://' + url
-            result['urls'].append(url)
-    elif ref_dict['reftype'] == 'pdf':
-        result['pdfs'].append(url)
+            reftype = 'arxiv'
+        elif not urlparse(url).scheme:
+            url = 'https://' + url
+    return [reftype, url, stat]
+
+
+def reference_outline(job_id):
+    """
+    Metadata and [type, url] records of the references of job_id, from
+    the reference index once they are extracted and before any check
+    finished; None until then.
+    """
+    index = refindex.load(job_id)
+    if index is None:
+        return None
+    return {'metadata': index['metadata'],
+            'references': [build_ref_result(ref_dict, None)[:RESULT_STATUS]
+                           for ref_dict in refindex.ref_dicts(index)]}
+
+
+def published_results(job_id):
+    """ Results of job_id in its progress stream, by their url """
+    return progress.checked(job_id, lambda result: result[RESULT_URL])
+
+
+@shared_task(bind=True, ignore_result=False)
+def sort_ref(self, ref_dict, job_id=None, resume=False):
+    """
+    Check one reference. A redelivered task, or one of a rerun analysis
+    (resume), returns the result published before; reading the stream on
+    every delivery would cost each task the results of all the others.
+    """
+    if resume or redelivered(self):
+        url = build_ref_result(ref_dict, None)[RESULT_URL]
+        result = published_results(job_id).get(url)
+        if result is not None:
+            CHECKS_RESUMED.inc()
+            return result
+    stat = safe_status(ref_url(ref_dict), CHECK_SECONDS.wrap(get_status_code))
+    result = build_ref_result(ref_dict, stat)
+    progress.publish(job_id, [result])
     return result
+
+
+def fetch_status_code(url):
+    """ Status of url asked from its host, refreshing the status cache """
+    return get_status_code(url, recheck=True)
+
+
+def check_refs(ref_dicts, job_id=None, resume=False):
+    """
+    Check references concurrently.
+
+    Returns one sort_ref shaped result per reference, in input order, and
+    publishes each one to the progress stream of job_id as it finishes.
+    Cached statuses are looked up first, only the checks that go out to
+    the hosts pass the shared per-host limits of HostLimiter.
+    With resume, references with a result in the progress stream of
+    job_id, published by an earlier run, are not checked again; the
+    stream is only read then, as it holds the results of the whole job.
+    """
+    published = published_results(job_id) if resume else {}
+    results = [published.get(build_ref_result(ref_dict, None)[RESULT_URL])
+               for ref_dict in ref_dicts]
+    todo = [index for index, result in enumerate(results) if result is None]
+    if len(todo) < len(ref_dicts):
+        CHECKS_RESUMED.inc(len(ref_dicts) - len(todo))
+
+    def on_result(index, stat):
+        progress.publish(job_id,
+                         [build_ref_result(ref_dicts[todo[index]], stat)])
+
+    statuses = check_urls([ref_url(ref_dicts[index]) for index in todo],
+                          CHECK_SECONDS.wrap(fetch_status_code),
+                          on_result=on_result, limiter=HostLimiter(),
+                          lookup=CHECK_SECONDS.wrap(lookup_status))
+    for index, stat in zip(todo, statuses):
+        results[index] = build_ref_result(ref_dicts[index], stat)
+    return results
+
+
+@shared_task(bind=True, ignore_result=False)
+def check_refs_batch(self, ref_dicts, job_id=None, resume=False):
+    """
+    Check a chunk of references concurrently in one task, resuming from
+    the progress stream when redelivered or resume is set
+    """
+    return check_refs(ref_dicts, job_id, resume or redelivered(self))
+
+
+@shared_task(ignore_result=False)
+def build_download_archive(source_path, pdf_urls, archive_path, infos):
+    """
+    Zip the uploaded PDF with every PDF it references. The urls come from
+    the reference index of the analysis instead of parsing the PDF again.
+    """
+    downloaded, failed = write_archive(archive_path, source_path, pdf_urls,
+                                       infos)
+    if os.path.exists(archive_path):
+        workspace.add_bytes(os.path.dirname(archive_path),
+                            os.path.getsize(archive_path))
+    return {'downloaded': downloaded, 'failed': failed}
@@ -3,11 +3,12 @@ import os
 import tempfile
 import shutil
 from unittest.mock import Mock, patch
+import fakeredis
 from app import app
 
 
 @pytest.fixture
-def client():
+def client(fake_redis):
     """Create a test client for the Flask application."""
     # Set test configuration
     app.config['TESTING'] = True
@@ -130,4 +131,11 @@ def mock_requests():
     """Mock requests for testing."""
     with patch('requests.post') as mock:
         mock.return_value.json.return_value = {'success': True}
-        yield mock
\ No newline at end of file
+        yield mock
+
+@pytest.fixture
+def fake_redis():
+    """Replace the shared Redis client with an in-memory fake."""
+    server = fakeredis.FakeRedis()
+    with patch('utilites.get_redis', return_value=server):
+        yield server
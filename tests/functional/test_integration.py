@@ -1,18 +1,18 @@
 from unittest.mock import patch, Mock
 from io import BytesIO
+from tasks import build_download_archive
 
 
 class TestApplicationIntegration:
     """Integration tests for the complete application."""
     
-    @patch('app.linkrot.linkrot')
     @patch('app.validateCaptcha')
-    @patch('app.pdfdata_task.delay')
+    @patch('app.pdfdata_task.apply_async')
     @patch('tasks.linkrot.linkrot')
     @patch('tasks.get_status_code')
     def test_full_pdf_processing_integration(
             self, mock_status, mock_task_linkrot,
-            mock_pdfdata_delay, mock_captcha, mock_app_linkrot,
+            mock_pdfdata_delay, mock_captcha,
             client, sample_pdf_file):
         """Test the complete PDF processing pipeline."""
         # Setup mocks
@@ -20,10 +20,6 @@ class TestApplicationIntegration:
         mock_status.return_value = 200
         mock_pdfdata_delay.return_value = Mock(id='task_123')
         
-        # Mock app linkrot
-        mock_app_pdf = Mock()
-        mock_app_linkrot.return_value = mock_app_pdf
-        
         # Mock task linkrot 
         mock_task_pdf = Mock()
         mock_task_pdf.get_metadata.return_value = {
@@ -83,8 +79,7 @@ class TestApplicationIntegration:
         # Step 3: Simulate task completion and check result
         with patch('app.AsyncResult') as mock_result:
             mock_result_instance = Mock()
-            mock_result_instance.ready.return_value = True
-            mock_result_instance.successful.return_value = True
+            mock_result_instance.state = 'SUCCESS'
             mock_result_instance.result = {
                 'metadata': {
                     'Title': 'Test Research Paper',
@@ -92,13 +87,9 @@ class TestApplicationIntegration:
                     'CreationDate': '2024-01-01 12:00 UTC+00:00'
                 },
                 'result_data': [
-                    {
-                        'urls': ['https://example.com/paper.html'],
-                        'doi': ['https://doi.org/10.1000/182'],
-                        'arxiv': ['https://arxiv.org/abs/1234.5678'],
-                        'pdfs': [],
-                        'check': ['200', '200', '200']
-                    }
+                    ['url', 'https://example.com/paper.html', '200'],
+                    ['doi', 'https://doi.org/10.1000/182', '200'],
+                    ['arxiv', 'https://arxiv.org/abs/1234.5678', '200']
                 ]
             }
             mock_result.return_value = mock_result_instance
@@ -134,8 +125,7 @@ class TestApplicationIntegration:
         # Test 4: Task result for non-existent task
         with patch('app.AsyncResult') as mock_result:
             mock_result_instance = Mock()
-            mock_result_instance.ready.return_value = False
-            mock_result_instance.successful.return_value = False
+            mock_result_instance.state = 'PENDING'
             mock_result_instance.result = None
             mock_result.return_value = mock_result_instance
             
@@ -145,7 +135,7 @@ class TestApplicationIntegration:
             result_data = pending_response.get_json()
             assert result_data['ready'] is False
     
-    @patch('app.pdfdata_task.delay')
+    @patch('app.pdfdata_task.apply_async')
     @patch('app.validateCaptcha')
     def test_captcha_integration(self, mock_captcha, mock_pdfdata_delay, client, sample_pdf_file):
         """Test captcha validation integration."""
@@ -193,37 +183,47 @@ class TestApplicationIntegration:
             
             assert response.status_code == 200, f"Failed for {url}"
     
-    @patch('app.linkrot.linkrot')
-    @patch('app.shutil.make_archive')
-    @patch('app.os.mkdir')
-    @patch('app.os.remove')
-    @patch('app.shutil.rmtree')
+    @patch('tasks.write_archive')
     @patch('app.send_from_directory')
-    def test_download_integration(self, mock_send, mock_rmtree, mock_remove,
-                                  mock_mkdir, mock_archive, mock_linkrot,
-                                  client):
+    @patch('app.build_download_archive.apply_async')
+    @patch('app.AsyncResult')
+    def test_download_integration(self, mock_result, mock_apply, mock_send,
+                                  mock_write, client):
         """Test download functionality integration."""
-        mock_linkrot_instance = Mock()
-        mock_linkrot.return_value = mock_linkrot_instance
+        analysis = {
+            'metadata': {'Title': 'Test'},
+            'result_data': [['pdf', 'https://example.com/a.pdf', '200']]
+        }
+        mock_result.return_value.ready.return_value = True
+        mock_result.return_value.successful.return_value = True
+        mock_result.return_value.result = analysis
         mock_send.return_value = 'download_response'
+        mock_write.return_value = (1, 0)
         
-        # Set up session as if file was uploaded
+        # Set up session as if file was uploaded and analysed
         with client.session_transaction() as sess:
             sess['file'] = 'test_document'
-            sess['path'] = '/tmp/test_document.pdf'
+            sess['path'] = '/tmp/job-123/test_document.pdf'
             sess['type'] = 'file'
-        
-        # Trigger download
-        client.get('/downloadpdf')
-        
-        # Verify all file operations were called
-        mock_linkrot.assert_called_once_with('/tmp/test_document.pdf')
-        mock_linkrot_instance.download_pdfs.assert_called_once()
-        mock_mkdir.assert_called_once()
-        mock_archive.assert_called_once()
+            sess['task_id'] = 'analysis_123'
+        
+        # Trigger download and run the job it queued
+        response = client.post('/downloadpdf')
+        assert response.status_code == 202
+        args = mock_apply.call_args[0][0]
+        assert build_download_archive(*args) == {'downloaded': 1,
+                                                 'failed': 0}
+        
+        # The archive is built from the analysis without parsing the PDF
+        mock_write.assert_called_once_with(
+            args[2], '/tmp/job-123/test_document.pdf',
+            ['https://example.com/a.pdf'], args[3])
+        assert args[2].startswith('/tmp/job-123/')
+        
+        with patch('app.workspace.remove'):
+            client.get('/downloadpdf/%s/archive' %
+                       response.get_json()['task_id'])
         mock_send.assert_called_once()
-        assert mock_remove.call_count == 2
-        mock_rmtree.assert_called_once()
     
     @patch('app.sanitize_url')
     @patch('app.get_status_code')
@@ -0,0 +1,133 @@
+import fitz
+import pytest
+from unittest.mock import patch, Mock
+from celery import Celery, _state
+from celery.contrib.testing.worker import start_worker
+import progress
+import queues
+import refindex
+import tasks
+
+
+WORKER_SLOTS = 2
+CONCURRENT_UPLOADS = 6
+REFS_PER_PAPER = 3
+
+
+@pytest.fixture
+def load_celery_app():
+    """A Celery app with an in-memory broker and a small worker."""
+    previous = _state.default_app
+    app = Celery('loadtest',
+                 broker='memory://',
+                 backend='cache+memory://',
+                 set_as_current=True)
+    app.conf.broker_transport_options = {'polling_interval': 0.01}
+    app.conf.task_queues = queues.task_queues()
+    app.conf.task_routes = queues.TASK_ROUTES
+    app.conf.task_acks_late = True
+    app.set_default()
+    app.finalize()
+    try:
+        with start_worker(app, pool='threads', concurrency=WORKER_SLOTS,
+                          perform_ping_check=False, shutdown_timeout=10):
+            yield app
+    finally:
+        _state.set_default_app(previous)
+        if previous is not None:
+            previous.set_current()
+
+
+class TestAnalysisLoad:
+    """Load tests for the analysis pipeline."""
+    
+    @patch('tasks.get_status_code')
+    @patch('tasks.linkrot.linkrot')
+    def test_concurrent_uploads_do_not_hold_worker_slots(
+            self, mock_linkrot, mock_status, fake_redis, load_celery_app):
+        """Test more concurrent uploads than worker slots all complete.
+        
+        While waiting on its subtasks the old pdfdata_task held a slot, so
+        with more uploads than slots every slot ended up blocked by a parent
+        and no sort_ref could run.
+        """
+        mock_pdf = Mock()
+        mock_pdf.get_metadata.return_value = {'Title': 'Test PDF'}
+        refs = []
+        for i in range(REFS_PER_PAPER):
+            ref = Mock()
+            ref.reftype = 'url'
+            ref.ref = 'https://example.com/%d' % i
+            ref.page = 1
+            refs.append(ref)
+        mock_pdf.get_references.return_value = refs
+        mock_linkrot.return_value = mock_pdf
+        mock_status.return_value = 200
+        
+        pdfdata_task = load_celery_app.tasks[tasks.pdfdata_task.name]
+        results = [pdfdata_task.delay('/test/path_%d.pdf' % i)
+                   for i in range(CONCURRENT_UPLOADS)]
+        
+        for result in results:
+            value = result.get(timeout=60, interval=0.05)
+            assert value['metadata'] == {'Title': 'Test PDF'}
+            assert len(value['result_data']) == REFS_PER_PAPER
+            assert value['result_data'][0][2] == '200'
+    
+    @patch('tasks.get_status_code', return_value=200)
+    @patch('tasks.extraction.EXTRACT_SPLIT_PAGES', 2)
+    @patch('tasks.extraction.EXTRACT_RANGE_PAGES', 2)
+    def test_large_pdf_extracted_in_page_ranges(
+            self, mock_status, fake_redis, load_celery_app, tmp_path):
+        """Test a PDF past the threshold runs through both chords.
+        
+        The range tasks feed merge_pages, which replaces itself by the
+        chord of checks, so the result still lands under the upload id.
+        """
+        doc = fitz.open()
+        for page in range(7):
+            doc.new_page().insert_text(
+                (36, 40), 'https://example.com/%d https://example.com/0'
+                % page, fontsize=9)
+        path = str(tmp_path / 'thesis.pdf')
+        doc.save(path)
+        doc.close()
+        
+        pdfdata_task = load_celery_app.tasks[tasks.pdfdata_task.name]
+        result = pdfdata_task.delay(path)
+        
+        value = result.get(timeout=60, interval=0.05)
+        assert value['metadata']['Pages'] == 7
+        assert sorted(row[1] for row in value['result_data']) == [
+            'https://example.com/%d' % page for page in range(7)]
+        assert {row[2] for row in value['result_data']} == {'200'}
+    
+    @patch('tasks.get_status_code', return_value=200)
+    @patch('tasks.linkrot.linkrot')
+    def test_rerun_checks_only_unfinished_references(
+            self, mock_linkrot, mock_status, fake_redis, load_celery_app):
+        """Test a redelivered analysis resumes where its checks stopped.
+        
+        The reference index and the progress stream of the first run stay
+        in Redis, so the rerun neither parses the PDF nor checks a reference
+        twice.
+        """
+        refindex.save('job_1', {'metadata': {'Title': 'Test PDF'},
+                                'references': [
+            ['url', 'https://example.com/%d' % i,
+             'https://example.com/%d' % i, 1]
+            for i in range(REFS_PER_PAPER)]})
+        progress.publish('job_1', [['url', 'https://example.com/0', '404']])
+        
+        pdfdata_task = load_celery_app.tasks[tasks.pdfdata_task.name]
+        value = pdfdata_task.apply_async(
+            ('/test/path.pdf',), task_id='job_1').get(timeout=60,
+                                                      interval=0.05)
+        
+        mock_linkrot.assert_not_called()
+        assert mock_status.call_count == REFS_PER_PAPER - 1
+        assert sorted(value['result_data']) == [
+            ['url', 'https://example.com/0', '404'],
+            ['url', 'https://example.com/1', '200'],
+            ['url', 'https://example.com/2', '200']]
+        assert len(progress.read('job_1')) == REFS_PER_PAPER
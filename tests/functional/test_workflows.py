@@ -7,7 +7,7 @@ class TestFileUploadWorkflow:
     """Test the complete file upload workflow."""
     
     @patch('app.validateCaptcha')
-    @patch('app.pdfdata_task.delay')
+    @patch('app.pdfdata_task.apply_async')
     def test_complete_pdf_upload_workflow(self, mock_task, mock_captcha,
                                           client, sample_pdf_file):
         """Test complete PDF upload and processing workflow."""
@@ -83,8 +83,7 @@ class TestTaskResultWorkflow:
     def test_task_result_complete_workflow(self, mock_result, client):
         """Test complete task result workflow."""
         mock_result_instance = Mock()
-        mock_result_instance.ready.return_value = True
-        mock_result_instance.successful.return_value = True
+        mock_result_instance.state = 'SUCCESS'
         mock_result_instance.result = {
             'metadata': {'Title': 'Test PDF'},
             'result_data': []
@@ -103,8 +102,7 @@ class TestTaskResultWorkflow:
     def test_task_result_pending_workflow(self, mock_result, client):
         """Test pending task result workflow."""
         mock_result_instance = Mock()
-        mock_result_instance.ready.return_value = False
-        mock_result_instance.successful.return_value = False
+        mock_result_instance.state = 'PENDING'
         mock_result_instance.result = None
         mock_result.return_value = mock_result_instance
         
@@ -119,36 +117,36 @@ class TestTaskResultWorkflow:
 class TestDownloadWorkflow:
     """Test file download workflow."""
     
-    @patch('app.linkrot.linkrot')
-    @patch('app.shutil.make_archive')
-    @patch('app.os.mkdir')
-    @patch('app.os.remove')
-    @patch('app.shutil.rmtree')
     @patch('app.send_from_directory')
-    def test_download_workflow(self, mock_send, mock_rmtree, mock_remove,
-                               mock_mkdir, mock_archive, mock_linkrot,
+    @patch('app.build_download_archive.apply_async')
+    @patch('app.AsyncResult')
+    def test_download_workflow(self, mock_result, mock_archive, mock_send,
                                client):
-        """Test complete download workflow."""
-        mock_linkrot_instance = Mock()
-        mock_linkrot.return_value = mock_linkrot_instance
+        """Test start, poll and fetch of the reference PDF archive."""
+        mock_result.return_value.ready.return_value = True
+        mock_result.return_value.successful.return_value = True
+        mock_result.return_value.result = {'metadata': {}, 'result_data': []}
         mock_send.return_value = 'file_download'
         
         # Set up session data
         with client.session_transaction() as sess:
             sess['file'] = 'test_document'
-            sess['path'] = '/tmp/test_document.pdf'
+            sess['path'] = '/tmp/job-123/test_document.pdf'
             sess['type'] = 'file'
+            sess['task_id'] = 'analysis_123'
         
-        client.get('/downloadpdf')
+        started = client.post('/downloadpdf').get_json()
+        status = client.get(started['status']).get_json()
         
-        # Verify all the expected calls were made
-        mock_linkrot.assert_called_once_with('/tmp/test_document.pdf')
-        mock_linkrot_instance.download_pdfs.assert_called_once()
-        mock_mkdir.assert_called_once()
+        assert status['ready'] is True
         mock_archive.assert_called_once()
+        with patch('app.workspace.remove') as mock_remove:
+            client.get(status['archive'])
+        
+        # Verify the archive was sent and its workspace cleaned up
         mock_send.assert_called_once()
-        assert mock_remove.call_count == 2
-        mock_rmtree.assert_called_once()
+        assert mock_send.call_args[1]['download_name'] == 'test_document.zip'
+        mock_remove.assert_called_once_with('/tmp/job-123')
 
 
 class TestNavigationWorkflow:
@@ -199,7 +197,7 @@ class TestSessionManagement:
     """Test session management across workflows."""
     
     @patch('app.validateCaptcha')
-    @patch('app.pdfdata_task.delay')
+    @patch('app.pdfdata_task.apply_async')
     def test_session_data_persistence(self, mock_task, mock_captcha,
                                       client, sample_pdf_file):
         """Test that session data persists across requests."""
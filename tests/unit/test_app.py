@@ -1,7 +1,17 @@
+import os
+import json
 from unittest.mock import patch, Mock
 from io import BytesIO
+import redis
 from flask import session
-from app import app, allowed_file, validateCaptcha, pdfdata
+import progress
+import refindex
+import localjobs
+import workspace
+import queues
+import events
+import redisreport
+from app import app, allowed_file, validateCaptcha, pdfdata, submitter
 
 
 class TestAllowedFile:
@@ -66,6 +76,32 @@ class TestRoutes:
         response = client.get('/contribute')
         assert response.status_code == 200
     
+    def test_redis_stats(self, client, fake_redis):
+        """Test the endpoint serves the stored report without a scan."""
+        fake_redis.set('celery-task-meta-1', 'x')
+        redisreport.log_report()
+        
+        with patch('redisreport.report') as scan:
+            response = client.get('/redis/stats')
+        
+        scan.assert_not_called()
+        assert response.status_code == 200
+        assert response.get_json()['classes']['results']['keys'] == 1
+    
+    def test_metrics(self, client):
+        """Test /metrics serves the Prometheus text format."""
+        client.get('/about')
+        
+        response = client.get('/metrics')
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        text = response.get_data(as_text=True)
+        assert '# TYPE rr_request_seconds histogram' in text
+        assert 'rr_request_seconds_count{endpoint="about"} 1' in text
+        assert 'rr_status_cache_hits_total 0' in text
+        assert 'endpoint="metrics_endpoint"' not in text
+    
     def test_404_handler(self, client):
         """Test 404 error handler."""
         response = client.get('/nonexistent-page')
@@ -114,6 +150,78 @@ class TestUploadPDF:
         assert response.status_code == 200
         mock_captcha.assert_called_once()
         mock_pdfdata.assert_called_once()
+        
+        text = client.get('/metrics').get_data(as_text=True)
+        assert 'rr_uploads_total{outcome="accepted"} 1' in text
+        assert 'rr_upload_bytes_count 1' in text
+        assert ('rr_requests_total{endpoint="upload_pdf",status="200"} 1'
+                in text)
+    
+    @patch('app.validateCaptcha')
+    @patch('app.pdfdata')
+    def test_upload_fake_pdf_rejected(self, mock_pdfdata, mock_captcha,
+                                      client):
+        """Test a file that is not a PDF is refused before any analysis."""
+        mock_captcha.return_value = True
+        
+        data = {
+            'file': (BytesIO(b'<html>not a pdf</html>'), 'test.pdf'),
+            'g-recaptcha-response': 'test'
+        }
+        response = client.post('/', data=data)
+        
+        assert response.status_code == 400
+        mock_pdfdata.assert_not_called()
+    
+    @patch('app.validateCaptcha')
+    @patch('app.pdfdata')
+    def test_upload_same_name_separate_workspaces(self, mock_pdfdata,
+                                                  mock_captcha, client,
+                                                  sample_pdf_file):
+        """Test two uploads of one file name do not share a path."""
+        mock_captcha.return_value = True
+        mock_pdfdata.return_value = ({}, [], [], [], [], 'task_id_123')
+        
+        for _ in range(2):
+            with open(sample_pdf_file, 'rb') as f:
+                client.post('/', data={'file': (f, 'paper.pdf'),
+                                       'g-recaptcha-response': 'test'})
+        
+        first, second = [c[0][0] for c in mock_pdfdata.call_args_list]
+        assert first != second
+        assert os.path.basename(first) == os.path.basename(second) == 'paper.pdf'
+        assert os.path.exists(first) and os.path.exists(second)
+    
+    @patch('app.validateCaptcha')
+    @patch('app.workspace.create')
+    def test_upload_quota_exceeded(self, mock_create, mock_captcha, client):
+        """Test uploads are refused while the workspace quota is used up."""
+        mock_captcha.return_value = True
+        mock_create.side_effect = workspace.QuotaExceeded('full')
+        
+        data = {
+            'file': (BytesIO(b'%PDF-1.4\n%%EOF'), 'test.pdf'),
+            'g-recaptcha-response': 'test'
+        }
+        response = client.post('/', data=data)
+        
+        assert response.status_code == 503
+    
+    @patch('app.validateCaptcha')
+    def test_upload_too_large(self, mock_captcha, client, monkeypatch):
+        """Test bodies over the upload limit are cut off with 413."""
+        mock_captcha.return_value = True
+        monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024)
+        size = 4096
+        
+        data = {
+            'file': (BytesIO(b'%PDF-' + b'x' * size), 'test.pdf'),
+            'g-recaptcha-response': 'test'
+        }
+        response = client.post('/', data=data)
+        
+        assert response.status_code == 413
+        mock_captcha.assert_not_called()
     
     @patch('app.validateCaptcha')
     def test_upload_invalid_captcha(self, mock_captcha, client, sample_pdf_file):
@@ -140,7 +248,7 @@ class TestValidateCaptcha:
         result = validateCaptcha('any_response')
         assert result is True
     
-    @patch('requests.post')
+    @patch('httpclient.requests.Session.post')
     def test_validate_captcha_prod_env_success(self, mock_post):
         """Test successful captcha validation in prod environment."""
         app.config['ENV'] = 'PROD'
@@ -150,8 +258,10 @@ class TestValidateCaptcha:
         result = validateCaptcha('valid_response')
         assert result is True
         mock_post.assert_called_once()
+        assert mock_post.call_args.kwargs['data'] == {
+            'secret': 'test_secret', 'response': 'valid_response'}
     
-    @patch('requests.post')
+    @patch('httpclient.requests.Session.post')
     def test_validate_captcha_prod_env_failure(self, mock_post):
         """Test failed captcha validation in prod environment."""
         app.config['ENV'] = 'PROD'
@@ -165,7 +275,14 @@ class TestValidateCaptcha:
 class TestPDFData:
     """Test PDF data processing."""
     
-    @patch('app.pdfdata_task.delay')
+    def test_tasks_survive_worker_loss(self):
+        """Test tasks are acknowledged late and redelivered on worker loss."""
+        conf = app.extensions['celery'].conf
+        assert conf.task_acks_late is True
+        assert conf.task_reject_on_worker_lost is True
+        assert conf.broker_transport_options['visibility_timeout'] > 0
+    
+    @patch('app.pdfdata_task.apply_async')
     def test_pdfdata(self, mock_task, client):
         """Test pdfdata function."""
         mock_task.return_value = 'task_id_123'
@@ -181,6 +298,76 @@ class TestPDFData:
             assert doi == []
             assert task_id == 'task_id_123'
             assert session['path'] == '/test/path.pdf'
+    
+    @patch('app.pdfdata_task.apply_async')
+    def test_pdfdata_reuses_identical_upload(self, mock_task, client,
+                                             fake_redis):
+        """Test an upload with a known digest reuses its analysis."""
+        mock_task.side_effect = lambda args, kwargs, task_id: Mock(id=task_id)
+        
+        with patch('app.AsyncResult') as mock_result:
+            mock_result.return_value.state = 'SUCCESS'
+            with client.application.test_request_context(
+                    environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+                first = pdfdata('/test/a.pdf', 'abc123')[-1]
+                second = pdfdata('/test/b.pdf', 'abc123')[-1]
+        
+        mock_task.assert_called_once()
+        assert mock_task.call_args[0][0] == ('/test/a.pdf',)
+        # the analysis counts against the fair share of the client address
+        assert (mock_task.call_args[0][1]['submitter'] ==
+                queues.submitter_id('127.0.0.1'))
+        mock_result.assert_called_once_with(first.id)
+        assert second is mock_result.return_value
+    
+    def test_submitter_ignores_forwarded_header(self, client):
+        """Test a client cannot pick its fair share identity."""
+        with client.application.test_request_context(
+                environ_base={'REMOTE_ADDR': '10.0.0.1'},
+                headers={'X-Forwarded-For': '1.2.3.4'}):
+            assert submitter() == queues.submitter_id('10.0.0.1')
+    
+    @patch('app.pdfdata_task.apply_async')
+    def test_pdfdata_attaches_to_running_analysis(self, mock_task, client,
+                                                  fake_redis):
+        """Test an identical upload attaches to a still running task."""
+        fake_redis.set('analysis:pdf:abc123', 'running_task')
+        
+        with patch('app.AsyncResult') as mock_result:
+            mock_result.return_value.state = 'PENDING'
+            with client.application.test_request_context():
+                task_id = pdfdata('/test/a.pdf', 'abc123')[-1]
+        
+        mock_task.assert_not_called()
+        mock_result.assert_called_once_with('running_task')
+        assert task_id is mock_result.return_value
+    
+    @patch('app.pdfdata_task.apply_async')
+    def test_pdfdata_reruns_failed_analysis(self, mock_task, client,
+                                            fake_redis):
+        """Test a failed analysis is not reused."""
+        fake_redis.set('analysis:pdf:abc123', 'failed_task')
+        
+        with patch('app.AsyncResult') as mock_result:
+            mock_result.return_value.state = 'FAILURE'
+            with client.application.test_request_context():
+                pdfdata('/test/a.pdf', 'abc123')
+        
+        mock_task.assert_called_once()
+        new_id = mock_task.call_args[1]['task_id']
+        assert fake_redis.get('analysis:pdf:abc123').decode() == new_id
+    
+    @patch('app.pdfdata_task.apply_async')
+    def test_pdfdata_redis_unavailable(self, mock_task, client):
+        """Test uploads are still analysed when Redis is down."""
+        broken = Mock()
+        broken.set.side_effect = redis.ConnectionError()
+        
+        with patch('utilites.get_redis', return_value=broken):
+            with client.application.test_request_context():
+                pdfdata('/test/a.pdf', 'abc123')
+        
+        mock_task.assert_called_once()
 
 
 class TestCheckRoute:
@@ -199,6 +386,74 @@ class TestCheckRoute:
         
         mock_sanitize.assert_called_once_with('example.com')
         mock_status.assert_called_once_with('https://example.com')
+    
+    @patch('app.get_status_code')
+    def test_check_url_recheck(self, mock_status, client):
+        """Test recheck bypasses the status cache."""
+        mock_status.return_value = 404
+        
+        response = client.get('/check?url=https://example.com&recheck=1')
+        
+        assert response.data == b'404'
+        mock_status.assert_called_once_with('https://example.com',
+                                            recheck=True)
+    
+    def test_check_stats(self, client, fake_redis):
+        """Test the status cache counters are exposed."""
+        fake_redis.set('linkcheck:cache:hits', 3)
+        fake_redis.set('linkcheck:cache:misses', 1)
+        
+        response = client.get('/check/stats')
+        
+        assert response.get_json() == {
+            'hits': 3, 'misses': 1, 'hit_rate': 0.75}
+
+
+class TestCheckBatch:
+    """Test the bulk /check/batch endpoint."""
+    
+    @patch('app.get_status_code')
+    def test_check_batch_streams_every_url(self, mock_status, client):
+        """Test one JSON line per url comes back with its index."""
+        mock_status.side_effect = lambda url: 404 if 'gone' in url else 200
+        urls = ['https://a.com/', 'https://b.com/gone', 'c.com/']
+        
+        response = client.post('/check/batch', json={'urls': urls})
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        assert sorted(lines, key=lambda line: line['index']) == [
+            {'index': 0, 'url': 'https://a.com/', 'status': '200'},
+            {'index': 1, 'url': 'https://b.com/gone', 'status': '404'},
+            {'index': 2, 'url': 'http://c.com/', 'status': '200'}]
+    
+    @patch('app.get_status_code')
+    def test_check_batch_recheck(self, mock_status, client):
+        """Test recheck bypasses the status cache for every url."""
+        mock_status.return_value = 200
+        
+        response = client.post('/check/batch', json={
+            'urls': ['https://a.com/', 'https://b.com/'], 'recheck': True})
+        
+        assert len(response.data.splitlines()) == 2
+        assert all(call.kwargs == {'recheck': True}
+                   for call in mock_status.call_args_list)
+    
+    def test_check_batch_invalid_body(self, client):
+        """Test bodies without a list of urls are refused."""
+        assert client.post('/check/batch', json={}).status_code == 400
+        assert client.post('/check/batch',
+                           json={'urls': [1, 2]}).status_code == 400
+        assert client.post('/check/batch', data='urls').status_code == 400
+    
+    @patch('app.CHECK_BATCH_MAX', 2)
+    def test_check_batch_too_many(self, client):
+        """Test batches over CHECK_BATCH_MAX are refused."""
+        response = client.post('/check/batch', json={
+            'urls': ['https://a.com/1', 'https://a.com/2', 'https://a.com/3']})
+        
+        assert response.status_code == 413
 
 
 class TestTaskResult:
@@ -208,8 +463,7 @@ class TestTaskResult:
     def test_task_result_ready(self, mock_result, client):
         """Test task result when ready."""
         mock_result_instance = Mock()
-        mock_result_instance.ready.return_value = True
-        mock_result_instance.successful.return_value = True
+        mock_result_instance.state = 'SUCCESS'
         mock_result_instance.result = {'test': 'data'}
         mock_result.return_value = mock_result_instance
         
@@ -220,13 +474,27 @@ class TestTaskResult:
         assert result_data['ready'] is True
         assert result_data['successful'] is True
         assert result_data['value'] == {'test': 'data'}
+        # the state is read once, not through ready() and successful()
+        mock_result_instance.ready.assert_not_called()
+        mock_result_instance.successful.assert_not_called()
+    
+    @patch('app.AsyncResult')
+    def test_task_result_failed(self, mock_result, client):
+        """Test a failed task is ready without exposing its exception."""
+        mock_result.return_value.state = 'FAILURE'
+        mock_result.return_value.result = ValueError('broken pdf')
+        
+        response = client.get('/result/task_id_123')
+        
+        assert response.status_code == 200
+        assert response.get_json() == {'ready': True, 'successful': False,
+                                       'value': None}
     
     @patch('app.AsyncResult')
     def test_task_result_not_ready(self, mock_result, client):
         """Test task result when not ready."""
         mock_result_instance = Mock()
-        mock_result_instance.ready.return_value = False
-        mock_result_instance.successful.return_value = False
+        mock_result_instance.state = 'PENDING'
         mock_result_instance.result = None
         mock_result.return_value = mock_result_instance
         
@@ -239,32 +507,231 @@ class TestTaskResult:
         assert result_data['value'] is None
 
 
+    @patch('app.AsyncResult')
+    def test_task_result_since(self, mock_result, client, fake_redis):
+        """Test references checked after the cursor are returned."""
+        mock_result_instance = Mock()
+        mock_result_instance.state = 'STARTED'
+        mock_result_instance.result = None
+        mock_result.return_value = mock_result_instance
+        progress.publish('task_id_123', [{'check': ['200']},
+                                         {'check': ['404']},
+                                         {'check': ['403']}])
+        
+        response = client.get('/result/task_id_123?since=1')
+        
+        result_data = response.get_json()
+        assert result_data['items'] == [{'check': ['404']},
+                                        {'check': ['403']}]
+        assert result_data['next'] == 3
+        
+        response = client.get('/result/task_id_123?since=3')
+        assert response.get_json()['items'] == []
+        assert response.get_json()['next'] == 3
+    
+    @patch('app.AsyncResult')
+    def test_task_result_outline(self, mock_result, client, fake_redis):
+        """Test an unfinished analysis lists its extracted references."""
+        mock_result.return_value.state = 'STARTED'
+        
+        result_data = client.get('/result/task_id_123?outline=1').get_json()
+        assert result_data['outline'] is None
+        
+        refindex.save('task_id_123', {
+            'metadata': {'Title': 'Test PDF'},
+            'references': [['doi', '10.1000/182',
+                            'https://doi.org/10.1000/182', 2]]})
+        result_data = client.get(
+            '/result/task_id_123?outline=1&since=0').get_json()
+        
+        assert result_data['outline'] == {
+            'metadata': {'Title': 'Test PDF'},
+            'references': [['doi', 'https://doi.org/10.1000/182']]}
+        assert result_data['items'] == []
+        
+        # a finished analysis has everything in its value
+        mock_result.return_value.state = 'SUCCESS'
+        mock_result.return_value.result = {'result_data': []}
+        result_data = client.get('/result/task_id_123?outline=1').get_json()
+        assert 'outline' not in result_data
+    
+    @patch('app.AsyncResult')
+    def test_task_result_without_since(self, mock_result, client):
+        """Test the cursor fields are only added when asked for."""
+        mock_result.return_value.state = 'PENDING'
+        
+        result_data = client.get('/result/task_id_123').get_json()
+        
+        assert 'items' not in result_data
+        assert 'next' not in result_data
+
+
+class TestTaskEvents:
+    """Test the server-sent events endpoint."""
+    
+    def test_events_disabled(self, client):
+        """Test browsers are told to poll when streams are off."""
+        with patch('events.RESULT_EVENTS', False):
+            response = client.get('/result/task_id_123/events')
+        
+        assert response.status_code == 204
+    
+    @patch('app.AsyncResult')
+    def test_events_stream(self, mock_result, client, fake_redis):
+        """Test a finished analysis is streamed from the last event id."""
+        mock_result.return_value.state = 'SUCCESS'
+        mock_result.return_value.result = {'result_data': []}
+        progress.publish('task_id_123', [['url', 'https://a.com', '200'],
+                                         ['url', 'https://b.com', '404']])
+        
+        with patch('events.RESULT_EVENTS', True), \
+                patch('events.listener', events.Listener()):
+            response = client.get('/result/task_id_123/events?since=0',
+                                  headers={'Last-Event-ID': '1'})
+            body = response.get_data(as_text=True)
+        
+        assert response.mimetype == 'text/event-stream'
+        assert response.headers['Cache-Control'] == 'no-cache'
+        event_id, name, data = body.strip().split('\n')
+        assert (event_id, name) == ('id: 2', 'event: result')
+        assert json.loads(data[len('data: '):]) == {
+            'ready': True, 'successful': True,
+            'value': {'result_data': []},
+            'items': [['url', 'https://b.com', '404']], 'next': 2}
+
+
 class TestDownloadPDF:
     """Test PDF download functionality."""
     
-    @patch('app.linkrot.linkrot')
-    @patch('app.shutil.make_archive')
-    @patch('app.os.mkdir')
-    @patch('app.os.remove')
-    @patch('app.shutil.rmtree')
-    @patch('app.send_from_directory')
-    def test_download_pdf(self, mock_send, mock_rmtree, mock_remove,
-                          mock_mkdir, mock_archive, mock_linkrot, client):
-        """Test PDF download functionality."""
-        mock_linkrot_instance = Mock()
-        mock_linkrot.return_value = mock_linkrot_instance
-        mock_send.return_value = 'file_response'
+    @patch('app.build_download_archive.apply_async')
+    @patch('app.AsyncResult')
+    def test_download_pdf_starts_job(self, mock_result, mock_archive, client):
+        """Test the archive is built by a Celery job from the ref index."""
+        mock_result.return_value.successful.return_value = True
+        index = {'metadata': {'Title': 'Test'}, 'references': [
+            ['pdf', 'https://example.com/a.pdf', 'https://example.com/a.pdf', 2],
+            ['url', 'https://example.com/', 'https://example.com/', 1]]}
+        refindex.save('analysis_123', index)
         
         with client.session_transaction() as sess:
             sess['file'] = 'test'
             sess['path'] = '/test/path.pdf'
             sess['type'] = 'file'
+            sess['task_id'] = 'analysis_123'
+        
+        response = client.post('/downloadpdf')
         
-        client.get('/downloadpdf')
+        assert response.status_code == 202
+        download_id = response.get_json()['task_id']
+        assert response.get_json()['status'] == '/downloadpdf/' + download_id
+        mock_result.assert_called_once_with('analysis_123')
+        args = mock_archive.call_args[0][0]
+        assert args[0] == '/test/path.pdf'
+        assert args[1] == ['https://example.com/a.pdf']
+        assert args[2].endswith(download_id + '.zip')
+        assert args[3] == index
+        assert mock_archive.call_args[1]['task_id'] == download_id
+        with client.session_transaction() as sess:
+            assert sess['download_id'] == download_id
+    
+    @patch('app.build_download_archive.apply_async')
+    @patch('app.AsyncResult')
+    def test_download_pdf_without_index(self, mock_result, mock_archive,
+                                        client):
+        """Test the analysis result is used when the index is gone."""
+        mock_result.return_value.successful.return_value = True
+        mock_result.return_value.result = {'metadata': {}, 'result_data': [
+            ['pdf', 'https://example.com/a.pdf', '200'],
+            ['url', 'https://example.com', '200']]}
+        with client.session_transaction() as sess:
+            sess['path'] = '/test/path.pdf'
+            sess['task_id'] = 'analysis_123'
+        
+        client.post('/downloadpdf')
+        
+        args = mock_archive.call_args[0][0]
+        assert args[1] == ['https://example.com/a.pdf']
+    
+    @patch('app.build_download_archive.apply_async')
+    @patch('app.AsyncResult')
+    def test_download_pdf_analysis_not_finished(self, mock_result,
+                                                mock_archive, client):
+        """Test no archive is started before the analysis finished."""
+        mock_result.return_value.successful.return_value = False
+        with client.session_transaction() as sess:
+            sess['task_id'] = 'analysis_123'
+        
+        response = client.post('/downloadpdf')
+        
+        assert response.status_code == 409
+        mock_archive.assert_not_called()
+    
+    @patch('app.AsyncResult')
+    def test_download_status(self, mock_result, client):
+        """Test polling reports the archive link when it is ready."""
+        mock_result.return_value.ready.return_value = True
+        mock_result.return_value.successful.return_value = True
+        mock_result.return_value.result = {'downloaded': 1, 'failed': 0}
+        with client.session_transaction() as sess:
+            sess['download_id'] = 'download_123'
+        
+        response = client.get('/downloadpdf/download_123')
+        
+        data = response.get_json()
+        assert data['ready'] is True
+        assert data['value'] == {'downloaded': 1, 'failed': 0}
+        assert data['archive'] == '/downloadpdf/download_123/archive'
+    
+    def test_download_status_other_session(self, client):
+        """Test archives of other sessions are not exposed."""
+        response = client.get('/downloadpdf/download_123')
+        assert response.status_code == 404
+    
+    @patch('app.AsyncResult')
+    def test_download_archive(self, mock_result, client):
+        """Test the finished archive is sent and then removed."""
+        mock_result.return_value.successful.return_value = True
+        folder = workspace.create(client.application.config['UPLOAD_FOLDER'])
+        archive_path = os.path.join(folder, 'download_123.zip')
+        upload_path = os.path.join(folder, 'test.pdf')
+        for path in (archive_path, upload_path):
+            with open(path, 'wb') as f:
+                f.write(b'data')
+        with client.session_transaction() as sess:
+            sess['file'] = 'test'
+            sess['path'] = upload_path
+            sess['type'] = 'file'
+            sess['download_id'] = 'download_123'
+        
+        response = client.get('/downloadpdf/download_123/archive')
+        
+        assert response.status_code == 200
+        assert response.data == b'data'
+        assert 'test.zip' in response.headers['Content-Disposition']
+        response.close()
+        assert not os.path.exists(folder)
+
+
+class TestInProcessMode:
+    """Test analyses run on the local job pool without Celery."""
+    
+    @patch('app.analyse_pdf')
+    @patch('app.pdfdata_task.apply_async')
+    @patch('localjobs.ANALYSIS_MODE', 'inprocess')
+    def test_inprocess_analysis(self, mock_task, mock_analyse, client,
+                                fake_redis, monkeypatch):
+        """Test the analysis runs locally and is polled through /result."""
+        monkeypatch.setattr(localjobs, '_pool', None)
+        mock_analyse.return_value = {'metadata': {}, 'result_data': []}
+        
+        with client.application.test_request_context():
+            task_id = pdfdata('/test/path.pdf')[-1]
+        localjobs.get_pool().wait_completion()
         
-        mock_linkrot.assert_called_once()
-        mock_linkrot_instance.download_pdfs.assert_called_once()
-        mock_archive.assert_called_once()
-        mock_mkdir.assert_called_once()
-        assert mock_remove.call_count == 2
-        mock_rmtree.assert_called_once()
+        mock_task.assert_not_called()
+        mock_analyse.assert_called_once_with('/test/path.pdf', str(task_id))
+        result = client.get('/result/%s' % task_id).get_json()
+        assert result['ready'] is True
+        assert result['value'] == {'metadata': {}, 'result_data': []}
+        assert client.get('/jobs/stats').get_json()['completed'] == 1
+        localjobs.get_pool().shutdown()
@@ -0,0 +1,98 @@
+import json
+import os
+import zipfile
+from io import BytesIO
+from unittest.mock import patch
+import pytest
+import requests
+from download import write_archive, archive_name, fetch_pdf
+
+
+URLS = ['https://a.com/paper.pdf',
+        'https://b.com/paper.pdf?x=1',
+        'https://c.com/broken.pdf']
+INFOS = {'metadata': {'Title': 'Test PDF'}, 'references': []}
+
+
+class TestArchiveHelpers:
+    """Test the archive naming helpers."""
+    
+    def test_archive_name_unique(self):
+        """Test clashing file names get a numbered suffix."""
+        taken = set()
+        assert archive_name('https://a.com/paper.pdf', taken) == 'paper.pdf'
+        assert archive_name('https://b.com/paper.pdf?x=1', taken) == (
+            'paper-1.pdf')
+        assert archive_name('https://c.com/', taken) == 'document.pdf'
+
+
+class TestFetchPdf:
+    """Test downloading into a spooled file."""
+    
+    @patch('download.get_session')
+    def test_fetch_pdf(self, mock_session):
+        """Test the body is spooled and rewound."""
+        response = mock_session.return_value.get.return_value.__enter__
+        response.return_value.iter_content.return_value = [b'%P', b'DF']
+        
+        with fetch_pdf('https://a.com/paper.pdf') as spool:
+            assert spool.read() == b'%PDF'
+        assert mock_session.return_value.get.call_args.kwargs['stream']
+    
+    @patch('download.get_session')
+    def test_fetch_pdf_http_error(self, mock_session):
+        """Test error statuses count as failed downloads."""
+        response = mock_session.return_value.get.return_value.__enter__
+        response.return_value.raise_for_status.side_effect = \
+            requests.HTTPError('404')
+        
+        with pytest.raises(requests.HTTPError):
+            fetch_pdf('https://a.com/missing.pdf')
+
+
+class TestWriteArchive:
+    """Test the streamed archive writer."""
+    
+    @patch('download.fetch_pdf')
+    def test_write_archive(self, mock_fetch, test_upload_folder):
+        """Test source, analysis and referenced PDFs end up in the zip."""
+        def fetch(url):
+            if 'broken' in url:
+                raise OSError('404')
+            return BytesIO(b'%PDF ' + url.encode())
+        mock_fetch.side_effect = fetch
+        source = os.path.join(test_upload_folder, 'test.pdf')
+        with open(source, 'wb') as f:
+            f.write(b'%PDF source')
+        archive_path = os.path.join(test_upload_folder, 'out.zip')
+        
+        downloaded, failed = write_archive(archive_path, source, URLS, INFOS,
+                                           max_workers=2)
+        
+        assert (downloaded, failed) == (2, 1)
+        with zipfile.ZipFile(archive_path) as archive:
+            names = set(archive.namelist())
+            assert names == {
+                'test.pdf',
+                'test.pdf.infos.json',
+                'test.pdf-referenced-pdfs/paper.pdf',
+                'test.pdf-referenced-pdfs/paper-1.pdf',
+            }
+            assert archive.read('test.pdf') == b'%PDF source'
+            assert json.loads(archive.read('test.pdf.infos.json')) == INFOS
+        # nothing but the archive is written to disk
+        assert sorted(os.listdir(test_upload_folder)) == ['out.zip',
+                                                          'test.pdf']
+    
+    @patch('download.fetch_pdf')
+    def test_write_archive_missing_source(self, mock_fetch,
+                                          test_upload_folder):
+        """Test a removed upload still yields the referenced PDFs."""
+        mock_fetch.return_value = BytesIO(b'%PDF')
+        archive_path = os.path.join(test_upload_folder, 'out.zip')
+        
+        write_archive(archive_path, '/missing/test.pdf',
+                      ['https://a.com/x.pdf'], INFOS)
+        
+        with zipfile.ZipFile(archive_path) as archive:
+            assert 'test.pdf-referenced-pdfs/x.pdf' in archive.namelist()
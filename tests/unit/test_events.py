@@ -0,0 +1,191 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+import pytest
+import events
+import progress
+
+
+def parse(lines):
+    """Name and data of the events in lines, keepalives left out."""
+    parsed = []
+    for block in ''.join(lines).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines()
+                      if not line.startswith(':'))
+        if fields:
+            parsed.append((fields['event'], json.loads(fields['data'])))
+    return parsed
+
+
+@pytest.fixture
+def listener(fake_redis):
+    """A fresh process listener on the fake Redis."""
+    fresh = events.Listener()
+    with patch('events.listener', fresh), patch('events.EVENTS_COALESCE', 0):
+        yield fresh
+
+
+class FakeJob:
+    """Result reader for a job finished by finish()."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.ready = False
+        self.reads = 0
+
+    def read_result(self, cursor):
+        self.reads += 1
+        items = progress.read(self.job_id, cursor)
+        return dict(ready=self.ready, successful=self.ready,
+                    value={'result_data': []} if self.ready else None,
+                    items=items, next=cursor + len(items))
+
+    def finish(self):
+        self.ready = True
+        progress.notify_done(self.job_id)
+
+
+class TestStream:
+    """Test the server-sent event stream of a job."""
+
+    def test_finished_job(self, listener):
+        """Test a finished job gets its result event and the stream ends."""
+        job = FakeJob('job_1')
+        job.ready = True
+        progress.publish('job_1', [['url', 'https://a.com', '200']])
+
+        parsed = parse(events.stream('job_1', 0, job.read_result))
+
+        assert parsed == [('result', {'ready': True, 'successful': True,
+                                      'value': {'result_data': []},
+                                      'items': [['url', 'https://a.com',
+                                                 '200']],
+                                      'next': 1})]
+
+    def test_pushes_progress_and_result(self, listener):
+        """Test announced references and the result are pushed."""
+        job = FakeJob('job_1')
+
+        def work():
+            # give the listener time to subscribe to the job
+            time.sleep(0.3)
+            progress.publish('job_1', [['url', 'https://a.com', '200']])
+            time.sleep(0.2)
+            job.finish()
+
+        threading.Thread(target=work).start()
+        start = time.monotonic()
+        parsed = parse(events.stream('job_1', 0, job.read_result))
+
+        assert [name for name, _ in parsed] == ['progress', 'result']
+        assert parsed[0][1] == {'items': [['url', 'https://a.com', '200']],
+                                'next': 1}
+        assert parsed[1][1]['next'] == 1
+        # the start and the announced result, progress only reads items
+        assert job.reads == 2
+        assert time.monotonic() - start < events.EVENTS_HEARTBEAT
+
+    def test_outline_before_progress(self, listener):
+        """Test the outline is pushed once it is announced."""
+        job = FakeJob('job_1')
+        outline = {'metadata': {}, 'references': [['url', 'https://a.com']]}
+        extracted = []
+
+        def read_outline():
+            return outline if extracted else None
+
+        def work():
+            time.sleep(0.3)
+            extracted.append(True)
+            progress.notify_outline('job_1')
+            time.sleep(0.2)
+            progress.publish('job_1', [['url', 'https://a.com', '200']])
+            time.sleep(0.2)
+            job.finish()
+
+        threading.Thread(target=work).start()
+        parsed = parse(events.stream('job_1', 0, job.read_result,
+                                     read_outline))
+
+        assert [name for name, _ in parsed] == ['outline', 'progress',
+                                                'result']
+        assert parsed[0][1] == dict(outline, next=0)
+
+    def test_resumed_stream_skips_outline(self, listener):
+        """Test a browser resuming after progress gets no second outline."""
+        job = FakeJob('job_1')
+        job.ready = True
+        progress.publish('job_1', [['url', 'https://a.com', '200']])
+        outline = {'metadata': {}, 'references': [['url', 'https://a.com']]}
+
+        parsed = parse(events.stream('job_1', 1, job.read_result,
+                                     lambda: outline))
+
+        assert [name for name, _ in parsed] == ['result']
+
+    def test_event_ids_are_cursors(self, listener):
+        """Test each event carries the cursor to resume from."""
+        job = FakeJob('job_1')
+        job.ready = True
+        progress.publish('job_1', [['url', 'https://a.com', '200'],
+                                   ['url', 'https://b.com', '404']])
+
+        text = ''.join(events.stream('job_1', 1, job.read_result))
+
+        assert text.startswith('id: 2\nevent: result\n')
+
+    def test_heartbeat_rereads_state(self, listener):
+        """Test a missed announcement is caught on a heartbeat."""
+        job = FakeJob('job_1')
+        job.ready = True
+        responses = iter([dict(ready=False, items=[], next=0)])
+
+        def read_result(cursor):
+            return next(responses, None) or job.read_result(cursor)
+
+        with patch('events.LISTEN_TIMEOUT', 0.05):
+            lines = list(events.stream('job_1', 0, read_result))
+
+        assert lines[0] == ': keepalive\n\n'
+        assert parse(lines)[0][0] == 'result'
+
+    def test_stream_closes_at_deadline(self, listener):
+        """Test a long stream ends so the browser reconnects."""
+        job = FakeJob('job_1')
+
+        with patch('events.EVENTS_MAX_SECONDS', 0.1):
+            assert parse(events.stream('job_1', 0, job.read_result)) == []
+
+        assert listener.waiters == {}
+
+
+class TestListener:
+    """Test the per-process pub/sub listener."""
+
+    def test_delivers_to_watchers(self, listener, fake_redis):
+        """Test announcements reach every stream watching the job."""
+        first = listener.watch('job_1')
+        second = listener.watch('job_1')
+        other = listener.watch('job_2')
+        time.sleep(0.2)
+
+        progress.notify_done('job_1')
+
+        assert first.get(timeout=2) == 'done'
+        assert second.get(timeout=2) == 'done'
+        assert other.empty()
+        for job_id, waiter in (('job_1', first), ('job_1', second),
+                               ('job_2', other)):
+            listener.unwatch(job_id, waiter)
+
+    def test_thread_ends_when_unwatched(self, listener):
+        """Test the listener thread stops once no stream is open."""
+        waiter = listener.watch('job_1')
+        thread = listener.thread
+        listener.unwatch('job_1', waiter)
+
+        thread.join(timeout=3)
+
+        assert not thread.is_alive()
+        assert listener.thread is None
@@ -0,0 +1,121 @@
+import json
+import fitz
+import linkrot
+import pytest
+from unittest.mock import patch
+import extraction
+
+
+PAGES = [
+    # a link, the same url in the text and a url that is part of the link
+    (['https://example.com/paper'],
+     'See https://example.com/paper and https://example.com/pap'),
+    (['mailto:author@example.com'],
+     'arxiv.org/abs/2101.00001 and https://example.org/data.pdf'),
+    # repeated on a later page: the first page is kept
+    ([], 'https://example.org/data.pdf\nDOI: 10.1234/abc.5\n'),
+    (['https://example.net/'],
+     'https://example.net/tool https://example.com/paper'),
+    ([], 'Nothing cited on this page'),
+    ([], 'DOI: 10.1234/abc.5\nhttps://example.com/new\n'
+         'arxiv.org/abs/2101.00001 '),
+    (['https://example.com/last'], 'https://example.com/last/appendix'),
+]
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    doc = fitz.open()
+    doc.set_metadata({'title': 'Ranges', 'author': 'Tester',
+                      'creationDate': "D:20240101120000+00'00'"})
+    for links, text in PAGES:
+        page = doc.new_page()
+        page.insert_text((36, 40), text, fontsize=9)
+        for i, uri in enumerate(links):
+            page.insert_link({'kind': fitz.LINK_URI, 'uri': uri,
+                              'from': fitz.Rect(36, 60 + 20 * i,
+                                                200, 75 + 20 * i)})
+    path = tmp_path / 'ranges.pdf'
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def found(refs):
+    return sorted((ref.reftype, ref.ref, ref.page) for ref in refs)
+
+
+class TestPageRanges:
+    """Test splitting documents into page ranges."""
+
+    def test_ranges_cover_all_pages(self):
+        assert extraction.page_ranges(7, 3) == [(0, 3), (3, 6), (6, 7)]
+        assert extraction.page_ranges(6, 3) == [(0, 3), (3, 6)]
+        assert extraction.page_ranges(0, 3) == []
+
+    def test_page_count(self, pdf_path, tmp_path):
+        assert extraction.page_count(pdf_path) == len(PAGES)
+        # linkrot reports unreadable files
+        assert extraction.page_count(str(tmp_path / 'missing.pdf')) == 0
+
+    def test_should_split(self, pdf_path):
+        with patch('extraction.EXTRACT_SPLIT_PAGES', len(PAGES)):
+            assert not extraction.should_split(pdf_path)
+        with patch('extraction.EXTRACT_SPLIT_PAGES', len(PAGES) - 1):
+            assert extraction.should_split(pdf_path)
+
+
+class TestMerge:
+    """Test the merged references match those linkrot finds."""
+
+    @pytest.mark.parametrize('size', [1, 2, 3, len(PAGES)])
+    def test_same_references_as_linkrot(self, pdf_path, size):
+        pdf = linkrot.linkrot(pdf_path)
+        parts = [extraction.extract_range(pdf_path, start, stop)
+                 for start, stop in extraction.page_ranges(len(PAGES), size)]
+
+        refs = extraction.merge(parts)
+
+        assert found(refs) == found(pdf.get_references())
+        assert len({ref.ref for ref in refs}) == len(refs)
+
+    def test_merge_rules(self, pdf_path):
+        parts = [extraction.extract_range(pdf_path, start, stop)
+                 for start, stop in extraction.page_ranges(len(PAGES), 2)]
+
+        refs = {ref.ref: ref.page for ref in extraction.merge(parts)}
+
+        # part of an earlier link or url, or a mail address
+        assert 'https://example.com/pap' not in refs
+        assert 'https://example.com/last/appendix' in refs
+        assert not any(ref.startswith('mailto:') for ref in refs)
+        # links come first, then the text page by page
+        assert refs['https://example.com/paper'] == 1
+        assert refs['https://example.org/data.pdf'] == 2
+        assert refs['10.1234/abc.5'] == 3
+        assert refs['2101.00001'] == 2
+
+    def test_parts_are_json(self, pdf_path):
+        part = extraction.extract_range(pdf_path, 0, len(PAGES))
+        assert json.loads(json.dumps(part)) == part
+
+    def test_metadata_as_linkrot(self, pdf_path):
+        assert (extraction.read_metadata(pdf_path) ==
+                linkrot.linkrot(pdf_path).get_metadata())
+
+
+class TestExtract:
+    """Test extracting a whole document in page ranges."""
+
+    def test_serial(self, pdf_path):
+        with patch('extraction.EXTRACT_RANGE_PAGES', 2):
+            metadata, refs = extraction.extract(pdf_path, processes=1)
+        pdf = linkrot.linkrot(pdf_path)
+        assert metadata == pdf.get_metadata()
+        assert found(refs) == found(pdf.get_references())
+
+    def test_process_pool(self, pdf_path):
+        with patch('extraction.EXTRACT_RANGE_PAGES', 3):
+            metadata, refs = extraction.extract(pdf_path, processes=2)
+        assert metadata['Pages'] == len(PAGES)
+        assert found(refs) == found(linkrot.linkrot(pdf_path).get_references())
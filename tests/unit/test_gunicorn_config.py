@@ -0,0 +1,31 @@
+import importlib
+import os
+from unittest.mock import patch
+import gunicorn_config
+
+
+def load_config(**env):
+    with patch.dict(os.environ, env):
+        return importlib.reload(gunicorn_config)
+
+
+class TestGunicornConfig:
+    """Test the selectable gunicorn worker model."""
+    
+    def test_threaded_default(self):
+        """Test threaded sync workers stay the default."""
+        config = load_config(GUNICORN_WORKER_CLASS='gthread',
+                             GUNICORN_WORKERS='3', GUNICORN_THREADS='4')
+        
+        assert config.worker_class == 'gthread'
+        assert config.workers == 3
+        assert config.threads == 4
+    
+    def test_gevent_mode(self):
+        """Test the gevent mode sets greenlet connections per worker."""
+        config = load_config(GUNICORN_WORKER_CLASS='gevent',
+                             GUNICORN_WORKER_CONNECTIONS='500')
+        
+        assert config.worker_class == 'gevent'
+        assert config.worker_connections == 500
+        load_config(GUNICORN_WORKER_CLASS='gthread')
@@ -0,0 +1,64 @@
+from unittest.mock import Mock, patch
+import httpclient
+from httpclient import get_session, head_or_get, TIMEOUT
+
+
+class TestGetSession:
+    """Test the process-wide pooled session."""
+    
+    def test_get_session_reused(self):
+        """Test every caller in a process shares one session."""
+        assert get_session() is get_session()
+    
+    def test_get_session_pool_sizes(self):
+        """Test both schemes are served by the tuned pool."""
+        adapter = get_session().get_adapter('https://example.com/')
+        
+        assert adapter._pool_connections == httpclient.HTTP_POOL_CONNECTIONS
+        assert adapter._pool_maxsize == httpclient.HTTP_POOL_MAXSIZE
+        assert get_session().get_adapter('http://example.com/') is adapter
+    
+    def test_get_session_new_after_fork(self, monkeypatch):
+        """Test a forked process does not reuse the parent's session."""
+        session = get_session()
+        monkeypatch.setattr(httpclient, '_session_pid', -1)
+        
+        assert get_session() is not session
+
+
+class TestHeadOrGet:
+    """Test HEAD with GET fallback."""
+    
+    @patch('httpclient.get_session')
+    def test_head_only(self, mock_session):
+        """Test a normal HEAD answer needs no GET."""
+        mock_session.return_value.head.return_value = Mock(status_code=200)
+        
+        assert head_or_get('https://a.com/').status_code == 200
+        mock_session.return_value.head.assert_called_once_with(
+            'https://a.com/', allow_redirects=True, timeout=TIMEOUT,
+            verify=False, headers=None)
+        mock_session.return_value.get.assert_not_called()
+    
+    @patch('httpclient.get_session')
+    def test_get_fallback(self, mock_session):
+        """Test servers rejecting HEAD are asked with a GET."""
+        mock_session.return_value.head.return_value = Mock(status_code=405)
+        mock_session.return_value.get.return_value = Mock(status_code=200)
+        
+        assert head_or_get('https://a.com/').status_code == 200
+        assert mock_session.return_value.get.call_args.kwargs['stream']
+        mock_session.return_value.get.return_value.close.assert_called_once()
+    
+    @patch('httpclient.get_session')
+    def test_headers_sent_with_both(self, mock_session):
+        """Test conditional headers go with the HEAD and the GET fallback."""
+        mock_session.return_value.head.return_value = Mock(status_code=405)
+        mock_session.return_value.get.return_value = Mock(status_code=304)
+        headers = {'If-None-Match': '"v1"'}
+        
+        assert head_or_get('https://a.com/', headers=headers).status_code == 304
+        assert mock_session.return_value.head.call_args.kwargs['headers'] == (
+            headers)
+        assert mock_session.return_value.get.call_args.kwargs['headers'] == (
+            headers)
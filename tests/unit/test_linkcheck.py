@@ -0,0 +1,298 @@
+import threading
+import time
+from collections import Counter
+from unittest.mock import Mock, patch
+import requests
+from linkcheck import (check_urls, safe_status, url_host, get_status_code,
+                       fetch_status)
+import metrics
+import statuscache
+
+
+class TestUrlHost:
+    """Test the url_host helper."""
+    
+    def test_url_host(self):
+        """Test hosts are lower-cased and urls without scheme work."""
+        assert url_host('https://Example.com/page') == 'example.com'
+        assert url_host('example.com/page') == 'example.com'
+
+
+class TestSafeStatus:
+    """Test the safe_status helper."""
+    
+    def test_safe_status_string(self):
+        """Test status codes are returned as strings."""
+        assert safe_status('https://example.com', lambda url: 200) == '200'
+    
+    def test_safe_status_exception(self):
+        """Test failing checks return 0."""
+        def check(url):
+            raise Exception('Network error')
+        
+        assert safe_status('https://example.com', check) == 0
+
+
+class TestCheckUrls:
+    """Test the concurrent check_urls engine."""
+    
+    def test_check_urls_keeps_order(self):
+        """Test statuses come back in input order."""
+        urls = ['https://a.com/%d' % i for i in range(10)]
+        
+        def check(url):
+            time.sleep(0.001 * (10 - int(url.rsplit('/', 1)[1])))
+            return 200 + int(url.rsplit('/', 1)[1])
+        
+        statuses = check_urls(urls, check, max_workers=4, per_host=4)
+        
+        assert statuses == [str(200 + i) for i in range(10)]
+    
+    def test_check_urls_empty(self):
+        """Test an empty list needs no checks."""
+        assert check_urls([], lambda url: 200) == []
+    
+    def test_check_urls_limits(self):
+        """Test the global and per-host concurrency limits hold."""
+        lock = threading.Lock()
+        active = Counter()
+        peak = Counter()
+        
+        def check(url):
+            host = url_host(url)
+            with lock:
+                active[host] += 1
+                active['total'] += 1
+                peak[host] = max(peak[host], active[host])
+                peak['total'] = max(peak['total'], active['total'])
+            time.sleep(0.01)
+            with lock:
+                active[host] -= 1
+                active['total'] -= 1
+            return 200
+        
+        urls = (['https://slow.com/%d' % i for i in range(12)] +
+                ['https://fast%d.com/' % i for i in range(6)])
+        
+        statuses = check_urls(urls, check, max_workers=5, per_host=2)
+        
+        assert statuses == ['200'] * len(urls)
+        assert peak['slow.com'] == 2
+        assert peak['total'] == 5
+    
+    def test_check_urls_hosts_round_robin(self):
+        """Test one busy host does not hold back the others."""
+        order = []
+        
+        def check(url):
+            order.append(url_host(url))
+            return 200
+        
+        urls = ['https://busy.com/%d' % i for i in range(5)]
+        urls.append('https://other.com/')
+        
+        check_urls(urls, check, max_workers=1, per_host=1)
+        
+        assert order.index('other.com') == 1
+
+
+class TestGetStatusCode:
+    """Test the cache-aware get_status_code."""
+    
+    @patch('linkcheck.fetch_status')
+    def test_get_status_code_uses_cache(self, mock_fetch, fake_redis):
+        """Test a second check of the same url is not fetched again."""
+        mock_fetch.return_value = (200, 'https://example.com/')
+        
+        assert get_status_code('https://example.com/') == 200
+        assert get_status_code('https://example.com/') == 200
+        assert get_status_code('https://example.com/', recheck=True) == 200
+        
+        assert mock_fetch.call_count == 2
+
+
+class TestFetchStatus:
+    """Test the uncached check over the pooled client."""
+    
+    @patch('linkcheck.head_or_get')
+    def test_fetch_status_final_url(self, mock_head_or_get):
+        """Test the status and the url after redirects are returned."""
+        mock_head_or_get.return_value.status_code = 200
+        mock_head_or_get.return_value.url = 'https://b.com/'
+        mock_head_or_get.return_value.headers = {}
+        
+        assert fetch_status('a.com') == (200, 'https://b.com/')
+        mock_head_or_get.assert_called_once_with('http://a.com', headers={})
+    
+    @patch('linkcheck.head_or_get')
+    def test_fetch_status_errors(self, mock_head_or_get):
+        """Test timeouts, connection errors and other failures."""
+        mock_head_or_get.side_effect = requests.ConnectTimeout()
+        assert fetch_status('https://a.com/') == ('timed out', 'https://a.com/')
+        
+        mock_head_or_get.side_effect = requests.ConnectionError(
+            Mock(reason='Name or service not known'))
+        assert fetch_status('https://a.com/') == (
+            'Name or service not known', 'https://a.com/')
+        
+        mock_head_or_get.side_effect = ValueError('bad url')
+        assert fetch_status('https://a.com/') == (None, 'https://a.com/')
+
+
+def answer(status, method='HEAD', url='https://a.com/', **headers):
+    return Mock(status_code=status, url=url, headers=headers,
+                request=Mock(method=method))
+
+
+class TestRevalidation:
+    """Test conditional checks of links checked before."""
+    
+    @patch('linkcheck.head_or_get')
+    def test_validators_stored_and_sent(self, mock_head_or_get, fake_redis):
+        """Test the validators of a success go with the next check."""
+        mock_head_or_get.return_value = answer(
+            200, url='https://b.com/', ETag='"v1"',
+            **{'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT',
+               'Content-Length': '5000'})
+        
+        assert fetch_status('https://a.com/') == (200, 'https://b.com/')
+        assert mock_head_or_get.call_args.kwargs['headers'] == {}
+        stored = statuscache.lookup_validators('https://a.com/')
+        assert stored['etag'] == '"v1"'
+        assert stored['length'] == 5000
+        ttl = fake_redis.ttl('linkcheck:validators:https://a.com/')
+        assert 0 < ttl <= statuscache.VALIDATOR_TTL
+        
+        mock_head_or_get.return_value = answer(304)
+        fetch_status('https://a.com/')
+        assert mock_head_or_get.call_args.kwargs['headers'] == {
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Wed, 01 Jan 2025 00:00:00 GMT'}
+    
+    @patch('linkcheck.head_or_get')
+    def test_not_modified_keeps_status(self, mock_head_or_get, fake_redis):
+        """Test a 304 reports the stored status and counts the savings."""
+        statuscache.store_validators('https://a.com/', dict(
+            status=200, url='https://b.com/', etag='"v1"',
+            last_modified=None, length=5000, seconds=30.0))
+        mock_head_or_get.return_value = answer(304, method='GET')
+        
+        fake_redis.expire('linkcheck:validators:https://a.com/', 10)
+        
+        assert fetch_status('https://a.com/') == (200, 'https://b.com/')
+        
+        # revalidated validators get a full TTL again
+        assert (fake_redis.ttl('linkcheck:validators:https://a.com/') >
+                statuscache.VALIDATOR_TTL - 60)
+        text = metrics.render()
+        assert 'rr_revalidations_total{outcome="not_modified"} 1' in text
+        assert 'rr_revalidation_saved_bytes_total 5000' in text
+        assert 'rr_revalidation_saved_seconds_total' in text
+    
+    @patch('linkcheck.head_or_get')
+    def test_head_saves_no_bytes(self, mock_head_or_get, fake_redis):
+        """Test a 304 to a HEAD is not counted as saved body bytes."""
+        statuscache.store_validators('https://a.com/', dict(
+            status=200, url='https://a.com/', etag='"v1"',
+            last_modified=None, length=5000, seconds=0.5))
+        mock_head_or_get.return_value = answer(304)
+        
+        assert fetch_status('https://a.com/') == (200, 'https://a.com/')
+        assert 'rr_revalidation_saved_bytes_total 5000' not in metrics.render()
+    
+    @patch('linkcheck.head_or_get')
+    def test_modified(self, mock_head_or_get, fake_redis):
+        """Test a changed link is checked in full and its validators kept."""
+        statuscache.store_validators('https://a.com/', dict(
+            status=200, url='https://a.com/', etag='"v1"',
+            last_modified=None, length=0, seconds=0.5))
+        mock_head_or_get.return_value = answer(200, ETag='"v2"')
+        
+        assert fetch_status('https://a.com/') == (200, 'https://a.com/')
+        assert statuscache.lookup_validators('https://a.com/')['etag'] == '"v2"'
+        assert ('rr_revalidations_total{outcome="modified"} 1'
+                in metrics.render())
+    
+    @patch('linkcheck.head_or_get')
+    def test_errors_not_stored(self, mock_head_or_get, fake_redis):
+        """Test only successful answers leave validators."""
+        mock_head_or_get.return_value = answer(404, ETag='"gone"')
+        
+        assert fetch_status('https://a.com/') == (404, 'https://a.com/')
+        assert statuscache.lookup_validators('https://a.com/') is None
+
+
+class TestCheckUrlsCallback:
+    """Test check_urls reports each result as it finishes."""
+    
+    def test_check_urls_on_result(self):
+        """Test on_result sees every index with its status."""
+        seen = []
+        urls = ['https://a.com/', 'https://b.com/', 'https://c.com/']
+        
+        statuses = check_urls(urls, lambda url: 200, max_workers=2,
+                              on_result=lambda i, s: seen.append((i, s)))
+        
+        assert sorted(seen) == [(0, '200'), (1, '200'), (2, '200')]
+        assert statuses == ['200'] * 3
+
+
+class FakeLimiter:
+    """Limiter refusing a host a given number of times, recording releases."""
+    
+    def __init__(self, refusals=0):
+        self.refusals = refusals
+        self.released = []
+    
+    def try_acquire(self, host):
+        if self.refusals:
+            self.refusals -= 1
+            return False
+        return True
+    
+    def release(self, host, status=None, elapsed=None):
+        self.released.append((host, status))
+
+
+class TestCheckUrlsLimiter:
+    """Test check_urls with a per-host limiter."""
+    
+    def test_check_urls_waits_for_limiter(self):
+        """Test refused hosts are retried until admitted."""
+        limiter = FakeLimiter(refusals=3)
+        urls = ['https://a.com/1', 'https://a.com/2']
+        
+        statuses = check_urls(urls, lambda url: 200, limiter=limiter)
+        
+        assert statuses == ['200', '200']
+        assert limiter.released == [('a.com', '200'), ('a.com', '200')]
+    
+    def test_check_urls_retries_throttled_once(self):
+        """Test a 429 is retried once and a second 429 is reported."""
+        answers = {'https://a.com/': [429, 200], 'https://b.com/': [429, 429]}
+        
+        def check(url):
+            return answers[url].pop(0)
+        
+        statuses = check_urls(list(answers), check, limiter=FakeLimiter())
+        
+        assert statuses == ['200', '429']
+    
+    def test_check_urls_no_retry_without_limiter(self):
+        """Test throttled answers are reported as is without a limiter."""
+        assert check_urls(['https://a.com/'], lambda url: 429) == ['429']
+    
+    def test_check_urls_known_statuses_skip_limiter(self):
+        """Test urls answered by lookup are reported without a check."""
+        limiter = FakeLimiter()
+        known = {'https://a.com/1': 404}
+        reported = []
+        
+        statuses = check_urls(['https://a.com/1', 'https://a.com/2'],
+                              lambda url: 200, limiter=limiter,
+                              lookup=known.get,
+                              on_result=lambda i, s: reported.append(i))
+        
+        assert statuses == ['404', '200']
+        assert sorted(reported) == [0, 1]
+        assert limiter.released == [('a.com', '200')]
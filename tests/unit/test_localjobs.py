@@ -0,0 +1,65 @@
+import time
+from unittest.mock import patch
+import pytest
+from celery import states
+import localjobs
+from localjobs import LocalResult
+
+
+@pytest.fixture
+def job_pool(monkeypatch):
+    """A fresh in-process job pool for each test."""
+    monkeypatch.setattr(localjobs, '_pool', None)
+    yield
+    if localjobs._pool is not None:
+        localjobs._pool.shutdown()
+
+
+def wait_ready(job_id, timeout=2):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        result = LocalResult(job_id)
+        if result.ready():
+            return result
+        time.sleep(0.01)
+    raise AssertionError('job %s not ready' % job_id)
+
+
+class TestLocalJobs:
+    """Test in-process jobs and their Redis backed results."""
+    
+    def test_unknown_job_is_pending(self, fake_redis):
+        """Test an id without state looks like a pending Celery job."""
+        result = LocalResult('missing')
+        assert result.state == states.PENDING
+        assert not result.ready()
+        assert str(result) == 'missing'
+    
+    def test_apply_async_success(self, fake_redis, job_pool):
+        """Test the return value of the job becomes its result."""
+        localjobs.apply_async(lambda a, b: {'sum': a + b}, (1, 2), 'job_1')
+        
+        result = wait_ready('job_1')
+        assert result.successful()
+        assert result.result == {'sum': 3}
+        assert localjobs.stats()['completed'] == 1
+    
+    def test_apply_async_failure(self, fake_redis, job_pool):
+        """Test a raising job ends in FAILURE."""
+        def fail():
+            raise ValueError('boom')
+        
+        localjobs.apply_async(fail, (), 'job_1')
+        
+        result = wait_ready('job_1')
+        assert result.state == states.FAILURE
+        assert not result.successful()
+    
+    @patch('localjobs.LOCAL_JOB_TIMEOUT', 0.05)
+    def test_apply_async_timeout(self, fake_redis, job_pool):
+        """Test a job over LOCAL_JOB_TIMEOUT is reported as failed."""
+        localjobs.apply_async(time.sleep, (0.5,), 'job_1')
+        
+        result = wait_ready('job_1')
+        assert result.state == states.FAILURE
+        assert 'TimeoutError' in result.result
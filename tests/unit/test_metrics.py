@@ -0,0 +1,83 @@
+from unittest.mock import patch
+import redis
+import metrics
+
+
+class TestCounter:
+    """Test counters kept in Redis."""
+
+    def test_inc_per_label_set(self, fake_redis):
+        """Test every label set is a series of its own."""
+        counter = metrics.Counter('test_events_total', 'Test events')
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        counter.inc(kind='b')
+
+        text = metrics.render()
+
+        assert '# TYPE test_events_total counter' in text
+        assert 'test_events_total{kind="a"} 3' in text
+        assert 'test_events_total{kind="b"} 1' in text
+
+    def test_inc_redis_unavailable(self):
+        """Test recording never raises."""
+        counter = metrics.Counter('test_down_total', 'Test events')
+        with patch('utilites.get_redis', side_effect=redis.ConnectionError):
+            counter.inc()
+
+
+class TestHistogram:
+    """Test histograms kept in Redis."""
+
+    def test_buckets_are_cumulative(self, fake_redis):
+        """Test rendered buckets count every value up to their bound."""
+        histogram = metrics.Histogram('test_seconds', 'Test durations',
+                                      buckets=(0.1, 1))
+        histogram.observe(0.05, step='x')
+        histogram.observe(0.5, step='x')
+        histogram.observe(5, step='x')
+
+        lines = metrics.render().splitlines()
+
+        assert 'test_seconds_bucket{step="x",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{step="x",le="1"} 2' in lines
+        assert 'test_seconds_bucket{step="x",le="+Inf"} 3' in lines
+        assert 'test_seconds_sum{step="x"} 5.55' in lines
+        assert 'test_seconds_count{step="x"} 3' in lines
+
+    def test_time_and_wrap(self, fake_redis):
+        """Test timed blocks and wrapped calls are observed."""
+        histogram = metrics.Histogram('test_timed_seconds', 'Test durations')
+        with histogram.time():
+            pass
+        assert histogram.wrap(lambda x: x * 2)(21) == 42
+
+        assert 'test_timed_seconds_count 2' in metrics.render()
+
+    def test_label_values_escaped(self, fake_redis):
+        """Test quotes in label values do not break the format."""
+        histogram = metrics.Histogram('test_escaped_seconds', 'Test')
+        histogram.observe(1, host='a"b')
+
+        assert 'test_escaped_seconds_count{host="a\\"b"} 1' in metrics.render()
+
+
+class TestRender:
+    """Test the exposition output."""
+
+    def test_collectors_rendered(self, fake_redis):
+        """Test values kept elsewhere are included."""
+        with patch.object(metrics, '_collectors', [lambda: [
+                ('test_gauge', 'gauge', 'Test gauge', [({'host': 'a'}, 0.5)])]]):
+            text = metrics.render()
+
+        assert '# TYPE test_gauge gauge' in text
+        assert 'test_gauge{host="a"} 0.5' in text
+
+    def test_render_redis_unavailable(self):
+        """Test the metric names are still listed without Redis."""
+        with patch('utilites.get_redis', side_effect=redis.ConnectionError), \
+                patch.object(metrics, '_collectors', []):
+            text = metrics.render()
+
+        assert '# TYPE rr_tasks_total counter' in text
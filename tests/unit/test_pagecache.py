@@ -0,0 +1,164 @@
+import gzip
+from unittest.mock import patch
+import pytest
+import pagecache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Start every test without cached pages."""
+    pagecache.clear()
+    yield
+    pagecache.clear()
+
+
+class TestCachedPages:
+    """Test pages rendered once and served with ETags."""
+
+    def test_rendered_once(self, client):
+        """Test a cached page renders its template on the first hit only."""
+        with patch('app.render_template',
+                   return_value='<html>about</html>') as mock_render:
+            first = client.get('/about')
+            second = client.get('/about')
+
+        mock_render.assert_called_once_with('about.html')
+        assert first.data == second.data == b'<html>about</html>'
+        assert first.headers['ETag'] == second.headers['ETag']
+        assert first.headers['Cache-Control'] == 'public, max-age=%d' % (
+            pagecache.PAGE_CACHE_MAX_AGE)
+
+    def test_not_modified(self, client):
+        """Test a matching If-None-Match gets 304 without a body."""
+        etag = client.get('/projects').headers['ETag']
+
+        response = client.get('/projects', headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+
+    def test_changed_page_gets_new_etag(self, client):
+        """Test a page rendered again after clear() with new content."""
+        with patch('app.render_template', return_value='old'):
+            etag = client.get('/research').headers['ETag']
+        pagecache.clear()
+
+        with patch('app.render_template', return_value='new'):
+            response = client.get('/research',
+                                  headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.data == b'new'
+
+    def test_gzip_when_accepted(self, client):
+        """Test the stored gzip body is sent with its own ETag."""
+        plain = client.get('/policies')
+        packed = client.get('/policies', headers={'Accept-Encoding': 'gzip'})
+
+        assert 'Content-Encoding' not in plain.headers
+        assert packed.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(packed.data) == plain.data
+        assert packed.headers['ETag'] != plain.headers['ETag']
+        assert packed.headers['Vary'] == 'Accept-Encoding'
+
+        response = client.get('/policies', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': packed.headers['ETag']})
+        assert response.status_code == 304
+
+    @patch('pagecache.PAGE_HOSTS', ['localhost'])
+    def test_robots_and_sitemap(self, client):
+        """Test the text routes are cached with their types."""
+        robots = client.get('/robots.txt')
+        sitemap = client.get('/sitemap.xml')
+
+        assert robots.mimetype == 'text/plain'
+        assert sitemap.mimetype == 'application/xml'
+        assert b'<loc>http://localhost/about</loc>' in sitemap.data
+        assert 'ETag' in robots.headers and 'ETag' in sitemap.headers
+
+    def test_vary_on_configuration(self, client):
+        """Test the upload form is rendered per captcha configuration."""
+        client.get('/')
+        client.application.config['CAPTCHA_KEY_ID'] = 'other-key'
+        try:
+            assert b'other-key' in client.get('/').data
+        finally:
+            client.application.config['CAPTCHA_KEY_ID'] = 'test-key'
+
+    def test_debug_renders_every_time(self, client):
+        """Test template reloading turns the cache off."""
+        client.application.config['TEMPLATES_AUTO_RELOAD'] = True
+        try:
+            with patch('app.render_template',
+                       return_value='page') as mock_render:
+                client.get('/about')
+                response = client.get('/about')
+        finally:
+            client.application.config['TEMPLATES_AUTO_RELOAD'] = None
+
+        assert mock_render.call_count == 2
+        assert 'ETag' not in response.headers
+
+    def test_errors_not_cached(self, client):
+        """Test a failed render is not kept."""
+        with patch('app.render_template', return_value=('down', 503)):
+            assert client.get('/contribute').status_code == 503
+
+        assert client.get('/contribute').status_code == 200
+
+    @patch('pagecache.MAX_PAGES', 2)
+    def test_least_recently_served_evicted(self, client):
+        """Test a full cache drops the page served longest ago."""
+        client.get('/about')
+        client.get('/contribute')
+        client.get('/about')
+        client.get('/policies')
+
+        assert [key[0] for key in pagecache._pages] == ['about', 'policies']
+
+    def test_host_header_not_in_key(self, client):
+        """Test pages are shared by every Host a client sends."""
+        for i in range(20):
+            client.get('/about', base_url='http://junk%d.example' % i)
+            client.get('/sitemap.xml', base_url='http://junk%d.example' % i)
+
+        assert len(pagecache._pages) == 2
+
+    @patch('pagecache.PAGE_HOSTS', ['rottingresearch.org'])
+    def test_sitemap_only_on_trusted_hosts(self, client):
+        """Test an untrusted Host never shows up in the sitemap."""
+        junk = client.get('/sitemap.xml', base_url='http://junk.example')
+        trusted = client.get('/sitemap.xml',
+                             base_url='http://rottingresearch.org')
+
+        assert b'junk.example' not in junk.data
+        assert b'<loc>https://rottingresearch.org/about</loc>' in junk.data
+        assert b'<loc>http://rottingresearch.org/about</loc>' in trusted.data
+
+
+class TestCompress:
+    """Test compression of the dynamic responses."""
+
+    def test_large_json_gzipped(self, client):
+        """Test a large JSON response is gzipped for a client accepting it."""
+        stats = {'host-%d' % i: i for i in range(200)}
+        with patch('app.cache_stats', return_value=stats):
+            response = client.get('/check/stats',
+                                  headers={'Accept-Encoding': 'gzip'})
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert b'host-199' in gzip.decompress(response.data)
+
+    def test_small_or_unaccepted_left_alone(self, client):
+        """Test small responses and clients without gzip get plain bodies."""
+        stats = {'host-%d' % i: i for i in range(200)}
+        with patch('app.cache_stats', return_value={'hits': 1}):
+            small = client.get('/check/stats',
+                               headers={'Accept-Encoding': 'gzip'})
+        with patch('app.cache_stats', return_value=stats):
+            plain = client.get('/check/stats')
+
+        assert 'Content-Encoding' not in small.headers
+        assert 'Content-Encoding' not in plain.headers
+        assert plain.get_json() == stats
@@ -0,0 +1,158 @@
+from unittest.mock import Mock, patch
+import redis
+import metrics
+from politeness import (HostLimiter, parse_host_limits, record_latency,
+                        host_latencies, schedule_batches, LATENCY_PREFIX)
+
+
+def make_refs(urls):
+    return [{'reftype': 'url', 'ref': url, 'url': url, 'page': 1}
+            for url in urls]
+
+
+class TestParseHostLimits:
+    """Test the HOST_LIMITS format."""
+    
+    def test_parse_host_limits(self):
+        """Test pairs are parsed and blanks ignored."""
+        assert parse_host_limits('doi.org=4:5, ArXiv.org=2:1,') == {
+            'doi.org': (4, 5), 'arxiv.org': (2, 1)}
+        assert parse_host_limits('') == {}
+
+
+class TestHostLimiter:
+    """Test the shared per-host limiter."""
+    
+    def test_limits_for_override_and_subdomain(self):
+        """Test overrides apply to the host and its subdomains."""
+        limiter = HostLimiter(concurrency=8, rate=10,
+                              limits={'doi.org': (2, 3)})
+        
+        assert limiter.limits_for('doi.org') == (2, 3)
+        assert limiter.limits_for('dx.doi.org') == (2, 3)
+        assert limiter.limits_for('example.com') == (8, 10)
+    
+    def test_concurrency_limit(self, fake_redis):
+        """Test a host is refused once its concurrency is used up."""
+        limiter = HostLimiter(concurrency=2, rate=100, limits={})
+        
+        assert limiter.try_acquire('a.com')
+        assert limiter.try_acquire('a.com')
+        assert not limiter.try_acquire('a.com')
+        assert limiter.try_acquire('b.com')
+        
+        limiter.release('a.com')
+        assert limiter.try_acquire('a.com')
+    
+    def test_rate_limit(self, fake_redis):
+        """Test a host is refused once its per-second rate is used up."""
+        limiter = HostLimiter(concurrency=100, rate=2, limits={})
+        
+        with patch('politeness.time.time', return_value=1000.0):
+            assert limiter.try_acquire('a.com')
+            assert limiter.try_acquire('a.com')
+            assert not limiter.try_acquire('a.com')
+        with patch('politeness.time.time', return_value=1001.0):
+            assert limiter.try_acquire('a.com')
+
+    def test_refusals_do_not_use_the_rate(self, fake_redis):
+        """Test refused attempts leave the rate budget untouched."""
+        limiter = HostLimiter(concurrency=1, rate=10, limits={})
+
+        with patch('politeness.time.time', return_value=1000.0):
+            assert limiter.try_acquire('a.com')
+            for _ in range(12):
+                assert not limiter.try_acquire('a.com')
+            limiter.release('a.com')
+            assert limiter.try_acquire('a.com')
+
+    def test_backoff_after_throttling(self, fake_redis):
+        """Test a 429 keeps the host refused for the backoff period."""
+        limiter = HostLimiter(concurrency=8, rate=100, limits={}, backoff=30)
+        
+        assert limiter.try_acquire('a.com')
+        limiter.release('a.com', '429', 0.1)
+        
+        assert not limiter.try_acquire('a.com')
+        assert fake_redis.ttl('linkcheck:host:backoff:a.com') == 30
+        assert limiter.try_acquire('b.com')
+    
+    @patch('utilites.get_redis')
+    def test_redis_unavailable(self, mock_get_redis):
+        """Test checks are let through when Redis is down."""
+        mock_redis = Mock()
+        mock_redis.exists.side_effect = redis.ConnectionError()
+        mock_redis.decr.side_effect = redis.ConnectionError()
+        mock_get_redis.return_value = mock_redis
+        limiter = HostLimiter()
+        
+        assert limiter.try_acquire('a.com')
+        limiter.release('a.com', '200', 0.1)
+
+
+class TestLatency:
+    """Test the per-host latency average."""
+    
+    def test_record_latency_moving_average(self, fake_redis):
+        """Test samples are folded into an exponential average."""
+        record_latency('a.com', 1.0)
+        record_latency('a.com', 2.0)
+        
+        assert host_latencies(['a.com', 'b.com']) == {'a.com': 1.3}
+        assert fake_redis.get(LATENCY_PREFIX + 'a.com') == b'1.3'
+
+    def test_latency_expires(self, fake_redis):
+        """Test the latency of a host no longer checked is forgotten."""
+        with patch('politeness.HOST_LATENCY_TTL', 60):
+            record_latency('a.com', 1.0)
+
+        assert fake_redis.ttl(LATENCY_PREFIX + 'a.com') == 60
+
+    def test_latency_metric_has_no_host_label(self, fake_redis):
+        """Test the exported latency is one histogram over all hosts."""
+        record_latency('a.com', 0.2)
+        record_latency('b.com', 3.0)
+
+        text = metrics.render()
+
+        assert 'rr_host_check_latency_seconds_count 2' in text
+        assert 'host=' not in text
+
+
+class TestScheduleBatches:
+    """Test host aware batching."""
+    
+    def test_schedule_batches_groups_hosts(self, fake_redis):
+        """Test a heavily cited host gets batches of its own."""
+        refs = make_refs(['https://big.com/%d' % i for i in range(4)] +
+                         ['https://a.com/', 'https://b.com/'])
+        
+        batches = schedule_batches(refs, 2)
+        
+        assert sorted(len(batch) for batch in batches) == [2, 2, 2]
+        assert sum(len(batch) for batch in batches) == 6
+        hosts = [{ref['url'].split('/')[2] for ref in batch}
+                 for batch in batches]
+        assert {'big.com'} in hosts
+    
+    def test_schedule_batches_fast_hosts_first(self, fake_redis):
+        """Test batches of faster hosts are scheduled first."""
+        record_latency('slow.com', 5.0)
+        record_latency('fast.com', 0.1)
+        refs = make_refs(['https://slow.com/1', 'https://slow.com/2',
+                          'https://fast.com/1', 'https://fast.com/2'])
+        
+        batches = schedule_batches(refs, 2)
+        
+        assert [ref['url'] for ref in batches[0]] == [
+            'https://fast.com/1', 'https://fast.com/2']
+    
+    def test_schedule_batches_keeps_every_reference(self, fake_redis):
+        """Test no reference is lost or duplicated."""
+        urls = ['https://h%d.com/%d' % (i % 3, i) for i in range(11)]
+        
+        batches = schedule_batches(make_refs(urls), 4)
+        
+        assert all(len(batch) <= 4 for batch in batches)
+        assert sorted(ref['url'] for batch in batches for ref in batch) == \
+            sorted(urls)
@@ -0,0 +1,74 @@
+from unittest.mock import Mock, patch
+import redis
+import progress
+
+
+class TestProgress:
+    """Test the per-analysis progress stream."""
+    
+    def test_publish_and_read(self, fake_redis):
+        """Test results are read back in publish order from a cursor."""
+        progress.publish('job_1', [{'check': ['200']}])
+        progress.publish('job_1', [{'check': ['404']}, {'check': ['403']}])
+        
+        assert progress.read('job_1') == [{'check': ['200']},
+                                          {'check': ['404']},
+                                          {'check': ['403']}]
+        assert progress.read('job_1', 2) == [{'check': ['403']}]
+        assert progress.read('job_1', 3) == []
+    
+    def test_publish_sets_expiry(self, fake_redis):
+        """Test the stream expires with the analysis."""
+        progress.publish('job_1', [{'check': ['200']}])
+        
+        ttl = fake_redis.ttl(progress.progress_key('job_1'))
+        assert 0 < ttl <= progress.PROGRESS_TTL
+    
+    def test_checked(self, fake_redis):
+        """Test the published results are read back by key."""
+        progress.publish('job_1', [['url', 'https://a.com', '200']])
+        progress.publish('job_1', [['url', 'https://b.com', '404']])
+        
+        def url(result):
+            return result[1]
+        
+        assert progress.checked('job_1', url) == {
+            'https://a.com': ['url', 'https://a.com', '200'],
+            'https://b.com': ['url', 'https://b.com', '404']}
+        assert progress.checked('job_2', url) == {}
+        assert progress.checked(None, url) == {}
+        # nothing but the stream is stored
+        assert fake_redis.keys() == [b'analysis:progress:job_1']
+    
+    def test_publish_without_job(self, fake_redis):
+        """Test nothing is published for direct calls without a job id."""
+        progress.publish(None, [{'check': ['200']}])
+        progress.publish('job_1', [])
+        
+        assert fake_redis.keys() == []
+    
+    def test_publish_announces(self, fake_redis):
+        """Test appends and finished results are announced to streams."""
+        pubsub = fake_redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(progress.events_channel('job_1'))
+        
+        progress.publish('job_1', [{'check': ['200']}])
+        progress.notify_done('job_1')
+        
+        # the subscribe confirmation reads as None
+        messages = [pubsub.get_message(timeout=1) for _ in range(3)]
+        assert [m['data'] for m in messages if m] == [b'progress', b'done']
+    
+    def test_redis_unavailable(self):
+        """Test a Redis outage does not break checks or polling."""
+        broken = Mock()
+        broken.pipeline.return_value.execute.side_effect = (
+            redis.ConnectionError())
+        broken.lrange.side_effect = redis.ConnectionError()
+        
+        with patch('utilites.get_redis', return_value=broken):
+            progress.publish('job_1', [{'check': ['200']}])
+            assert progress.read('job_1') == []
+            assert progress.checked('job_1', lambda result: result[1]) == {}
+            broken.publish.side_effect = redis.ConnectionError()
+            progress.notify_done('job_1')
@@ -0,0 +1,88 @@
+from unittest.mock import Mock, patch
+import redis
+import queues
+
+
+class TestCheckQueue:
+    """Test the queue chosen for the link checks of a paper."""
+
+    def test_small_paper_goes_to_checks(self, fake_redis):
+        """Test a short paper is checked on the checks queue."""
+        assert queues.check_queue(20, 'alice') == queues.CHECKS_QUEUE
+        assert fake_redis.get('queue:submitter:alice') == b'20'
+        assert fake_redis.ttl('queue:submitter:alice') > 0
+
+    @patch('queues.LARGE_PAPER_REFS', 100)
+    def test_large_paper_goes_to_bulk(self, fake_redis):
+        """Test a paper past LARGE_PAPER_REFS is checked on the bulk queue."""
+        assert queues.check_queue(101, 'alice') == queues.BULK_QUEUE
+        assert queues.check_queue(100, 'bob') == queues.CHECKS_QUEUE
+
+    @patch('queues.SUBMITTER_FAIR_REFS', 50)
+    def test_submitter_over_fair_share_goes_to_bulk(self, fake_redis):
+        """Test a submitter with many references in flight is demoted."""
+        assert queues.check_queue(30, 'alice') == queues.CHECKS_QUEUE
+        assert queues.check_queue(30, 'alice') == queues.BULK_QUEUE
+        # other submitters keep the checks queue
+        assert queues.check_queue(30, 'bob') == queues.CHECKS_QUEUE
+
+        queues.checks_done(30, 'alice')
+        assert queues.check_queue(10, 'alice') == queues.CHECKS_QUEUE
+
+    def test_checks_done_removes_count(self, fake_redis):
+        """Test the count is deleted once every reference is checked."""
+        queues.check_queue(20, 'alice')
+
+        queues.checks_done(20, 'alice')
+
+        assert not fake_redis.exists('queue:submitter:alice')
+
+    def test_checks_done_once_per_job(self, fake_redis):
+        """Test a job releases its references only once."""
+        queues.check_queue(20, 'alice')
+
+        queues.checks_done(5, 'alice', 'job_1')
+        queues.checks_done(5, 'alice', 'job_1')
+
+        assert fake_redis.get('queue:submitter:alice') == b'15'
+
+    @patch('queues.TASK_MAX_DELIVERIES', 3)
+    def test_deliveries_exhausted(self, fake_redis):
+        """Test a task is given up once delivered more often than allowed."""
+        assert not queues.deliveries_exhausted('tasks.t', 'job_1')
+        assert not queues.deliveries_exhausted('tasks.t', 'job_1')
+        assert queues.deliveries_exhausted('tasks.t', 'job_1')
+        assert not queues.deliveries_exhausted('tasks.other', 'job_1')
+
+    def test_redis_unavailable(self):
+        """Test routing by size still works when Redis is down."""
+        broken = Mock()
+        broken.pipeline.return_value.execute.side_effect = (
+            redis.ConnectionError())
+        broken.decrby.side_effect = redis.ConnectionError()
+
+        with patch('utilites.get_redis', return_value=broken):
+            assert queues.check_queue(20, 'alice') == queues.CHECKS_QUEUE
+            queues.checks_done(20, 'alice')
+            assert not queues.deliveries_exhausted('tasks.t', 'job_1')
+
+    def test_submitter_id(self):
+        """Test addresses are reduced to a stable digest."""
+        assert queues.submitter_id('10.0.0.1') == queues.submitter_id('10.0.0.1')
+        assert queues.submitter_id('10.0.0.1') != queues.submitter_id('10.0.0.2')
+        assert '10.0.0.1' not in queues.submitter_id('10.0.0.1')
+
+
+class TestCeleryConfig:
+    """Test the app configures the queues."""
+
+    def test_routes_and_queues(self):
+        """Test every queue is declared and tasks are routed to them."""
+        from app import celery_app
+
+        names = [queue.name for queue in celery_app.conf.task_queues]
+        assert names == list(queues.ALL_QUEUES)
+        route = celery_app.amqp.router.route({}, 'tasks.pdfdata_task')
+        assert route['queue'].name == queues.INTERACTIVE_QUEUE
+        route = celery_app.amqp.router.route({}, 'tasks.build_download_archive')
+        assert route['queue'].name == queues.DEFAULT_QUEUE
@@ -0,0 +1,87 @@
+import logging
+from unittest.mock import Mock
+import redis
+import redisreport
+
+
+class TestKeyClass:
+    """Test keys are grouped by what stores them."""
+
+    def test_key_class(self):
+        """Test every store maps to its class."""
+        assert redisreport.key_class(b'celery-task-meta-abc') == 'results'
+        assert redisreport.key_class('celery-taskset-meta-abc.j') == 'chords'
+        assert redisreport.key_class(
+            'linkcheck:status:https://a.com/') == 'statuses'
+        assert redisreport.key_class(
+            'linkcheck:validators:https://a.com/') == 'validators'
+        assert redisreport.key_class('analysis:refs:job_1') == 'refindex'
+        assert redisreport.key_class('analysis:progress:job_1') == 'progress'
+        assert redisreport.key_class('celery') == 'broker'
+        assert redisreport.key_class('bulk') == 'broker'
+        assert redisreport.key_class('queue:submitter:ab12') == 'counters'
+        assert redisreport.key_class('_kombu.binding.celery') == 'broker'
+        assert redisreport.key_class('something') == 'other'
+
+
+class TestReport:
+    """Test the keyspace report."""
+
+    def test_report_counts_keys_per_class(self, fake_redis):
+        """Test keys and bytes are summed per class."""
+        fake_redis.set('celery-task-meta-1', 'x' * 100)
+        fake_redis.set('celery-task-meta-2', 'x' * 100)
+        fake_redis.rpush('analysis:progress:job_1', 'a', 'b')
+
+        report = redisreport.report()
+
+        assert report['keys'] == 3
+        assert report['classes']['results']['keys'] == 2
+        assert report['classes']['results']['bytes'] > 200
+        assert report['classes']['progress']['keys'] == 1
+        assert report['bytes'] == sum(c['bytes']
+                                      for c in report['classes'].values())
+
+    def test_log_report_stores_latest(self, fake_redis):
+        """Test the logged report is kept for latest()."""
+        assert redisreport.latest() == {}
+        fake_redis.set('celery-task-meta-1', 'x')
+
+        logged = redisreport.log_report()
+
+        stored = redisreport.latest()
+        assert stored['classes'] == logged['classes']
+        assert 'generated' in stored
+        assert fake_redis.ttl(redisreport.REPORT_KEY) > 0
+
+    def test_report_memory_usage(self):
+        """Test MEMORY USAGE and INFO figures are used when available."""
+        client = Mock()
+        client.scan_iter.return_value = [b'celery-task-meta-1']
+        client.pipeline.return_value.execute.return_value = [512]
+        client.info.return_value = {'used_memory': 2048, 'maxmemory': 4096,
+                                    'maxmemory_policy': 'volatile-lru'}
+
+        report = redisreport.report(client)
+
+        assert report['classes'] == {'results': {'keys': 1, 'bytes': 512}}
+        assert report['used_memory'] == 2048
+        assert report['maxmemory_policy'] == 'volatile-lru'
+
+    def test_report_redis_unavailable(self):
+        """Test an unreachable Redis gives an empty report."""
+        client = Mock()
+        client.scan_iter.side_effect = redis.ConnectionError()
+
+        assert redisreport.report(client) == {}
+
+    def test_log_report_warns_on_allkeys_policy(self, caplog):
+        """Test a policy that can evict the queues is warned about."""
+        client = Mock()
+        client.scan_iter.return_value = []
+        client.info.return_value = {'maxmemory_policy': 'allkeys-lru'}
+
+        with caplog.at_level(logging.INFO, logger='redisreport'):
+            redisreport.log_report(client)
+
+        assert 'allkeys-lru can evict' in caplog.text
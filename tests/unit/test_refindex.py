@@ -0,0 +1,74 @@
+import zlib
+from unittest.mock import Mock, patch
+import redis
+import refindex
+
+
+def make_ref(reftype, ref, page):
+    row = Mock()
+    row.reftype = reftype
+    row.ref = ref
+    row.page = page
+    return row
+
+
+class TestRefIndex:
+    """Test the persisted reference index."""
+    
+    def test_build(self):
+        """Test rows hold type, value, normalized url and page."""
+        index = refindex.build({'Title': 'Test'}, [
+            make_ref('arxiv', '1234.5678', 1),
+            make_ref('doi', '10.1000/182', 2),
+            make_ref('url', 'Example.com/page#top', 3),
+            make_ref('pdf', 'https://example.com/a.pdf', 4),
+        ])
+        
+        assert index['metadata'] == {'Title': 'Test'}
+        assert index['references'] == [
+            ['arxiv', '1234.5678', 'https://arxiv.org/abs/1234.5678', 1],
+            ['doi', '10.1000/182', 'https://doi.org/10.1000/182', 2],
+            ['url', 'Example.com/page#top', 'http://example.com/page', 3],
+            ['pdf', 'https://example.com/a.pdf',
+             'https://example.com/a.pdf', 4],
+        ]
+    
+    def test_save_and_load(self, fake_redis):
+        """Test the index round-trips compressed under the task id."""
+        index = {'metadata': {}, 'references': [
+            ['pdf', 'https://example.com/a.pdf', 'https://example.com/a.pdf',
+             1]] * 50}
+        
+        refindex.save('job_1', index)
+        
+        stored = fake_redis.get(refindex.index_key('job_1'))
+        assert zlib.decompress(stored)
+        assert len(stored) < len(str(index))
+        assert refindex.load('job_1') == index
+        assert refindex.load('job_2') is None
+        assert refindex.load(None) is None
+    
+    def test_ref_dicts_and_pdf_urls(self):
+        """Test the views used by the analysis and download steps."""
+        index = {'metadata': {}, 'references': [
+            ['pdf', 'https://a.com/x.pdf', 'https://a.com/x.pdf', 1],
+            ['url', 'https://b.com', 'https://b.com/', 1],
+            ['pdf', 'https://a.com/x.pdf', 'https://a.com/x.pdf', 5],
+        ]}
+        
+        assert refindex.ref_dicts(index) == [
+            {'reftype': 'pdf', 'ref': 'https://a.com/x.pdf'},
+            {'reftype': 'url', 'ref': 'https://b.com'},
+            {'reftype': 'pdf', 'ref': 'https://a.com/x.pdf'},
+        ]
+        assert refindex.pdf_urls(index) == ['https://a.com/x.pdf']
+    
+    def test_redis_unavailable(self):
+        """Test a Redis outage only means the index is not reused."""
+        broken = Mock()
+        broken.set.side_effect = redis.ConnectionError()
+        broken.get.side_effect = redis.ConnectionError()
+        
+        with patch('utilites.get_redis', return_value=broken):
+            refindex.save('job_1', {'metadata': {}, 'references': []})
+            assert refindex.load('job_1') is None
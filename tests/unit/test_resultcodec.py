@@ -0,0 +1,39 @@
+import json
+import zlib
+from celery import Celery
+import resultcodec
+
+
+class TestResultCodec:
+    """Test the compressed result serializer."""
+
+    def test_round_trip(self):
+        """Test a result survives encoding and is stored compressed."""
+        result = {'metadata': {'Title': 'Test'},
+                  'result_data': [['url', 'https://example.com', '200']]}
+
+        data = resultcodec.dumps(result)
+
+        assert resultcodec.loads(data) == result
+        assert json.loads(zlib.decompress(data)) == result
+
+    def test_loads_plain_json(self):
+        """Test results stored before compression are still read."""
+        data = json.dumps({'result_data': []}).encode()
+
+        assert resultcodec.loads(data) == {'result_data': []}
+        assert resultcodec.loads(data.decode()) == {'result_data': []}
+
+    def test_celery_backend_uses_serializer(self):
+        """Test a Celery backend configured with zjson stores and reads."""
+        app = Celery('codec', backend='cache+memory://',
+                     set_as_current=False)
+        app.conf.result_serializer = resultcodec.SERIALIZER
+        app.conf.result_accept_content = ['json', resultcodec.SERIALIZER]
+        result = {'result_data': [['pdf', 'https://example.com/a.pdf', '404']]}
+
+        app.backend.store_result('task_1', result, 'SUCCESS')
+
+        assert app.backend.get_result('task_1') == result
+        stored = app.backend.get(app.backend.get_key_for_task('task_1'))
+        assert zlib.decompress(stored)
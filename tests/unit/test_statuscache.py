@@ -0,0 +1,98 @@
+import json
+from unittest.mock import Mock, patch
+import redis
+from statuscache import (normalize_url, ttl_for, cached_status, cache_stats,
+                         lookup, KEY_PREFIX, TTL_OK, TTL_CLIENT_ERROR,
+                         TTL_ERROR)
+
+
+class TestNormalizeUrl:
+    """Test cache key normalization."""
+    
+    def test_normalize_url_case_and_fragment(self):
+        """Test scheme and host case and fragments do not matter."""
+        assert (normalize_url('HTTPS://Example.COM/Paper#section') ==
+                'https://example.com/Paper')
+    
+    def test_normalize_url_default_port_and_path(self):
+        """Test default ports and empty paths are dropped."""
+        assert normalize_url('https://example.com:443') == 'https://example.com/'
+        assert (normalize_url('http://example.com:8080/a?b=1') ==
+                'http://example.com:8080/a?b=1')
+    
+    def test_normalize_url_no_scheme(self):
+        """Test urls without a scheme get one like the checker adds."""
+        assert normalize_url('example.com/page') == 'http://example.com/page'
+
+
+class TestTtlFor:
+    """Test outcome based expiry."""
+    
+    def test_ttl_for_outcomes(self):
+        """Test each outcome class gets its own TTL."""
+        assert ttl_for(200) == TTL_OK
+        assert ttl_for('301') == TTL_OK
+        assert ttl_for(404) == TTL_CLIENT_ERROR
+        assert ttl_for(503) == TTL_ERROR
+        assert ttl_for('timed out') == TTL_ERROR
+        assert ttl_for(None) == TTL_ERROR
+
+
+class TestCachedStatus:
+    """Test the shared status cache."""
+    
+    def test_cached_status_miss_then_hit(self, fake_redis):
+        """Test the first lookup fetches and the second is served cached."""
+        fetch = Mock(return_value=(200, 'https://example.com/final'))
+        
+        assert cached_status('https://example.com/', fetch) == 200
+        assert cached_status('https://EXAMPLE.com', fetch) == 200
+        
+        fetch.assert_called_once_with('https://example.com/')
+        entry = lookup('https://example.com/')
+        assert entry['status'] == 200
+        assert entry['url'] == 'https://example.com/final'
+        assert 'checked' in entry
+        assert cache_stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+    
+    def test_cached_status_ttl_by_outcome(self, fake_redis):
+        """Test failed checks expire sooner than successful ones."""
+        cached_status('https://ok.com/', Mock(return_value=(200, None)))
+        cached_status('https://down.com/', Mock(return_value=(500, None)))
+        
+        assert fake_redis.ttl(KEY_PREFIX + 'https://ok.com/') == TTL_OK
+        assert fake_redis.ttl(KEY_PREFIX + 'https://down.com/') == TTL_ERROR
+    
+    def test_cached_status_skips_throttled(self, fake_redis):
+        """Test 429 and 503 answers are not cached."""
+        fetch = Mock(side_effect=[(429, None), (503, None), (200, None)])
+        
+        assert cached_status('https://busy.com/', fetch) == 429
+        assert cached_status('https://busy.com/', fetch) == 503
+        assert cached_status('https://busy.com/', fetch) == 200
+        assert lookup('https://busy.com/')['status'] == 200
+    
+    def test_cached_status_recheck(self, fake_redis):
+        """Test recheck bypasses and refreshes the cached entry."""
+        fake_redis.set(KEY_PREFIX + 'https://example.com/',
+                       json.dumps({'status': 404, 'checked': 0,
+                                   'url': 'https://example.com/'}))
+        fetch = Mock(return_value=(200, None))
+        
+        assert cached_status('https://example.com/', fetch,
+                             recheck=True) == 200
+        assert lookup('https://example.com/')['status'] == 200
+        assert cache_stats()['misses'] == 1
+    
+    def test_cached_status_redis_unavailable(self):
+        """Test checks still work when Redis is down."""
+        broken = Mock()
+        broken.get.side_effect = redis.ConnectionError()
+        broken.set.side_effect = redis.ConnectionError()
+        broken.incr.side_effect = redis.ConnectionError()
+        broken.mget.side_effect = redis.ConnectionError()
+        fetch = Mock(return_value=(200, None))
+        
+        with patch('utilites.get_redis', return_value=broken):
+            assert cached_status('https://example.com/', fetch) == 200
+            assert cache_stats() == {'hits': 0, 'misses': 0, 'hit_rate': 0.0}
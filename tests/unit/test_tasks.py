@@ -1,14 +1,28 @@
+import time
 from unittest.mock import Mock, patch
-from tasks import pdfdata_task, sort_ref
+import pytest
+from celery.exceptions import WorkerLostError
+import metrics
+import progress
+import refindex
+import statuscache
+from tasks import (pdfdata_task, sort_ref, aggregate_results,
+                   check_refs_batch, analyse_pdf, build_ref_result,
+                   merge_pages,
+                   forget_results, start_task_timer, stop_task_timer,
+                   stamp_published, announce_result, reference_outline,
+                   RESULT_STATUS)
 
 
 class TestPDFDataTask:
     """Test the pdfdata_task Celery task."""
     
     @patch('tasks.linkrot.linkrot')
-    @patch('tasks.group')
-    def test_pdfdata_task_success(self, mock_group, mock_linkrot):
-        """Test successful PDF data processing."""
+    @patch('tasks.chord')
+    @patch.object(pdfdata_task, 'replace')
+    def test_pdfdata_task_success(self, mock_replace, mock_chord, mock_linkrot,
+                                  fake_redis):
+        """Test the link checks are handed to a chord instead of awaited."""
         # Mock linkrot instance
         mock_pdf = Mock()
         mock_pdf.get_metadata.return_value = {
@@ -21,39 +35,181 @@ class TestPDFDataTask:
         mock_ref = Mock()
         mock_ref.reftype = 'url'
         mock_ref.ref = 'https://example.com'
+        mock_ref.page = 3
         mock_pdf.get_references.return_value = [mock_ref]
         
         mock_linkrot.return_value = mock_pdf
+        mock_replace.return_value = 'replaced'
         
-        # Mock group execution
-        mock_group_result = Mock()
-        mock_group_result.ready.return_value = True
-        mock_child_result = Mock()
-        mock_child_result.result = {
-            'pdfs': [],
-            'urls': ['https://example.com'],
-            'arxiv': [],
-            'doi': [],
-            'check': ['200']
-        }
-        mock_group_result.__iter__ = Mock(
-            return_value=iter([mock_child_result]))
-        mock_group.return_value.return_value = mock_group_result
+        pdfdata_task.push_request(id='job_1')
+        try:
+            result = pdfdata_task('/test/path.pdf')
+        finally:
+            pdfdata_task.pop_request()
         
-        result = pdfdata_task('/test/path.pdf')
+        assert result == 'replaced'
+        mock_replace.assert_called_once_with(mock_chord.return_value)
         
-        # Verify metadata processing
-        assert 'Title' in result['metadata']
-        assert 'Author' in result['metadata']
-        assert 'CreationDate' in result['metadata']
+        header, callback = mock_chord.call_args[0]
+        assert len(header) == 1
+        assert header[0].task == 'tasks.check_refs_batch'
+        # a first run has nothing to resume
+        assert header[0].args == (
+            [{'reftype': 'url', 'ref': 'https://example.com'}], 'job_1',
+            False)
         
-        # Verify date formatting
-        expected_date = '2024-01-01 12:00 UTC+00:00'
-        assert result['metadata']['CreationDate'] == expected_date
+        # The callback forgets the results of the checks
+        assert callback.args[1] == [header[0].id]
         
-        # Verify result data
-        assert len(result['result_data']) == 1
-        assert result['result_data'][0]['urls'] == ['https://example.com']
+        # A short paper is checked on the checks queue
+        assert header[0].options['queue'] == 'checks'
+        
+        # Verify metadata processing and date formatting
+        metadata = callback.args[0]
+        assert metadata['Title'] == 'Test PDF'
+        assert metadata['Author'] == 'Test Author'
+        assert metadata['CreationDate'] == '2024-01-01 12:00 UTC+00:00'
+        
+        # The extracted references are kept in the index of the task
+        index = refindex.load('job_1')
+        assert index['metadata'] == metadata
+        assert index['references'] == [
+            ['url', 'https://example.com', 'https://example.com/', 3]]
+        
+        # The extracted references are announced before any check
+        assert reference_outline('job_1') == {
+            'metadata': metadata,
+            'references': [['url', 'https://example.com']]}
+        
+        # Parsing is timed and the references counted
+        text = metrics.render()
+        assert 'rr_pdf_parse_seconds_count{step="references"} 1' in text
+        assert 'rr_pdf_references_bucket{le="10"} 1' in text
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.chord')
+    @patch.object(pdfdata_task, 'replace')
+    def test_pdfdata_task_reuses_index(self, mock_replace, mock_chord,
+                                       mock_linkrot, fake_redis):
+        """Test a rerun with a stored index does not parse the PDF again."""
+        refindex.save('job_1', {
+            'metadata': {'Title': 'Test PDF'},
+            'references': [['doi', '10.1000/182',
+                            'https://doi.org/10.1000/182', 2]]
+        })
+        
+        pdfdata_task.push_request(id='job_1')
+        try:
+            pdfdata_task('/test/path.pdf')
+        finally:
+            pdfdata_task.pop_request()
+        
+        mock_linkrot.assert_not_called()
+        header, callback = mock_chord.call_args[0]
+        assert header[0].args[0] == [{'reftype': 'doi', 'ref': '10.1000/182'}]
+        # the checks of a rerun skip what the first run published
+        assert header[0].args[2] is True
+        assert callback.args[0] == {'Title': 'Test PDF'}
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.chord')
+    @patch.object(pdfdata_task, 'replace')
+    @patch('tasks.BATCH_SIZE', 2)
+    def test_pdfdata_task_batches_references(self, mock_replace, mock_chord,
+                                             mock_linkrot):
+        """Test references are split into check_refs_batch chunks."""
+        mock_pdf = Mock()
+        mock_pdf.get_metadata.return_value = {}
+        refs = []
+        for i in range(5):
+            ref = Mock()
+            ref.reftype = 'url'
+            ref.ref = 'https://example.com/%d' % i
+            refs.append(ref)
+        mock_pdf.get_references.return_value = refs
+        mock_linkrot.return_value = mock_pdf
+        
+        pdfdata_task('/test/path.pdf')
+        
+        header = mock_chord.call_args[0][0]
+        assert [len(sig.args[0]) for sig in header] == [2, 2, 1]
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.chord')
+    @patch.object(pdfdata_task, 'replace')
+    @patch('tasks.CHECK_ENGINE', 'task')
+    def test_pdfdata_task_per_reference_engine(self, mock_replace, mock_chord,
+                                               mock_linkrot):
+        """Test the per-reference engine dispatches one sort_ref each."""
+        mock_pdf = Mock()
+        mock_pdf.get_metadata.return_value = {}
+        mock_ref = Mock()
+        mock_ref.reftype = 'doi'
+        mock_ref.ref = '10.1000/182'
+        mock_pdf.get_references.return_value = [mock_ref, mock_ref]
+        mock_linkrot.return_value = mock_pdf
+        
+        pdfdata_task('/test/path.pdf')
+        
+        header = mock_chord.call_args[0][0]
+        assert [sig.task for sig in header] == ['tasks.sort_ref'] * 2
+        assert header[0].args == ({'reftype': 'doi', 'ref': '10.1000/182'},
+                                  None, False)
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.chord')
+    @patch.object(pdfdata_task, 'replace')
+    @patch('queues.LARGE_PAPER_REFS', 3)
+    def test_pdfdata_task_large_paper_queue(self, mock_replace, mock_chord,
+                                            mock_linkrot, fake_redis):
+        """Test a large paper is checked on the bulk queue."""
+        mock_pdf = Mock()
+        mock_pdf.get_metadata.return_value = {}
+        refs = []
+        for i in range(4):
+            ref = Mock()
+            ref.reftype = 'url'
+            ref.ref = 'https://example.com/%d' % i
+            refs.append(ref)
+        mock_pdf.get_references.return_value = refs
+        mock_linkrot.return_value = mock_pdf
+        
+        pdfdata_task('/test/path.pdf', submitter='alice')
+        
+        header, callback = mock_chord.call_args[0]
+        assert [sig.options['queue'] for sig in header] == ['bulk']
+        assert callback.args[2] == 'alice'
+        assert fake_redis.get('queue:submitter:alice') == b'4'
+        assert 'rr_papers_routed_total{queue="bulk"} 1' in metrics.render()
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.chord')
+    @patch.object(pdfdata_task, 'replace')
+    def test_pdfdata_task_announces_outline(self, mock_replace, mock_chord,
+                                            mock_linkrot, fake_redis):
+        """Test the outline is announced before the checks are queued."""
+        refindex.save('job_1', {
+            'metadata': {'Title': 'Test PDF'},
+            'references': [['arxiv', '2101.00001',
+                            'https://arxiv.org/abs/2101.00001', 1]]
+        })
+        pubsub = fake_redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(progress.events_channel('job_1'))
+        
+        pdfdata_task.push_request(id='job_1')
+        try:
+            pdfdata_task('/test/path.pdf')
+        finally:
+            pdfdata_task.pop_request()
+        
+        messages = [pubsub.get_message(timeout=1) for _ in range(2)]
+        assert [m['data'] for m in messages if m] == [b'outline']
+        assert reference_outline('job_1')['references'] == [
+            ['arxiv', 'https://arxiv.org/abs/2101.00001']]
+    
+    def test_reference_outline_before_extraction(self, fake_redis):
+        """Test there is no outline until the references are extracted."""
+        assert reference_outline('job_1') is None
     
     @patch('tasks.linkrot.linkrot')
     def test_pdfdata_task_no_references(self, mock_linkrot):
@@ -69,6 +225,349 @@ class TestPDFDataTask:
         assert result['result_data'] == []
 
 
+    @patch('queues.TASK_MAX_DELIVERIES', 2)
+    @patch('tasks.linkrot.linkrot')
+    def test_pdfdata_task_fails_after_lost_deliveries(self, mock_linkrot,
+                                                       fake_redis):
+        """Test a PDF the workers keep dying on is failed, not retried."""
+        mock_linkrot.return_value.get_metadata.return_value = {}
+        mock_linkrot.return_value.get_references.return_value = []
+        
+        pdfdata_task.push_request(id='job_1',
+                                  delivery_info={'redelivered': True})
+        try:
+            pdfdata_task('/test/path.pdf')
+            with pytest.raises(WorkerLostError):
+                pdfdata_task('/test/path.pdf')
+        finally:
+            pdfdata_task.pop_request()
+        # first deliveries are not counted
+        pdfdata_task.push_request(id='job_2')
+        try:
+            pdfdata_task('/test/path.pdf')
+        finally:
+            pdfdata_task.pop_request()
+        assert not fake_redis.exists(
+            'queue:redelivered:tasks.pdfdata_task:job_2')
+
+
+class TestPageRangeExtraction:
+    """Test large PDFs are read in page ranges by parallel tasks."""
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.chord')
+    @patch.object(pdfdata_task, 'replace')
+    @patch('tasks.extraction.page_count', return_value=120)
+    @patch('tasks.extraction.EXTRACT_SPLIT_PAGES', 100)
+    @patch('tasks.extraction.EXTRACT_RANGE_PAGES', 50)
+    def test_pdfdata_task_splits_large_pdf(self, mock_pages, mock_replace,
+                                           mock_chord, mock_linkrot,
+                                           fake_redis):
+        """Test a PDF past the threshold is handed to page range tasks."""
+        pdfdata_task.push_request(id='job_1')
+        try:
+            pdfdata_task('/test/path.pdf', submitter='abc')
+        finally:
+            pdfdata_task.pop_request()
+        
+        mock_linkrot.assert_not_called()
+        header, callback = mock_chord.call_args[0]
+        assert [signature.args for signature in header] == [
+            ('/test/path.pdf', 0, 50), ('/test/path.pdf', 50, 100),
+            ('/test/path.pdf', 100, 120)]
+        assert callback.task == 'tasks.merge_pages'
+        path, child_ids, submitter = callback.args
+        assert path == '/test/path.pdf'
+        assert child_ids == [signature.id for signature in header]
+        assert submitter == 'abc'
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.chord')
+    @patch.object(pdfdata_task, 'replace')
+    @patch('tasks.extraction.page_count', return_value=120)
+    @patch('tasks.extraction.EXTRACT_SPLIT_PAGES', 100)
+    def test_pdfdata_task_stored_index_not_split(self, mock_pages,
+                                                 mock_replace, mock_chord,
+                                                 mock_linkrot, fake_redis):
+        """Test a rerun with a stored index goes straight to the checks."""
+        refindex.save('job_1', {'metadata': {}, 'references': [
+            ['url', 'https://a.com', 'https://a.com/', 1]]})
+        
+        pdfdata_task.push_request(id='job_1')
+        try:
+            pdfdata_task('/test/path.pdf')
+        finally:
+            pdfdata_task.pop_request()
+        
+        mock_pages.assert_not_called()
+        header, callback = mock_chord.call_args[0]
+        assert callback.task == 'tasks.aggregate_results'
+    
+    @patch('tasks.chord')
+    @patch.object(merge_pages, 'replace')
+    @patch('tasks.extraction.read_metadata',
+           return_value={'Title': 'Thesis', 'Pages': 120})
+    def test_merge_pages(self, mock_metadata, mock_replace, mock_chord,
+                         fake_redis):
+        """Test the merged references are stored, announced and checked."""
+        parts = [
+            {'links': [['https://a.com', 1]],
+             'pages': [[1, ['https://a.com', 'https://b.com'], [], []]]},
+            {'links': [],
+             'pages': [[51, ['https://b.com',
+                             'https://arxiv.org/abs/2101.00001'], [], []]]},
+        ]
+        
+        merge_pages.push_request(id='job_1')
+        try:
+            merge_pages(parts, '/test/path.pdf', [], 'abc')
+        finally:
+            merge_pages.pop_request()
+        
+        index = refindex.load('job_1')
+        assert index['metadata'] == {'Title': 'Thesis', 'Pages': 120}
+        assert sorted(index['references']) == [
+            ['arxiv', '2101.00001', 'https://arxiv.org/abs/2101.00001', 51],
+            ['url', 'https://a.com', 'https://a.com/', 1],
+            ['url', 'https://b.com', 'https://b.com/', 1]]
+        assert reference_outline('job_1') is not None
+        header, callback = mock_chord.call_args[0]
+        assert callback.task == 'tasks.aggregate_results'
+        assert callback.args[0] == index['metadata']
+        assert callback.args[2] == 'abc'
+        mock_replace.assert_called_once()
+        text = metrics.render()
+        assert 'rr_pdf_parse_seconds_count{step="merge"} 1' in text
+
+
+class TestTaskMetrics:
+    """Test the Celery signal handlers recording task metrics."""
+    
+    def test_task_timers(self, fake_redis):
+        """Test queue wait, run time and state are recorded per task."""
+        task = Mock()
+        task.name = 'tasks.sort_ref'
+        task.request.published_at = time.time() - 2
+        
+        start_task_timer(task_id='t1', task=task)
+        stop_task_timer(task_id='t1', task=task, state='SUCCESS')
+        
+        text = metrics.render()
+        assert 'rr_task_queue_wait_seconds_count{task="tasks.sort_ref"} 1' in text
+        assert ('rr_task_queue_wait_seconds_bucket{task="tasks.sort_ref",'
+                'le="1"} 0') in text
+        assert 'rr_task_seconds_count{task="tasks.sort_ref"} 1' in text
+        assert 'rr_tasks_total{state="SUCCESS",task="tasks.sort_ref"} 1' in text
+    
+    def test_announce_result(self):
+        """Test finished jobs a browser waits on are announced."""
+        task = Mock()
+        
+        with patch('tasks.progress.notify_done') as mock_notify:
+            task.name = 'tasks.aggregate_results'
+            announce_result(task_id='job_1', task=task, state='SUCCESS')
+            # replaced by its chord, the result is not stored yet
+            task.name = 'tasks.pdfdata_task'
+            announce_result(task_id='job_1', task=task, state='IGNORED')
+            task.name = 'tasks.sort_ref'
+            announce_result(task_id='t1', task=task, state='SUCCESS')
+        
+        mock_notify.assert_called_once_with('job_1')
+    
+    def test_published_at_stamped(self):
+        """Test published messages carry their publish time."""
+        headers = {}
+        
+        stamp_published(headers=headers)
+        
+        assert headers['published_at'] <= time.time()
+
+
+class TestAggregateResults:
+    """Test the aggregate_results chord callback."""
+    
+    def test_aggregate_results(self):
+        """Test child results are combined with the metadata."""
+        child = ['url', 'https://example.com', '200']
+        
+        result = aggregate_results([child], {'Title': 'Test PDF'})
+        
+        assert result == {
+            'metadata': {'Title': 'Test PDF'},
+            'result_data': [child]
+        }
+
+
+    def test_aggregate_results_flattens_batches(self):
+        """Test batch results are flattened into result_data."""
+        first = ['url', 'https://a.com', '200']
+        second = ['url', 'https://b.com', '404']
+        third = ['url', 'https://c.com', '200']
+        
+        result = aggregate_results([[first, second], [third]], {})
+        
+        assert result['result_data'] == [first, second, third]
+
+
+    def test_aggregate_results_forgets_children(self):
+        """Test child results are removed from the backend."""
+        with patch.object(aggregate_results, 'app') as mock_app:
+            aggregate_results([['url', 'https://a.com', '200']], {},
+                              ['child_1', 'child_2'])
+        
+        forget = mock_app.backend.forget
+        assert [c.args[0] for c in forget.call_args_list] == ['child_1',
+                                                             'child_2']
+    
+    def test_aggregate_results_releases_submitter(self, fake_redis):
+        """Test the checked references leave the submitter's count."""
+        fake_redis.set('queue:submitter:alice', 3)
+        
+        aggregate_results([[['url', 'https://a.com', '200']]], {}, [],
+                          'alice')
+        
+        assert fake_redis.get('queue:submitter:alice') == b'2'
+    
+    def test_aggregate_results_releases_submitter_once(self, fake_redis):
+        """Test a callback delivered twice releases its references once."""
+        fake_redis.set('queue:submitter:alice', 3)
+        
+        aggregate_results.push_request(id='job_1')
+        try:
+            for _ in range(2):
+                aggregate_results([[['url', 'https://a.com', '200']]], {},
+                                  [], 'alice')
+        finally:
+            aggregate_results.pop_request()
+        
+        assert fake_redis.get('queue:submitter:alice') == b'2'
+    
+    def test_forget_results_ignores_backend_errors(self):
+        """Test a failing forget does not stop the others."""
+        backend = Mock()
+        backend.forget.side_effect = [Exception('down'), None]
+        
+        forget_results(backend, ['child_1', 'child_2'])
+        
+        assert backend.forget.call_count == 2
+
+
+class TestCheckRefsBatch:
+    """Test the check_refs_batch Celery task."""
+    
+    @patch('tasks.get_status_code')
+    def test_check_refs_batch_matches_sort_ref(self, mock_status, fake_redis):
+        """Test batch results have the same shape and order as sort_ref."""
+        mock_status.side_effect = lambda url, recheck=False: (
+            404 if 'missing' in url else 200)
+        ref_dicts = [
+            {'reftype': 'arxiv', 'ref': '1234.5678'},
+            {'reftype': 'doi', 'ref': '10.1000/182'},
+            {'reftype': 'pdf', 'ref': 'https://example.com/missing.pdf'},
+            {'reftype': 'url', 'ref': 'example.com/page'},
+        ]
+        
+        result = check_refs_batch(ref_dicts)
+        
+        assert result == [sort_ref(ref_dict) for ref_dict in ref_dicts]
+        assert result[2] == ['pdf', 'https://example.com/missing.pdf', '404']
+        assert result[3] == ['url', 'https://example.com/page', '200']
+    
+    @patch('tasks.get_status_code')
+    def test_check_refs_batch_publishes_progress(self, mock_status,
+                                                 fake_redis):
+        """Test every checked reference is published to the job stream."""
+        mock_status.return_value = 200
+        ref_dicts = [
+            {'reftype': 'url', 'ref': 'https://a.example.com'},
+            {'reftype': 'doi', 'ref': '10.1000/182'},
+        ]
+        
+        result = check_refs_batch(ref_dicts, 'job_1')
+        
+        published = progress.read('job_1')
+        assert len(published) == 2
+        assert sorted(published, key=str) == sorted(result, key=str)
+    
+    @patch('tasks.get_status_code')
+    def test_check_refs_batch_resumes_from_checkpoint(self, mock_status,
+                                                      fake_redis):
+        """Test a redelivered batch only checks what is not published."""
+        mock_status.return_value = 200
+        ref_dicts = [
+            {'reftype': 'url', 'ref': 'https://a.example.com'},
+            {'reftype': 'url', 'ref': 'https://b.example.com'},
+            {'reftype': 'doi', 'ref': '10.1000/182'},
+        ]
+        done = build_ref_result(ref_dicts[1], '404')
+        progress.publish('job_1', [done])
+        
+        check_refs_batch.push_request(delivery_info={'redelivered': True})
+        try:
+            result = check_refs_batch(ref_dicts, 'job_1')
+        finally:
+            check_refs_batch.pop_request()
+        
+        assert sorted(call.args[0] for call in mock_status.call_args_list) == [
+            'https://a.example.com', 'https://doi.org/10.1000/182']
+        assert result[1] == done
+        assert [item[RESULT_STATUS] for item in result] == ['200', '404',
+                                                            '200']
+        # the reference checked before is not published twice
+        assert len(progress.read('job_1')) == 3
+        assert 'rr_checks_resumed_total 1' in metrics.render()
+        
+        # a batch of a rerun analysis checks nothing
+        mock_status.reset_mock()
+        assert check_refs_batch(ref_dicts, 'job_1', True) == result
+        mock_status.assert_not_called()
+    
+    @patch('tasks.get_status_code', return_value=200)
+    def test_check_refs_batch_first_delivery_skips_stream(self, mock_status,
+                                                          fake_redis):
+        """Test a first delivery never reads the progress stream."""
+        with patch('tasks.progress.checked') as checked:
+            check_refs_batch([{'reftype': 'url', 'ref': 'https://a.com'}],
+                             'job_1')
+        checked.assert_not_called()
+    
+    @patch('tasks.get_status_code')
+    def test_check_refs_batch_status_exception(self, mock_status,
+                                               fake_redis):
+        """Test a failing check only affects its own reference."""
+        mock_status.side_effect = lambda url, recheck=False: (
+            1 / 0 if 'bad' in url else 200)
+        ref_dicts = [
+            {'reftype': 'url', 'ref': 'https://bad.example.com'},
+            {'reftype': 'url', 'ref': 'https://good.example.com'},
+        ]
+        
+        result = check_refs_batch(ref_dicts)
+        
+        assert result[0][RESULT_STATUS] == 0
+        assert result[1][RESULT_STATUS] == '200'
+
+
+    @patch('tasks.get_status_code')
+    def test_check_refs_batch_cache_hits_skip_limiter(self, mock_status,
+                                                      fake_redis):
+        """Test cached statuses neither wait for nor feed the host limits."""
+        mock_status.return_value = 200
+        statuscache.store('https://doi.org/10.1000/1', 200)
+        ref_dicts = [{'reftype': 'doi', 'ref': '10.1000/1'},
+                     {'reftype': 'doi', 'ref': '10.1000/2'}]
+        
+        with patch('tasks.HostLimiter') as limiter:
+            limiter.return_value.try_acquire.return_value = True
+            result = check_refs_batch(ref_dicts)
+        
+        assert [item[RESULT_STATUS] for item in result] == ['200', '200']
+        mock_status.assert_called_once_with('https://doi.org/10.1000/2',
+                                            recheck=True)
+        assert limiter.return_value.try_acquire.call_count == 1
+        assert limiter.return_value.release.call_count == 1
+
+
 class TestSortRef:
     """Test the sort_ref Celery task."""
     
@@ -80,11 +579,7 @@ class TestSortRef:
         ref_dict = {'reftype': 'arxiv', 'ref': '1234.5678'}
         result = sort_ref(ref_dict)
         
-        assert result['arxiv'] == ['https://arxiv.org/abs/1234.5678']
-        assert result['check'] == ['200']
-        assert result['pdfs'] == []
-        assert result['urls'] == []
-        assert result['doi'] == []
+        assert result == ['arxiv', 'https://arxiv.org/abs/1234.5678', '200']
     
     @patch('tasks.get_status_code')
     def test_sort_ref_doi(self, mock_status):
@@ -94,11 +589,7 @@ class TestSortRef:
         ref_dict = {'reftype': 'doi', 'ref': '10.1000/182'}
         result = sort_ref(ref_dict)
         
-        assert result['doi'] == ['https://doi.org/10.1000/182']
-        assert result['check'] == ['200']
-        assert result['pdfs'] == []
-        assert result['urls'] == []
-        assert result['arxiv'] == []
+        assert result == ['doi', 'https://doi.org/10.1000/182', '200']
     
     @patch('tasks.get_status_code')
     def test_sort_ref_pdf(self, mock_status):
@@ -108,11 +599,7 @@ class TestSortRef:
         ref_dict = {'reftype': 'pdf', 'ref': 'document.pdf'}
         result = sort_ref(ref_dict)
         
-        assert result['pdfs'] == ['document.pdf']
-        assert result['check'] == ['200']
-        assert result['urls'] == []
-        assert result['arxiv'] == []
-        assert result['doi'] == []
+        assert result == ['pdf', 'document.pdf', '200']
     
     @patch('tasks.get_status_code')
     def test_sort_ref_url_doi_domain(self, mock_status):
@@ -122,11 +609,7 @@ class TestSortRef:
         ref_dict = {'reftype': 'url', 'ref': 'https://dx.doi.org/10.1000/182'}
         result = sort_ref(ref_dict)
         
-        assert result['doi'] == ['https://dx.doi.org/10.1000/182']
-        assert result['check'] == ['200']
-        assert result['pdfs'] == []
-        assert result['urls'] == []
-        assert result['arxiv'] == []
+        assert result == ['doi', 'https://dx.doi.org/10.1000/182', '200']
     
     @patch('tasks.get_status_code')
     def test_sort_ref_url_arxiv_domain(self, mock_status):
@@ -137,11 +620,17 @@ class TestSortRef:
         ref_dict = {'reftype': 'url', 'ref': 'https://arxiv.org/abs/1234.5678'}
         result = sort_ref(ref_dict)
         
-        assert result['urls'] == ['https://arxiv.org/abs/1234.5678']
-        assert result['check'] == ['200']
-        assert result['pdfs'] == []
-        assert result['arxiv'] == []
-        assert result['doi'] == []
+        assert result == ['url', 'https://arxiv.org/abs/1234.5678', '200']
+    
+    @patch('tasks.get_status_code')
+    def test_sort_ref_url_arxiv_subdomain(self, mock_status):
+        """Test URL on an arxiv.org subdomain is typed as arxiv."""
+        mock_status.return_value = 200
+        
+        ref_dict = {'reftype': 'url', 'ref': 'https://export.arxiv.org/abs/1'}
+        result = sort_ref(ref_dict)
+        
+        assert result == ['arxiv', 'https://export.arxiv.org/abs/1', '200']
     
     @patch('tasks.get_status_code')
     def test_sort_ref_regular_url(self, mock_status):
@@ -151,11 +640,7 @@ class TestSortRef:
         ref_dict = {'reftype': 'url', 'ref': 'https://example.com/page'}
         result = sort_ref(ref_dict)
         
-        assert result['urls'] == ['https://example.com/page']
-        assert result['check'] == ['200']
-        assert result['pdfs'] == []
-        assert result['arxiv'] == []
-        assert result['doi'] == []
+        assert result == ['url', 'https://example.com/page', '200']
     
     @patch('tasks.get_status_code')
     def test_sort_ref_url_no_scheme(self, mock_status):
@@ -165,8 +650,7 @@ class TestSortRef:
         ref_dict = {'reftype': 'url', 'ref': 'example.com/page'}
         result = sort_ref(ref_dict)
         
-        assert result['urls'] == ['https://example.com/page']
-        assert result['check'] == ['200']
+        assert result == ['url', 'https://example.com/page', '200']
     
     @patch('tasks.get_status_code')
     def test_sort_ref_status_code_exception(self, mock_status):
@@ -176,5 +660,79 @@ class TestSortRef:
         ref_dict = {'reftype': 'url', 'ref': 'https://example.com'}
         result = sort_ref(ref_dict)
         
-        assert result['check'] == [0]
-        assert result['urls'] == ['https://example.com']
+        assert result == ['url', 'https://example.com', 0]
+    
+    @patch('tasks.get_status_code')
+    def test_sort_ref_publishes_progress(self, mock_status, fake_redis):
+        """Test sort_ref publishes its result to the job stream."""
+        mock_status.return_value = 404
+        
+        result = sort_ref({'reftype': 'url', 'ref': 'https://a.com'}, 'job_1')
+        
+        assert progress.read('job_1') == [result]
+    
+    @patch('tasks.get_status_code')
+    def test_sort_ref_redelivered(self, mock_status, fake_redis):
+        """Test a redelivered sort_ref returns its published result."""
+        mock_status.return_value = 404
+        ref_dict = {'reftype': 'url', 'ref': 'a.com'}
+        first = sort_ref(ref_dict, 'job_1')
+        
+        sort_ref.push_request(delivery_info={'redelivered': True})
+        try:
+            assert sort_ref(ref_dict, 'job_1') == first
+        finally:
+            sort_ref.pop_request()
+        assert mock_status.call_count == 1
+        assert progress.read('job_1') == [first]
+        
+        # a first delivery does not read the stream
+        with patch('tasks.progress.checked') as checked:
+            sort_ref(ref_dict, 'job_1')
+        checked.assert_not_called()
+
+
+class TestAnalysePdf:
+    """Test the in-process analysis without Celery."""
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.get_status_code', return_value=200)
+    def test_analyse_pdf(self, mock_status, mock_linkrot, fake_redis):
+        """Test the payload matches what the chord aggregates."""
+        mock_pdf = Mock()
+        mock_pdf.get_metadata.return_value = {'Title': 'Test PDF'}
+        mock_ref = Mock()
+        mock_ref.reftype = 'url'
+        mock_ref.ref = 'https://example.com'
+        mock_ref.page = 1
+        mock_pdf.get_references.return_value = [mock_ref]
+        mock_linkrot.return_value = mock_pdf
+        
+        result = analyse_pdf('/test/path.pdf', 'job_1')
+        
+        assert result['metadata'] == {'Title': 'Test PDF'}
+        assert result['result_data'] == [
+            build_ref_result({'reftype': 'url', 'ref': 'https://example.com'},
+                             '200')]
+        assert progress.read('job_1') == result['result_data']
+    
+    @patch('tasks.linkrot.linkrot')
+    @patch('tasks.get_status_code', return_value=200)
+    @patch('tasks.extraction.page_count', return_value=200)
+    @patch('tasks.extraction.EXTRACT_SPLIT_PAGES', 100)
+    def test_analyse_pdf_splits_large_pdf(self, mock_pages, mock_status,
+                                          mock_linkrot, fake_redis):
+        """Test a large PDF is read in page ranges on the process pool."""
+        mock_ref = Mock()
+        mock_ref.reftype = 'url'
+        mock_ref.ref = 'https://example.com'
+        mock_ref.page = 150
+        with patch('tasks.extraction.extract',
+                   return_value=({'Title': 'Thesis'}, [mock_ref])) as extract:
+            result = analyse_pdf('/test/path.pdf', 'job_1')
+        
+        extract.assert_called_once_with('/test/path.pdf')
+        mock_linkrot.assert_not_called()
+        assert result['metadata'] == {'Title': 'Thesis'}
+        assert len(result['result_data']) == 1
+        assert refindex.load('job_1')['references'][0][3] == 150
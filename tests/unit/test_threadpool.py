@@ -0,0 +1,114 @@
+import threading
+import time
+from concurrent.futures import TimeoutError, CancelledError, wait
+import pytest
+from threadpool import ThreadPool, PoolFull
+
+
+class TestThreadPool:
+    """Test the futures based thread pool."""
+    
+    def test_submit_returns_result(self):
+        """Test results come back through the future."""
+        with ThreadPool(2) as pool:
+            assert pool.submit(lambda a, b: a + b, 1, b=2).result(1) == 3
+    
+    def test_submit_reports_exception(self):
+        """Test failures are raised from the future, not swallowed."""
+        def fail():
+            raise ValueError('boom')
+        
+        with ThreadPool(1) as pool:
+            with pytest.raises(ValueError):
+                pool.submit(fail).result(1)
+            assert pool.stats()['failed'] == 1
+    
+    def test_map_keeps_order(self):
+        """Test map returns every result in input order."""
+        def slow_square(n):
+            time.sleep(0.001 * (5 - n))
+            return n * n
+        
+        with ThreadPool(3) as pool:
+            assert pool.map(slow_square, range(5)) == [0, 1, 4, 9, 16]
+    
+    def test_wait_works_with_futures(self):
+        """Test the futures work with concurrent.futures.wait."""
+        with ThreadPool(2) as pool:
+            fs = [pool.submit(time.sleep, 0.01) for _ in range(4)]
+            done, not_done = wait(fs, timeout=1)
+            assert len(done) == 4 and not not_done
+    
+    def test_deadline_of_running_task(self):
+        """Test a task still running at its deadline times out."""
+        release = threading.Event()
+        with ThreadPool(1) as pool:
+            future = pool.submit_with_timeout(0.05, release.wait, 1)
+            with pytest.raises(TimeoutError):
+                future.result(1)
+            assert pool.stats()['timed_out'] == 1
+            release.set()
+    
+    def test_deadline_starts_when_task_runs(self):
+        """Test time spent queued does not count against the deadline."""
+        with ThreadPool(2, timeout=0.5) as pool:
+            fs = [pool.submit(time.sleep, 0.2) for _ in range(10)]
+            done, not_done = wait(fs, timeout=5)
+            assert len(done) == 10 and not not_done
+            assert all(f.exception() is None for f in fs)
+            assert pool.stats()['timed_out'] == 0
+    
+    def test_cancel_queued_task(self):
+        """Test queued tasks can be cancelled."""
+        release = threading.Event()
+        ran = []
+        with ThreadPool(1) as pool:
+            pool.submit(release.wait, 1)
+            future = pool.submit(ran.append, 1)
+            assert future.cancel()
+            release.set()
+            pool.wait_completion()
+            with pytest.raises(CancelledError):
+                future.result()
+            assert pool.stats()['cancelled'] == 1
+        assert ran == []
+    
+    def test_bounded_queue_does_not_block(self):
+        """Test a full bounded queue refuses instead of blocking."""
+        release = threading.Event()
+        with ThreadPool(1, max_queue=1) as pool:
+            started = threading.Event()
+            pool.submit(lambda: (started.set(), release.wait(1)))
+            started.wait(1)
+            pool.submit(release.wait, 1)
+            with pytest.raises(PoolFull):
+                pool.submit(release.wait, 1)
+            release.set()
+    
+    def test_stats(self):
+        """Test queue depth, busy workers and latency are reported."""
+        release = threading.Event()
+        pool = ThreadPool(1, name='test')
+        started = threading.Event()
+        pool.submit(lambda: (started.set(), release.wait(1)))
+        pool.submit(time.sleep, 0)
+        started.wait(1)
+        
+        stats = pool.stats()
+        assert stats['name'] == 'test'
+        assert stats['busy'] == 1
+        assert stats['queued'] == 1
+        
+        release.set()
+        pool.shutdown(wait=True)
+        stats = pool.stats()
+        assert stats['completed'] == 2
+        assert stats['busy'] == 0
+        assert stats['run_max'] >= stats['run_p50'] >= 0
+    
+    def test_submit_after_shutdown(self):
+        """Test a shut down pool takes no new tasks."""
+        pool = ThreadPool(1)
+        pool.shutdown()
+        with pytest.raises(RuntimeError):
+            pool.submit(print)
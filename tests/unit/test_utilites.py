@@ -1,7 +1,11 @@
+import hashlib
 import os
 import tempfile
+from io import BytesIO
 from unittest.mock import patch
-from utilites import get_tmp_folder
+from werkzeug.datastructures import FileStorage
+import pytest
+from utilites import get_tmp_folder, save_upload, UploadRejected
 
 
 class TestGetTmpFolder:
@@ -35,3 +39,59 @@ class TestGetTmpFolder:
             result = get_tmp_folder()
             assert os.getenv('OTHER_VAR') == 'value'
             assert result == tempfile.gettempdir()
+
+
+class TestSaveUpload:
+    """Test the streaming upload writer."""
+    
+    def test_save_upload_writes_and_hashes(self, test_upload_folder):
+        """Test the file is written and its SHA-256 digest returned."""
+        content = b'%PDF-1.4 ' + b'x' * 200000 + b'\n%%EOF\n'
+        upload = FileStorage(stream=BytesIO(content), filename='test.pdf')
+        path = os.path.join(test_upload_folder, 'test.pdf')
+        
+        digest = save_upload(upload, path)
+        
+        assert digest == hashlib.sha256(content).hexdigest()
+        with open(path, 'rb') as f:
+            assert f.read() == content
+    
+    def test_save_upload_rejects_missing_header(self, test_upload_folder):
+        """Test a file without the PDF header is rejected early."""
+        content = b'MZ' + b'x' * 200000 + b'%%EOF'
+        upload = FileStorage(stream=BytesIO(content), filename='test.pdf')
+        path = os.path.join(test_upload_folder, 'test.pdf')
+        
+        with patch('utilites.UPLOAD_CHUNK_SIZE', 4096):
+            with pytest.raises(UploadRejected) as e:
+                save_upload(upload, path)
+        
+        assert e.value.reason == 'pdf'
+        # rejected after the first chunk instead of reading everything
+        assert upload.stream.tell() == 4096
+        assert not os.path.exists(path)
+    
+    def test_save_upload_rejects_missing_trailer(self, test_upload_folder):
+        """Test a truncated PDF without %%EOF is rejected."""
+        upload = FileStorage(stream=BytesIO(b'%PDF-1.4\n' + b'x' * 5000),
+                             filename='test.pdf')
+        path = os.path.join(test_upload_folder, 'test.pdf')
+        
+        with pytest.raises(UploadRejected) as e:
+            save_upload(upload, path)
+        
+        assert e.value.reason == 'pdf'
+        assert not os.path.exists(path)
+    
+    def test_save_upload_rejects_oversized(self, test_upload_folder):
+        """Test uploads stop as soon as they pass max_size."""
+        content = b'%PDF-1.4\n' + b'x' * 300000 + b'%%EOF'
+        upload = FileStorage(stream=BytesIO(content), filename='test.pdf')
+        path = os.path.join(test_upload_folder, 'test.pdf')
+        
+        with pytest.raises(UploadRejected) as e:
+            save_upload(upload, path, max_size=100000)
+        
+        assert e.value.reason == 'size'
+        assert upload.stream.tell() < len(content)
+        assert not os.path.exists(path)
@@ -0,0 +1,140 @@
+import os
+import time
+from unittest.mock import patch
+import pytest
+import redis
+import workspace
+from workspace import (create, remove, sweep, stats, workspaces,
+                       add_bytes, used_bytes, QuotaExceeded)
+
+
+def write(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+
+@pytest.fixture(autouse=True)
+def no_sweeper():
+    """Keep tests from starting background sweeper threads."""
+    with patch('workspace.start_sweeper'):
+        yield
+
+
+class TestWorkspace:
+    """Test per-job workspaces."""
+    
+    def test_create_unique(self, test_upload_folder, fake_redis):
+        """Test two jobs never share a directory."""
+        first = create(test_upload_folder)
+        second = create(test_upload_folder)
+        
+        assert first != second
+        assert os.path.isdir(first) and os.path.isdir(second)
+        assert sorted(workspaces(test_upload_folder)) == sorted([first, second])
+    
+    def test_remove_counts_reclaimed(self, test_upload_folder, fake_redis):
+        """Test removal frees the directory and counts the bytes."""
+        path = create(test_upload_folder)
+        write(os.path.join(path, 'paper.pdf'), 1000)
+        
+        assert remove(path) == 1000
+        assert not os.path.exists(path)
+        assert stats(test_upload_folder)['reclaimed_bytes'] == 1000
+        assert stats(test_upload_folder)['reclaimed_workspaces'] == 1
+    
+    def test_remove_refuses_other_paths(self, test_upload_folder):
+        """Test only job workspaces can be removed."""
+        with pytest.raises(ValueError):
+            remove(test_upload_folder)
+    
+    def test_sweep_expired_only(self, test_upload_folder, fake_redis):
+        """Test workspaces unchanged for the TTL are swept."""
+        old = create(test_upload_folder)
+        write(os.path.join(old, 'paper.pdf'), 10)
+        past = time.time() - 7200
+        os.utime(os.path.join(old, 'paper.pdf'), (past, past))
+        os.utime(old, (past, past))
+        fresh = create(test_upload_folder)
+        
+        assert sweep(test_upload_folder, ttl=3600) == 10
+        assert workspaces(test_upload_folder) == [fresh]
+    
+    def test_quota(self, test_upload_folder, fake_redis):
+        """Test new jobs are refused while the quota is used up."""
+        path = create(test_upload_folder)
+        write(os.path.join(path, 'paper.pdf'), 100)
+        add_bytes(path, 100)
+        
+        with pytest.raises(QuotaExceeded):
+            create(test_upload_folder, quota=100)
+        assert create(test_upload_folder, quota=1000)
+    
+    def test_quota_sweeps_first(self, test_upload_folder, fake_redis):
+        """Test expired workspaces are swept before refusing a job."""
+        path = create(test_upload_folder)
+        write(os.path.join(path, 'paper.pdf'), 100)
+        add_bytes(path, 100)
+        
+        with patch('workspace.WORKSPACE_TTL', -1):
+            assert create(test_upload_folder, quota=100)
+        assert not os.path.exists(path)
+    
+    def test_used_bytes_running_total(self, test_upload_folder, fake_redis):
+        """Test the total follows saves and removals without a disk walk."""
+        first = create(test_upload_folder)
+        second = create(test_upload_folder)
+        write(os.path.join(first, 'paper.pdf'), 100)
+        add_bytes(first, 100)
+        add_bytes(second, 50)
+        
+        with patch('workspace.usage') as walk:
+            assert used_bytes(test_upload_folder + os.sep) == 150
+            create(test_upload_folder, quota=1000)
+        walk.assert_not_called()
+        
+        remove(first)
+        assert used_bytes(test_upload_folder) == 50
+    
+    def test_sweep_corrects_total(self, test_upload_folder, fake_redis):
+        """Test a sweep replaces the total with what is on disk."""
+        path = create(test_upload_folder)
+        write(os.path.join(path, 'paper.pdf'), 300)
+        add_bytes(path, 5)
+        
+        sweep(test_upload_folder, ttl=3600)
+        
+        assert used_bytes(test_upload_folder) == 300
+    
+    def test_used_bytes_without_redis(self, test_upload_folder, fake_redis):
+        """Test the disk is measured when Redis is down."""
+        path = create(test_upload_folder)
+        write(os.path.join(path, 'paper.pdf'), 70)
+        
+        with patch('utilites.get_redis', side_effect=redis.ConnectionError()):
+            assert used_bytes(test_upload_folder) == 70
+    
+    def test_stats(self, test_upload_folder, fake_redis):
+        """Test disk use is reported from the totals, without a walk."""
+        path = create(test_upload_folder)
+        write(os.path.join(path, 'paper.pdf'), 300)
+        add_bytes(path, 300)
+        remove(create(test_upload_folder))
+        
+        with patch('workspace.usage') as walk, \
+                patch('workspace.workspaces') as listing:
+            result = stats(test_upload_folder)
+        walk.assert_not_called()
+        listing.assert_not_called()
+        
+        assert result['workspaces'] == 1
+        assert result['bytes'] == 300
+        assert result['quota'] == workspace.WORKSPACE_QUOTA
+    
+    def test_sweep_corrects_count(self, test_upload_folder, fake_redis):
+        """Test a sweep recounts the workspaces on disk."""
+        create(test_upload_folder)
+        fake_redis.set(workspace.count_key(test_upload_folder), 7)
+        
+        sweep(test_upload_folder, ttl=3600)
+        
+        assert stats(test_upload_folder)['workspaces'] == 1
@@ -1,49 +1,261 @@
 '''
 file: threadpool.py
-description: Inspired by http://stackoverflow.com/a/7257510
+description: Thread pool executor with futures, deadlines and metrics
+
+Tasks are queued to a fixed set of worker threads and every submit
+returns a concurrent.futures.Future, so callers can use wait and
+as_completed on them. The deadline of a task starts when a worker picks
+it up, not while it waits in the queue, and a task still running when it
+passes fails with TimeoutError; the thread cannot be interrupted and
+keeps going, but its result is dropped. stats() reports queue depth,
+busy workers and task latency.
 '''
 
-from queue import Queue
-from threading import Thread
+import heapq
+import itertools
+import time
+from collections import deque
+from concurrent import futures
+from queue import Queue, Full
+from threading import Thread, Lock, Condition
+
+# Recent task durations kept for the latency percentiles in stats()
+LATENCY_SAMPLES = 1000
+
+
+class PoolFull(Exception):
+    ''' Raised by submit when a bounded queue has no room left '''
+
+
+class Task:
+    ''' A queued call and the future its outcome is reported through '''
+
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'submitted', 'timeout')
+
+    def __init__(self, func, args, kwargs, timeout=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = futures.Future()
+        self.submitted = time.monotonic()
+        self.timeout = timeout
+
+
+def settle(future, result=None, exception=None):
+    ''' Complete future unless a deadline or cancellation got there first '''
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+        return True
+    except futures.InvalidStateError:
+        return False
 
 
 class Worker(Thread):
-    ''' Thread executing tasks from a given tasks queue '''
+    ''' Thread executing tasks from the queue of its pool '''
 
-    def __init__(self, tasks):
-        Thread.__init__(self)
-        self.tasks = tasks
+    def __init__(self, pool, name):
+        Thread.__init__(self, name=name)
+        self.pool = pool
         self.daemon = True
         self.start()
 
     def run(self):
         while True:
-            func, args, kargs = self.tasks.get()
+            task = self.pool.tasks.get()
             try:
-                func(*args, **kargs)
-            except Exception as e:
-                print(e)
+                if task is None:
+                    return
+                self.pool.run_task(task)
             finally:
-                self.tasks.task_done()
+                self.pool.tasks.task_done()
 
 
 class ThreadPool:
-    ''' Pool of threads consuming tasks from a queue '''
+    '''
+    Pool of num_threads threads consuming tasks from a queue.
+
+    max_queue bounds the number of waiting tasks, 0 means unbounded; a
+    submit that does not fit raises PoolFull instead of blocking. timeout
+    is the default deadline in seconds of every task once it starts
+    running, None for no limit.
 
-    def __init__(self, num_threads):
-        self.tasks = Queue(num_threads)
-        for _ in range(num_threads):
-            Worker(self.tasks)
+    Leaving a with block cancels the tasks not started yet and does not
+    wait for threads still busy with tasks past their deadline.
+    '''
+
+    def __init__(self, num_threads, max_queue=0, timeout=None, name='pool'):
+        self.num_threads = max(1, num_threads)
+        self.timeout = timeout
+        self.name = name
+        self.tasks = Queue(max_queue)
+        self.lock = Lock()
+        self.busy = 0
+        self.counts = dict(submitted=0, completed=0, failed=0, cancelled=0,
+                           timed_out=0)
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.run_times = deque(maxlen=LATENCY_SAMPLES)
+        self.deadlines = []
+        self.deadline_seq = itertools.count()
+        self.deadline_cond = Condition(Lock())
+        self.watcher = None
+        self.closed = False
+        self.workers = [Worker(self, '%s-%d' % (name, i))
+                        for i in range(self.num_threads)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, func, *args, **kwargs):
+        ''' Queue func(*args, **kwargs) under the default deadline '''
+        return self.submit_with_timeout(self.timeout, func, *args, **kwargs)
+
+    def submit_with_timeout(self, timeout, func, *args, **kwargs):
+        '''
+        Queue func(*args, **kwargs) to finish within timeout seconds of
+        starting
+        '''
+        if self.closed:
+            raise RuntimeError('cannot submit to a pool that is shut down')
+        task = Task(func, args, kwargs, timeout)
+        try:
+            self.tasks.put_nowait(task)
+        except Full:
+            raise PoolFull('%s queue is full' % self.name)
+        with self.lock:
+            self.counts['submitted'] += 1
+        return task.future
 
     def add_task(self, func, *args, **kargs):
         ''' Add a task to the queue '''
-        self.tasks.put((func, args, kargs))
+        return self.submit(func, *args, **kargs)
 
-    def map(self, func, args_list):
-        ''' Add a list of tasks to the queue '''
-        for args in args_list:
-            self.add_task(func, args)
+    def map(self, func, args_list, timeout=None):
+        '''
+        Run func on every item of args_list and return the results in
+        order. The first failure is raised; timeout bounds the whole call.
+        '''
+        fs = [self.submit(func, args) for args in args_list]
+        end = None if timeout is None else time.monotonic() + timeout
+        try:
+            return [f.result(None if end is None else
+                             max(0, end - time.monotonic())) for f in fs]
+        finally:
+            for f in fs:
+                f.cancel()
 
     def wait_completion(self):
         ''' Wait for completion of all the tasks in the queue '''
         self.tasks.join()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        '''
+        Stop the workers once the queued tasks are done. cancel_futures
+        cancels the tasks that have not started yet instead.
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        if cancel_futures:
+            with self.tasks.mutex:
+                queued = list(self.tasks.queue)
+            for task in queued:
+                task.future.cancel()
+        for _ in self.workers:
+            self.tasks.put(None)
+        with self.deadline_cond:
+            self.deadline_cond.notify()
+        if wait:
+            for worker in self.workers:
+                worker.join()
+
+    def run_task(self, task):
+        future = task.future
+        try:
+            running = future.set_running_or_notify_cancel()
+        except RuntimeError:
+            # already settled by the caller
+            return
+        if not running:
+            with self.lock:
+                self.counts['cancelled'] += 1
+            return
+
+        started = time.monotonic()
+        with self.lock:
+            self.busy += 1
+            self.wait_total += started - task.submitted
+        if task.timeout is not None:
+            self.watch(future, started + task.timeout)
+        try:
+            result = task.func(*task.args, **task.kwargs)
+        except BaseException as e:
+            outcome = 'failed'
+            settle(future, exception=e)
+        else:
+            outcome = 'completed'
+            settle(future, result)
+        finally:
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.busy -= 1
+                self.counts[outcome] += 1
+                self.run_total += elapsed
+                self.run_times.append(elapsed)
+
+    def watch(self, future, deadline):
+        with self.deadline_cond:
+            heapq.heappush(self.deadlines,
+                           (deadline, next(self.deadline_seq), future))
+            if self.watcher is None:
+                self.watcher = Thread(target=self.expire_overdue,
+                                      name='%s-deadlines' % self.name,
+                                      daemon=True)
+                self.watcher.start()
+            self.deadline_cond.notify()
+
+    def expire_overdue(self):
+        ''' Fail the futures of tasks still unfinished at their deadline '''
+        with self.deadline_cond:
+            while not self.closed or self.deadlines:
+                if not self.deadlines:
+                    self.deadline_cond.wait()
+                    continue
+                deadline, _, future = self.deadlines[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self.deadline_cond.wait(remaining)
+                    continue
+                heapq.heappop(self.deadlines)
+                if settle(future, exception=futures.TimeoutError(
+                        '%s task deadline passed' % self.name)):
+                    with self.lock:
+                        self.counts['timed_out'] += 1
+
+    def stats(self):
+        ''' Queue depth, busy workers, task counts and latency in seconds '''
+        with self.lock:
+            run_times = sorted(self.run_times)
+            finished = self.counts['completed'] + self.counts['failed']
+            started = finished + self.busy
+            stats = dict(self.counts,
+                         name=self.name,
+                         workers=self.num_threads,
+                         busy=self.busy,
+                         queued=self.tasks.qsize(),
+                         wait_avg=(self.wait_total / started
+                                   if started else 0.0),
+                         run_avg=(self.run_total / finished
+                                  if finished else 0.0))
+        stats['run_p50'] = run_times[len(run_times) // 2] if run_times else 0.0
+        stats['run_p95'] = (run_times[int(len(run_times) * 0.95)]
+                            if run_times else 0.0)
+        stats['run_max'] = run_times[-1] if run_times else 0.0
+        return {key: round(value, 4) if isinstance(value, float) else value
+                for key, value in stats.items()}
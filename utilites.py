@@ -1,5 +1,22 @@
 import os
+import hashlib
+import logging
 import tempfile
+import time
+import redis
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 50 * 1024 * 1024))
+# A PDF starts with %PDF- and ends with %%EOF, both within 1024 bytes
+PDF_MAGIC = b'%PDF-'
+PDF_EOF = b'%%EOF'
+PDF_MARKER_WINDOW = 1024
+# Seconds analysis results, and the data stored alongside them, stay in Redis
+RESULT_EXPIRES = int(os.environ.get('RESULT_EXPIRES', 24 * 3600))
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
 
 
 def get_tmp_folder():
@@ -9,3 +26,64 @@ def get_tmp_folder():
         tmp_folder = os.getenv("TMP_CUSTOM_DIR", None)
 
     return tmp_folder
+
+
+def get_redis():
+    """Process-wide Redis client for REDIS_URL, created on first use."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(os.environ['REDIS_URL'],
+                                             socket_connect_timeout=2)
+    return _redis_client
+
+
+class UploadRejected(ValueError):
+    """An upload that is too large or not a PDF; reason is 'size' or 'pdf'."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def save_upload(file, path, max_size=None):
+    """
+    Stream an uploaded PDF to path in chunks, hashing the bytes on the
+    way. Returns the SHA-256 hex digest of the content.
+
+    The %PDF- header is checked as soon as the first bytes arrive, the
+    size as it grows and the %%EOF trailer at the end. A rejected upload
+    raises UploadRejected and leaves no file behind.
+    """
+    max_size = MAX_UPLOAD_SIZE if max_size is None else max_size
+    digest = hashlib.sha256()
+    head, tail, size = b'', b'', 0
+    start = time.perf_counter()
+    try:
+        with open(path, 'wb') as f:
+            for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadRejected(
+                        'size', 'upload exceeds %d bytes' % max_size)
+                if len(head) < PDF_MARKER_WINDOW:
+                    head += chunk[:PDF_MARKER_WINDOW - len(head)]
+                    if (len(head) >= PDF_MARKER_WINDOW and
+                            PDF_MAGIC not in head):
+                        raise UploadRejected('pdf', 'missing %PDF- header')
+                tail = (tail + chunk)[-PDF_MARKER_WINDOW:]
+                digest.update(chunk)
+                f.write(chunk)
+        if PDF_MAGIC not in head:
+            raise UploadRejected('pdf', 'missing %PDF- header')
+        if PDF_EOF not in tail:
+            raise UploadRejected('pdf', 'missing %%EOF trailer')
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    elapsed = time.perf_counter() - start
+    logger.info('ingested %s: %d bytes in %.3fs (%.0f bytes/s)',
+                os.path.basename(path), size, elapsed,
+                size / elapsed if elapsed else 0)
+    return digest.hexdigest()
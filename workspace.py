@@ -0,0 +1,231 @@
+'''
+file: workspace.py
+description: Per-job temporary directories with expiry, quota and metrics
+
+Every upload gets a directory of its own under the temp folder, so two
+uploads of paper.pdf never overwrite each other, and everything a job
+writes (the upload, its download archive) lives and dies together. A
+background sweep removes workspaces unused for WORKSPACE_TTL seconds and
+new jobs are refused while the workspaces use more than WORKSPACE_QUOTA.
+
+The bytes in use and the number of workspaces are kept as running
+totals in Redis, added to when a job saves a file or a workspace is
+created and taken from by removals, so neither creating a workspace nor
+stats() walks the disk. Every sweep walks it anyway and corrects the
+totals.
+'''
+
+import os
+import shutil
+import threading
+import time
+import uuid
+import redis
+import utilites
+
+WORKSPACE_PREFIX = 'job-'
+WORKSPACE_TTL = int(os.environ.get('WORKSPACE_TTL', 24 * 3600))
+WORKSPACE_QUOTA = int(os.environ.get('WORKSPACE_QUOTA', 5 * 1024 ** 3))
+WORKSPACE_SWEEP_INTERVAL = int(os.environ.get('WORKSPACE_SWEEP_INTERVAL', 600))
+
+RECLAIMED_BYTES_KEY = 'workspace:reclaimed:bytes'
+RECLAIMED_COUNT_KEY = 'workspace:reclaimed:count'
+USED_BYTES_PREFIX = 'workspace:bytes:'
+COUNT_PREFIX = 'workspace:count:'
+
+_sweepers = dict()
+_sweepers_lock = threading.Lock()
+
+
+class QuotaExceeded(Exception):
+    ''' Raised by create when the workspaces use up WORKSPACE_QUOTA '''
+
+
+def default_root():
+    return utilites.get_tmp_folder()
+
+
+def workspaces(root):
+    ''' Paths of all job workspaces under root '''
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return []
+    return [entry.path for entry in entries
+            if entry.name.startswith(WORKSPACE_PREFIX) and entry.is_dir()]
+
+
+def usage(path):
+    '''
+    Bytes used below path and the time anything in it last changed,
+    (0, 0) for a workspace removed in the meantime
+    '''
+    try:
+        size, changed = 0, os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0, 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(folder, name))
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            changed = max(changed, stat.st_mtime)
+    return size, changed
+
+
+def disk_use(root):
+    return sum(usage(path)[0] for path in workspaces(root))
+
+
+def used_key(root):
+    return USED_BYTES_PREFIX + os.path.normpath(root)
+
+
+def count_key(root):
+    return COUNT_PREFIX + os.path.normpath(root)
+
+
+def root_of(path):
+    return os.path.dirname(os.path.normpath(path))
+
+
+def used_bytes(root):
+    '''
+    Bytes the workspaces under root use by the running total, measured
+    on disk when there is none yet or Redis is unavailable
+    '''
+    try:
+        r = utilites.get_redis()
+        total = r.get(used_key(root))
+        if total is not None:
+            return int(total)
+        total = disk_use(root)
+        r.set(used_key(root), total, nx=True)
+        return total
+    except redis.RedisError:
+        return disk_use(root)
+
+
+def add_bytes(path, size):
+    ''' Count size bytes a job wrote to the workspace path '''
+    try:
+        utilites.get_redis().incrby(used_key(root_of(path)), size)
+    except redis.RedisError:
+        pass
+
+
+def create(root=None, quota=None):
+    '''
+    New unique workspace directory under root. Expired workspaces are
+    swept first when the quota is reached, QuotaExceeded is raised if
+    that does not free enough room.
+    '''
+    root = root or default_root()
+    quota = WORKSPACE_QUOTA if quota is None else quota
+    start_sweeper(root)
+    if used_bytes(root) >= quota:
+        sweep(root)
+        if used_bytes(root) >= quota:
+            raise QuotaExceeded('workspaces use more than %d bytes' % quota)
+    path = os.path.join(root, WORKSPACE_PREFIX + uuid.uuid4().hex)
+    os.makedirs(path)
+    count_workspaces(root, 1)
+    return path
+
+
+def count_workspaces(root, change):
+    try:
+        utilites.get_redis().incrby(count_key(root), change)
+    except redis.RedisError:
+        pass
+
+
+def count_reclaimed(size):
+    try:
+        pipe = utilites.get_redis().pipeline()
+        pipe.incrby(RECLAIMED_BYTES_KEY, size)
+        pipe.incr(RECLAIMED_COUNT_KEY)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def remove(path):
+    ''' Delete a workspace and everything in it, returns the bytes freed '''
+    if not os.path.basename(path).startswith(WORKSPACE_PREFIX):
+        raise ValueError('%s is not a job workspace' % path)
+    if not os.path.isdir(path):
+        return 0
+    size = usage(path)[0]
+    shutil.rmtree(path, ignore_errors=True)
+    count_reclaimed(size)
+    add_bytes(path, -size)
+    count_workspaces(root_of(path), -1)
+    return size
+
+
+def sweep(root=None, ttl=None, now=None):
+    '''
+    Remove workspaces unchanged for ttl seconds and store the bytes and
+    number of the others as the running totals, returns bytes freed
+    '''
+    root = root or default_root()
+    ttl = WORKSPACE_TTL if ttl is None else ttl
+    now = time.time() if now is None else now
+    reclaimed, kept, count = 0, 0, 0
+    for path in workspaces(root):
+        size, changed = usage(path)
+        if changed and now - changed > ttl:
+            reclaimed += remove(path)
+        else:
+            kept += size
+            count += 1
+    try:
+        pipe = utilites.get_redis().pipeline()
+        pipe.set(used_key(root), kept)
+        pipe.set(count_key(root), count)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    return reclaimed
+
+
+def start_sweeper(root, interval=WORKSPACE_SWEEP_INTERVAL):
+    ''' Sweep root every interval seconds on a daemon thread, once per root '''
+    with _sweepers_lock:
+        if root in _sweepers:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    sweep(root)
+                except OSError:
+                    pass
+
+        _sweepers[root] = threading.Thread(target=run, daemon=True,
+                                           name='workspace-sweeper')
+        _sweepers[root].start()
+
+
+def stats(root=None):
+    '''
+    Running totals of the workspaces and what removals have reclaimed;
+    the disk is only walked when Redis has no totals yet
+    '''
+    root = root or default_root()
+    try:
+        count, reclaimed, removed = utilites.get_redis().mget(
+            count_key(root), RECLAIMED_BYTES_KEY, RECLAIMED_COUNT_KEY)
+    except redis.RedisError:
+        count, reclaimed, removed = None, None, None
+    if count is None:
+        count = len(workspaces(root))
+    return dict(workspaces=int(count),
+                bytes=used_bytes(root),
+                quota=WORKSPACE_QUOTA,
+                reclaimed_bytes=int(reclaimed or 0),
+                reclaimed_workspaces=int(removed or 0))